@@ -11,23 +11,31 @@ if PROJECT_ROOT not in sys.path:
 # =========================================================
 # IMPORTS
 # =========================================================
+import math
+
 import streamlit as st
-import json
 
 from crawler.selenium_crawler import ImprovedSeleniumCrawler
+from indexing.bm25f import BM25F
+from indexing.builder import IndexBuilder
+from indexing.facets import UNKNOWN_YEAR
+from indexing.fields import FIELD_WEIGHTS
 from indexing.inverted_index import AdvancedInvertedIndex
+from utils.helpers import keyed_publications, paginate
+from utils.instrumentation import count, instrumentation, stage, trace
+from utils.jsonl import JsonlWriter
+from evaluation.engine import evaluate, run_queries
 from evaluation.ir_metrics import (
     precision,
     recall,
     f1_score,
-    average_precision,
-    mean_average_precision
+    average_precision
 )
 
 # =========================================================
 # CONFIG
 # =========================================================
-DATA_FILE = "data/publications.json"
+DATA_FILE = "data/publications.jsonl"
 INDEX_FILE = "data/search_index.pkl"
 
 BASE_URL = (
@@ -37,6 +45,11 @@ BASE_URL = (
 
 os.makedirs("data", exist_ok=True)
 
+RESULTS_PER_PAGE = 20
+
+# Values offered per facet next to the results
+FACET_VALUES = 10
+
 # =========================================================
 # GROUND TRUTH (DEMO PURPOSE)
 # =========================================================
@@ -47,45 +60,66 @@ GROUND_TRUTH = {
     "analysis": [0, 1, 3],
 }
 
-# =========================================================
-# LOAD INDEX
-# =========================================================
-index = AdvancedInvertedIndex()
-loaded = index.load(INDEX_FILE)
+
+def relevant_ids(index, query_key):
+    """
+    Ground truth lists positions in crawl order; map them to doc ids
+    """
+    return {
+        index.doc_keys[i] for i in GROUND_TRUTH[query_key]
+        if i < len(index.doc_keys)
+    }
 
 # =========================================================
 # HELPER: STATISTICS
 # =========================================================
-def compute_statistics(index):
-    years = {}
-    authors = set()
-
-    for doc in index.documents.values():
-        year = doc.get("year")
-        if year is None or not str(year).isdigit():
-            year = "N/A"
-        else:
-            year = int(year)
-
-        years[year] = years.get(year, 0) + 1
+def year_label(year):
+    return "N/A" if year == UNKNOWN_YEAR else year
 
-        for a in doc.get("authors", []):
-            authors.add(a)
 
-    sorted_years = dict(
-        sorted(
-            years.items(),
-            key=lambda x: (x[0] == "N/A", -x[0] if isinstance(x[0], int) else 0)
-        )
-    )
+def compute_statistics(index):
+    """
+    Sidebar figures from the facet columns; no stored document is read
+    """
+    stats = index.facets.statistics()
 
     return {
-        "total_docs": len(index.documents),
+        "total_docs": stats["total_docs"],
         "unique_terms": len(index.index),
-        "total_authors": len(authors),
-        "years": sorted_years
+        "total_authors": stats["total_authors"],
+        "years": {year_label(y): c for y, c in stats["years"].items()}
     }
 
+# =========================================================
+# LOAD INDEX (SHARED ACROSS SESSIONS AND RERUNS)
+# =========================================================
+def index_version(path):
+    """
+    Cache key for the index file; changes whenever it is rewritten
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@st.cache_resource(max_entries=1, show_spinner="Loading index…")
+def load_index(path, version):
+    index = AdvancedInvertedIndex()
+    loaded = index.load(path)
+    stats = compute_statistics(index) if loaded and index.documents else None
+    return index, loaded, stats
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def ranked_doc_ids(_index, version, generation, query, bm25f, filters):
+    """
+    Every matching doc id, best first, for scoring against the ground
+    truth; paging and other reruns reuse it until the index changes
+    """
+    return [hit.doc_id for hit in _index.search(query, bm25f=bm25f, filters=filters)]
+
 # =========================================================
 # STREAMLIT PAGE
 # =========================================================
@@ -97,6 +131,8 @@ st.set_page_config(
 st.title("🎓 Coventry University – Research Search Engine")
 st.caption("Vertical Search Engine | PurePortal Publications Only")
 
+index, loaded, stats = load_index(INDEX_FILE, index_version(INDEX_FILE))
+
 if not loaded:
     st.warning("Index not found or invalid. Please run the crawler.")
 
@@ -114,45 +150,88 @@ max_authors = st.sidebar.slider(
     step=5
 )
 
-# -------- RUN CRAWLER --------
-if st.sidebar.button("🕷️ Run Selenium Crawler"):
-    st.sidebar.info("Crawling in progress… please wait")
+# -------- PARALLEL BROWSERS --------
+crawl_workers = st.sidebar.slider(
+    "Parallel Browsers",
+    min_value=1,
+    max_value=8,
+    value=4
+)
 
-    crawler = ImprovedSeleniumCrawler()
-    publications = crawler.crawl_department(
-        BASE_URL,
-        max_authors=max_authors
-    )
+# -------- RANKING --------
+ranking = st.sidebar.radio("Ranking", ["TF-IDF (cosine)", "BM25F"])
 
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(publications, f, indent=2)
+bm25f = None
+if ranking == "BM25F":
+    with st.sidebar.expander("BM25F parameters"):
+        k1 = st.slider("k1", 0.0, 3.0, 1.2, 0.1)
+        b = st.slider("b", 0.0, 1.0, 0.75, 0.05)
+        field_weights = {
+            field: st.slider(f"{field.title()} weight", 0.0, 5.0, weight, 0.5)
+            for field, weight in FIELD_WEIGHTS.items()
+        }
+    bm25f = BM25F(field_weights, k1=k1, b=b)
 
-    index = AdvancedInvertedIndex()
-    for i, pub in enumerate(publications):
-        index.add_document(i, pub)
+# -------- RUN CRAWLER --------
+if st.sidebar.button("🕷️ Run Selenium Crawler"):
+    st.sidebar.info("Crawling in progress… please wait")
 
-    index.finalize()
-    index.save(INDEX_FILE)
+    with trace("update", max_authors=max_authors, workers=crawl_workers):
+        crawler = ImprovedSeleniumCrawler(workers=crawl_workers)
+
+        # Re-index only new, changed and removed publications. Each one
+        # is written to DATA_FILE and indexed as soon as it is parsed,
+        # while the crawl workers fetch the next pages; removals are
+        # applied once the crawl has finished. Without an index to
+        # update, it is built from scratch across worker processes.
+        updater = AdvancedInvertedIndex(positions=True)
+        rebuild = not updater.load(INDEX_FILE)
+        with JsonlWriter(DATA_FILE) as writer:
+            publications = keyed_publications(writer.tee(crawler.iter_department(
+                BASE_URL,
+                max_authors=max_authors
+            )))
+            # The new segment is renamed into place, so sessions still
+            # searching the cached index keep their mapping of the old
+            # file; dropping the cache makes every session load the new one
+            if rebuild:
+                updater = IndexBuilder(positions=True).build(publications, INDEX_FILE)
+                added, updated, deleted = len(updater.documents), 0, 0
+            else:
+                added, updated, deleted = updater.sync_documents(publications)
+                # Recompute idf and every norm, not only those of the
+                # changed documents, so rankings match a full rebuild
+                updater.finalize()
+                updater.save(INDEX_FILE)
+        count("publications_crawled", writer.count)
+
+        load_index.clear()
+
+    index, loaded, stats = load_index(INDEX_FILE, index_version(INDEX_FILE))
 
-    st.sidebar.success(f"Indexed {len(publications)} publications")
+    st.sidebar.success(
+        f"Indexed {writer.count} publications "
+        f"({added} new, {updated} updated, {deleted} removed)"
+    )
 
 # -------- MAP --------
 if st.sidebar.button("📊 Evaluate MAP"):
-    ap_scores = []
-    for q, rel_docs in GROUND_TRUTH.items():
-        results = index.search(q)
-        retrieved_ids = [doc_id for doc_id, _, _ in results]
-        ap_scores.append(average_precision(retrieved_ids, set(rel_docs)))
+    qrels = {
+        q: {str(doc_id): 1 for doc_id in relevant_ids(index, q)}
+        for q in GROUND_TRUTH
+    }
+    run = run_queries(index, {q: q for q in GROUND_TRUTH}, depth=None, bm25f=bm25f)
+    scores = evaluate(qrels, run, cutoffs=(10,)).mean()
 
     st.sidebar.success(
-        f"MAP Score: {mean_average_precision(ap_scores):.3f}"
+        f"MAP Score: {scores['map']:.3f} | "
+        f"nDCG@10: {scores['ndcg@10']:.3f} | MRR: {scores['mrr']:.3f}"
     )
 
 # -------- STATISTICS --------
 st.sidebar.markdown("## 📊 Statistics")
 
-if index.documents:
-    stats = compute_statistics(index)
+if stats:
     st.sidebar.metric("Publications", stats["total_docs"])
     st.sidebar.metric("Unique Terms", stats["unique_terms"])
     st.sidebar.metric("Authors", stats["total_authors"])
@@ -170,18 +249,57 @@ st.markdown("## 🔍 Search Publications")
 
 query = st.text_input(
     "Enter keywords",
-    placeholder="Try: modelling, computational, analysis"
+    placeholder='Try: modelling, "mathematical modelling", fluid NEAR/3 dynamics',
+    help=(
+        'Combine terms with AND, OR, NOT and parentheses; restrict them '
+        'with author:, title:, keywords:, abstract: or year:, e.g. '
+        '`author:smith year:2020..2023 (fluid OR gas) AND NOT survey`'
+    )
 )
 
 if query:
-    results = index.search(query)
+    # -------- FACETS --------
+    facet_counts = index.facet_counts(query, limit=FACET_VALUES)
+    year_counts = dict(facet_counts["year"])
+    author_counts = dict(facet_counts["authors"])
+
+    col_year, col_author = st.columns(2)
+    filters = {
+        "year": col_year.multiselect(
+            "Year", list(year_counts),
+            format_func=lambda y: f"{year_label(y)} ({year_counts[y]})"
+        ),
+        "authors": col_author.multiselect(
+            "Author", list(author_counts),
+            format_func=lambda a: f"{a} ({author_counts[a]})"
+        ),
+    }
+
+    results = index.search(
+        query, k=RESULTS_PER_PAGE, bm25f=bm25f, filters=filters
+    )
 
     if not results:
         st.warning("No results found.")
     else:
-        st.success(f"Found {len(results)} results")
+        st.success(f"Found {results.total_hits} results")
 
-        for rank, (doc_id, doc, score) in enumerate(results[:20], start=1):
+        # -------- PAGINATION --------
+        pages = max(1, math.ceil(results.total_hits / RESULTS_PER_PAGE))
+        page = st.number_input(
+            f"Page (of {pages})", min_value=1, max_value=pages, value=1
+        )
+        if page > 1:
+            # Only rank as deep as the requested page
+            results = index.search(
+                query, k=page * RESULTS_PER_PAGE, bm25f=bm25f, filters=filters
+            )
+
+        page_hits = paginate(results, page, RESULTS_PER_PAGE)
+        page_docs = results.documents(page_hits)
+        first_rank = (page - 1) * RESULTS_PER_PAGE + 1
+
+        for rank, (hit, doc) in enumerate(zip(page_hits, page_docs), start=first_rank):
 
             col_main, col_side = st.columns([4, 1])
 
@@ -199,7 +317,7 @@ if query:
 
                 st.write(
                     f"**Year:** {doc.get('year','N/A')} | "
-                    f"**Score:** {round(score,3)}"
+                    f"**Score:** {round(hit.score,3)}"
                 )
 
                 abstract = doc.get("abstract", "")
@@ -236,8 +354,11 @@ if query:
         )
 
         if matched:
-            rel = set(GROUND_TRUTH[matched])
-            ret = [doc_id for doc_id, _, _ in results]
+            rel = relevant_ids(index, matched)
+            ret = ranked_doc_ids(
+                index, index_version(INDEX_FILE), index.generation,
+                query, bm25f, filters,
+            )
 
             tp = len(set(ret) & rel)
             fp = len(set(ret) - rel)
@@ -263,6 +384,60 @@ if query:
         else:
             st.sidebar.info("No ground truth for this query.")
 
+# =========================================================
+# DIAGNOSTICS (OPT-IN TIMINGS)
+# =========================================================
+with st.sidebar.expander("🩺 Diagnostics"):
+    record = st.checkbox(
+        "Record timings", value=instrumentation.enabled,
+        help="Time every search, crawl and index update in this server process"
+    )
+    if record and not instrumentation.enabled:
+        instrumentation.enable()
+    elif not record and instrumentation.enabled:
+        instrumentation.disable()
+
+    if index.cache is not None:
+        st.markdown("**Result cache**")
+        st.json(index.cache.stats())
+
+    snapshot = instrumentation.snapshot()
+    if snapshot["events"] or snapshot["stages"]:
+        st.markdown("**Operations**")
+        st.dataframe([{"name": n, **s} for n, s in snapshot["events"].items()])
+        st.markdown("**Stages**")
+        st.dataframe([{"name": n, **s} for n, s in snapshot["stages"].items()])
+        st.markdown("**Counters**")
+        st.json(snapshot["counters"])
+
+        name = st.selectbox(
+            "Histogram", list(snapshot["events"]) + list(snapshot["stages"])
+        )
+        distribution = instrumentation.distribution(name)
+        st.bar_chart(
+            {
+                "≤ ms": [f"{upper:g}" for upper, _ in distribution],
+                "count": [n for _, n in distribution],
+            },
+            x="≤ ms", y="count",
+        )
+
+        st.markdown("**Slowest recent searches**")
+        st.dataframe([
+            {
+                "query": r.get("query"),
+                "ms": round(r["duration_ms"], 2),
+                **{s: round(ms, 2) for s, ms in r["stages"].items()},
+                **r["counters"],
+            }
+            for r in instrumentation.slowest("search")
+        ])
+
+        if st.button("Reset timings"):
+            instrumentation.reset()
+    elif record:
+        st.caption("No timings recorded yet.")
+
 # =========================================================
 # FOOTER
 # =========================================================
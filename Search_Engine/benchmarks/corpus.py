@@ -0,0 +1,153 @@
+"""
+Synthetic PurePortal-like publication corpus for benchmarks.
+
+Words are drawn from a Zipf distribution over a vocabulary that starts
+with stopwords and common research terms and continues with generated
+words, so posting list lengths follow the long tail of real text.
+Authors are Zipf distributed too (a few prolific authors, many with one
+paper); title, abstract and author list lengths vary per document and
+years lean towards recent ones. The same seed always gives the same
+corpus, so runs are comparable.
+"""
+
+import random
+from itertools import accumulate
+
+
+COMMON_WORDS = (
+    "the of and in to for with on by from is are this that as an at be "
+    "data model analysis learning system method network based approach "
+    "study using research mathematical modelling computational simulation "
+    "fluid dynamics numerical optimization algorithm framework performance "
+    "control stochastic process theory graph design evaluation prediction "
+    "neural deep machine health social education energy engineering "
+    "statistical structure dynamic problem application results efficient "
+    "novel robust estimation distributed parallel complex multi scale flow "
+    "equation finite element nonlinear linear quantum signal image time "
+    "series classification clustering regression uncertainty security "
+    "privacy sustainable urban climate policy community development impact"
+).split()
+
+SYLLABLES = (
+    "al an ar ba be bi ca ce ci co da de di do el en er fa fe fi ga ge "
+    "go ha he hi in is ka ke la le li lo ma me mi mo na ne ni no or pa "
+    "pe pi po ra re ri ro sa se si so ta te ti to tra tri un va ve vi za"
+).split()
+
+FIRST_NAMES = (
+    "James Mary Robert Patricia John Jennifer Michael Linda David Sarah "
+    "Wei Li Mohammed Fatima Olga Ivan Aisha Ravi Priya Chen Yuki Kenji "
+    "Ana Carlos Sofia Lucas Emma Noah Amara Kwame"
+).split()
+
+ZIPF_EXPONENT = 1.05
+
+YEARS = list(range(2000, 2026))
+
+# Share of documents without a year, abstract or keywords
+MISSING_YEAR = 0.05
+MISSING_ABSTRACT = 0.15
+MISSING_KEYWORDS = 0.4
+
+
+def _zipf_cum_weights(n, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def make_vocabulary(size, seed=0):
+    """
+    COMMON_WORDS followed by generated words, size words in all
+    """
+    rng = random.Random(seed)
+    words = list(COMMON_WORDS[:size])
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def make_authors(size, seed=0):
+    rng = random.Random(seed)
+    surnames = make_vocabulary(size + len(COMMON_WORDS), seed + 1)[len(COMMON_WORDS):]
+    return [
+        f"{rng.choice(FIRST_NAMES)} {surname.capitalize()}"
+        for surname in surnames
+    ]
+
+
+class SyntheticCorpus:
+    """
+    Iterable of (doc_id, publication) pairs in the crawler's format plus
+    abstract and keywords. Nothing is held in memory beyond the
+    vocabulary, so millions of documents can be streamed.
+    """
+
+    def __init__(self, num_docs, vocabulary_size=None, num_authors=None, seed=0):
+        self.num_docs = num_docs
+        self.seed = seed
+
+        # Vocabulary grows sublinearly with the corpus (Heaps' law)
+        if vocabulary_size is None:
+            vocabulary_size = max(2000, int(40 * num_docs ** 0.6))
+        if num_authors is None:
+            num_authors = max(50, num_docs // 4)
+
+        self.vocabulary = make_vocabulary(vocabulary_size, seed)
+        self.authors = make_authors(num_authors, seed)
+        self._word_weights = _zipf_cum_weights(len(self.vocabulary))
+        self._author_weights = _zipf_cum_weights(len(self.authors), 0.8)
+        self._year_weights = list(accumulate(
+            1.1 ** i for i in range(len(YEARS))
+        ))
+
+    def __len__(self):
+        return self.num_docs
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for n in range(self.num_docs):
+            yield f"pub{n:08d}", self._publication(rng, n)
+
+    def _words(self, rng, count):
+        return " ".join(rng.choices(
+            self.vocabulary, cum_weights=self._word_weights, k=count
+        ))
+
+    def _publication(self, rng, n):
+        authors = rng.choices(
+            self.authors, cum_weights=self._author_weights,
+            k=min(12, 1 + int(rng.expovariate(0.5))),
+        )
+        publication = {
+            "title": self._words(rng, rng.randint(5, 16)).capitalize(),
+            "authors": list(dict.fromkeys(authors)),
+            "year": None,
+            "publication_link": f"https://pureportal.example/en/publications/pub{n:08d}/",
+            "profile_link": f"https://pureportal.example/en/persons/{authors[0].lower().replace(' ', '-')}/",
+        }
+        if rng.random() >= MISSING_YEAR:
+            publication["year"] = rng.choices(YEARS, cum_weights=self._year_weights)[0]
+        if rng.random() >= MISSING_ABSTRACT:
+            length = min(400, int(rng.lognormvariate(5.0, 0.35)))
+            publication["abstract"] = self._words(rng, length)
+        if rng.random() >= MISSING_KEYWORDS:
+            publication["keywords"] = self._words(rng, rng.randint(2, 6)).split()
+        return publication
+
+    def queries(self, num_queries, seed=None):
+        """
+        Plain 1-3 term queries. Terms come from below the stopwords and
+        most frequent words, weighted towards the head as user queries
+        are, so both common and rare postings get exercised.
+        """
+        rng = random.Random(self.seed + 1 if seed is None else seed)
+        start = min(20, len(self.vocabulary) - 1)
+        terms = self.vocabulary[start:]
+        weights = _zipf_cum_weights(len(terms), 0.9)
+        return [
+            " ".join(rng.choices(terms, cum_weights=weights, k=rng.choice((1, 2, 2, 3))))
+            for _ in range(num_queries)
+        ]
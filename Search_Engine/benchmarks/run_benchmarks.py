@@ -0,0 +1,272 @@
+"""
+Index and search benchmarks over a synthetic corpus.
+
+    python -m benchmarks.run_benchmarks --docs 100000 --output run.json
+    python -m benchmarks.run_benchmarks --docs 100000 --baseline run.json
+
+For each index implementation it times add_document (per document),
+finalize, save and load, and search latency percentiles and throughput
+on the index as built and as loaded, then rebuilds the index under
+tracemalloc for its peak memory. Results are written as JSON; with
+--baseline, metrics that got worse by more than --tolerance are listed
+and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks.corpus import SyntheticCorpus
+from indexing import sparse_backend
+from indexing.inverted_index import AdvancedInvertedIndex
+from indexing.inverted_index2 import AdvancedInvertedIndex as SimpleInvertedIndex
+
+
+FORMAT_VERSION = 1
+
+PERCENTILES = (50, 90, 95, 99)
+
+# name -> (index factory, file name used by save/load). The result
+# cache is disabled so repeated queries are scored every time.
+IMPLEMENTATIONS = {
+    "inverted_index": (lambda: AdvancedInvertedIndex(cache_size=0), "index.seg"),
+    "inverted_index2": (SimpleInvertedIndex, "index.pkl"),
+}
+if sparse_backend.AVAILABLE:
+    IMPLEMENTATIONS["inverted_index_sparse"] = (
+        lambda: AdvancedInvertedIndex(backend="sparse", cache_size=0), "index.seg"
+    )
+
+# Metrics where a larger value is an improvement; for all other
+# numbers smaller is better
+HIGHER_IS_BETTER = ("per_second",)
+
+# Not compared against a baseline: sizes of the run, and single worst
+# timings, which are too noisy to flag
+NOT_COMPARED = (".count", ".max_ms")
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of ascending values
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(seconds):
+    """
+    Per-operation timings (seconds) -> milliseconds summary
+    """
+    values = sorted(seconds)
+    total = sum(values)
+    summary = {
+        "count": len(values),
+        "total_s": total,
+        "mean_ms": 1000 * total / len(values) if values else None,
+        "max_ms": 1000 * values[-1] if values else None,
+        "per_second": len(values) / total if total else None,
+    }
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f"p{p}_ms"] = None if value is None else 1000 * value
+    return summary
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# -------------------------------------------------
+# MEASUREMENTS
+# -------------------------------------------------
+def build(factory, corpus):
+    """
+    (index, per-document add_document timings, finalize seconds or None)
+    """
+    index = factory()
+    add_times = []
+    clock = time.perf_counter
+    for doc_id, doc_data in corpus:
+        start = clock()
+        index.add_document(doc_id, doc_data)
+        add_times.append(clock() - start)
+
+    finalize_s = None
+    if hasattr(index, "finalize"):
+        _, finalize_s = timed(index.finalize)
+    return index, add_times, finalize_s
+
+
+def search_latencies(index, queries, k):
+    latencies = []
+    clock = time.perf_counter
+    for query in queries:
+        start = clock()
+        index.search(query, k=k)
+        latencies.append(clock() - start)
+    return latency_summary(latencies)
+
+
+def peak_build_memory(factory, corpus):
+    """
+    Peak traced allocation (bytes) while building the index; the
+    corpus generator's own allocations are included but small
+    """
+    tracemalloc.start()
+    try:
+        index, _, _ = build(factory, corpus)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del index
+    return peak
+
+
+def benchmark(name, corpus, queries, k, directory, memory=True):
+    factory, filename = IMPLEMENTATIONS[name]
+    path = os.path.join(directory, filename)
+
+    index, add_times, finalize_s = build(factory, corpus)
+    result = {
+        "add_document": latency_summary(add_times),
+        "finalize_s": finalize_s,
+        "search": search_latencies(index, queries, k),
+    }
+
+    _, result["save_s"] = timed(index.save, path)
+    result["index_bytes"] = os.path.getsize(path)
+
+    loaded = factory()
+    _, result["load_s"] = timed(loaded.load, path)
+    result["search_loaded"] = search_latencies(loaded, queries, k)
+
+    for opened in (index, loaded):
+        if hasattr(opened, "close"):
+            opened.close()
+    del index, loaded
+
+    if memory:
+        result["peak_build_bytes"] = peak_build_memory(factory, corpus)
+    return result
+
+
+# -------------------------------------------------
+# REGRESSION CHECK
+# -------------------------------------------------
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def regressions(current, baseline, tolerance):
+    """
+    [(metric, baseline value, current value)] for metrics at least
+    tolerance (a fraction) worse than in baseline
+    """
+    old = dict(_flatten(baseline["results"]))
+    found = []
+    for metric, value in _flatten(current["results"]):
+        before = old.get(metric)
+        if not before or metric.endswith(NOT_COMPARED):
+            continue
+        change = (value - before) / before
+        if metric.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            found.append((metric, before, value))
+    return found
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10,
+                        help="results per query; 0 ranks every match")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--implementations", nargs="+",
+                        choices=sorted(IMPLEMENTATIONS), default=sorted(IMPLEMENTATIONS))
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc rebuild")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    corpus = SyntheticCorpus(args.docs, seed=args.seed)
+    queries = corpus.queries(args.queries)
+    k = args.k or None
+
+    run = {
+        "version": FORMAT_VERSION,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {
+            "docs": args.docs, "queries": args.queries, "k": k,
+            "seed": args.seed, "vocabulary": len(corpus.vocabulary),
+        },
+        "results": {},
+    }
+
+    directory = tempfile.mkdtemp(prefix="search-bench-")
+    try:
+        for name in args.implementations:
+            print(f"{name}: {args.docs} documents, {args.queries} queries", file=sys.stderr)
+            run["results"][name] = benchmark(
+                name, corpus, queries, k, directory, memory=not args.no_memory
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(run, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != run["params"]:
+            print("warning: baseline was run with different parameters", file=sys.stderr)
+        found = regressions(run, baseline, args.tolerance)
+        for metric, before, after in found:
+            print(f"REGRESSION {metric}: {before:.6g} -> {after:.6g}", file=sys.stderr)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
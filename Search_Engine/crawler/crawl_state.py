@@ -0,0 +1,324 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from utils.helpers import make_doc_id, publication_content
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    fetched_at TEXT
+);
+CREATE TABLE IF NOT EXISTS publications (
+    profile_url TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile_url, doc_id)
+);
+CREATE INDEX IF NOT EXISTS publications_doc_id ON publications (doc_id);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS run_pages (
+    run_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (run_id, url)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL,
+    doc_id TEXT NOT NULL,
+    change TEXT NOT NULL,
+    data TEXT
+);
+"""
+
+
+def page_hash(html):
+    return hashlib.sha1(html.encode("utf-8")).hexdigest()
+
+
+def content_hash(publication):
+    encoded = json.dumps(
+        publication_content(publication), sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class CrawlStateStore:
+    """
+    Persistent crawl state in SQLite.
+
+    Records per-URL validators and content hashes, the publications last
+    seen on each author profile, and the changes a crawl run produced.
+    A run stays open until finish_run(), so a crawl that dies halfway
+    resumes where it stopped and its changes are not lost.
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+        self.validators = _ValidatorView(self)
+
+    def close(self):
+        self._conn.close()
+
+    # -------------------------------------------------
+    # RUNS
+    # -------------------------------------------------
+    def begin_run(self):
+        """
+        Return the unfinished run if there is one, else start a new run
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT run_id FROM runs WHERE finished_at IS NULL "
+                "ORDER BY run_id DESC LIMIT 1"
+            ).fetchone()
+            if row:
+                return row[0]
+
+            cursor = self._conn.execute(
+                "INSERT INTO runs (started_at) VALUES (?)",
+                (datetime.now().isoformat(),)
+            )
+            return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        """
+        Close the run once its changes have been applied to the index
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE runs SET finished_at = ? WHERE run_id = ?",
+                (datetime.now().isoformat(), run_id)
+            )
+            self._conn.execute("DELETE FROM run_pages WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM changes WHERE run_id = ?", (run_id,))
+
+    def is_done(self, run_id, url):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM run_pages WHERE run_id = ? AND url = ?",
+                (run_id, url)
+            ).fetchone() is not None
+
+    def mark_done(self, run_id, url, page=None):
+        """
+        Mark url done in the run, storing page's validators and content
+        hash in the same transaction when given
+        """
+        with self._lock, self._conn:
+            if page is not None and not page.not_modified:
+                self._store_page(page)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO run_pages (run_id, url) VALUES (?, ?)",
+                (run_id, url)
+            )
+
+    # -------------------------------------------------
+    # PAGES
+    # -------------------------------------------------
+    def page_changed(self, url, html):
+        """
+        False if html matches the content hash stored for url. Nothing
+        is written: the hash is stored by record_profile() or mark_done()
+        once the page has been processed.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        return row is None or row[0] != page_hash(html)
+
+    def _store_page(self, page):
+        self._conn.execute(
+            "INSERT INTO pages (url, etag, last_modified, content_hash, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET "
+            "etag = excluded.etag, last_modified = excluded.last_modified, "
+            "content_hash = excluded.content_hash, fetched_at = excluded.fetched_at",
+            (page.url, page.etag, page.last_modified, page_hash(page.html),
+             datetime.now().isoformat())
+        )
+
+    # -------------------------------------------------
+    # PUBLICATIONS AND CHANGES
+    # -------------------------------------------------
+    def record_profile(self, run_id, profile_url, publications, page=None):
+        """
+        Replace the publications stored for profile_url, queue the
+        added/updated/removed ones as changes, store the fetched page's
+        validators and content hash and mark the page done, all in one
+        transaction. Returns the number of changes.
+        """
+        current = {make_doc_id(p): p for p in publications}
+
+        with self._lock, self._conn:
+            previous = dict(self._conn.execute(
+                "SELECT doc_id, content_hash FROM publications WHERE profile_url = ?",
+                (profile_url,)
+            ).fetchall())
+
+            changes = []
+            for doc_id, publication in current.items():
+                digest = content_hash(publication)
+                if previous.get(doc_id) == digest:
+                    continue
+
+                change = "updated" if doc_id in previous else "added"
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO publications "
+                    "(profile_url, doc_id, content_hash, data) VALUES (?, ?, ?, ?)",
+                    (profile_url, doc_id, digest, json.dumps(publication))
+                )
+                # Another profile's copy of a shared publication is the
+                # one indexed, whichever profile was crawled first
+                owner_url, _ = self._owner(doc_id)
+                if owner_url == profile_url:
+                    changes.append((doc_id, change, publication))
+
+            for doc_id in previous.keys() - current.keys():
+                self._conn.execute(
+                    "DELETE FROM publications WHERE profile_url = ? AND doc_id = ?",
+                    (profile_url, doc_id)
+                )
+                changes.extend(self._removal(doc_id, profile_url))
+
+            self._conn.executemany(
+                "INSERT INTO changes (run_id, doc_id, change, data) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, doc_id, change, json.dumps(pub) if pub else None)
+                    for doc_id, change, pub in changes
+                ]
+            )
+            if page is not None:
+                self._store_page(page)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO run_pages (run_id, url) VALUES (?, ?)",
+                (run_id, profile_url)
+            )
+
+        return len(changes)
+
+    def prune_profiles(self, run_id, keep_urls):
+        """
+        Remove publications of profiles no longer listed on the
+        department page. Returns the number of changes.
+        """
+        keep_urls = set(keep_urls)
+        with self._lock, self._conn:
+            stale = [
+                url for (url,) in self._conn.execute(
+                    "SELECT DISTINCT profile_url FROM publications"
+                ).fetchall()
+                if url not in keep_urls
+            ]
+
+            changes = []
+            for url in stale:
+                doc_ids = [d for (d,) in self._conn.execute(
+                    "SELECT doc_id FROM publications WHERE profile_url = ?", (url,)
+                ).fetchall()]
+                self._conn.execute(
+                    "DELETE FROM publications WHERE profile_url = ?", (url,)
+                )
+                for doc_id in doc_ids:
+                    changes.extend(self._removal(doc_id, url))
+
+            self._conn.executemany(
+                "INSERT INTO changes (run_id, doc_id, change, data) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, doc_id, change, json.dumps(pub) if pub else None)
+                    for doc_id, change, pub in changes
+                ]
+            )
+
+        return len(changes)
+
+    def _owner(self, doc_id):
+        """
+        (profile_url, data) of the stored copy of a publication that is
+        indexed: the one on the lowest profile URL, as in publications()
+        """
+        return self._conn.execute(
+            "SELECT profile_url, data FROM publications WHERE doc_id = ? "
+            "ORDER BY profile_url LIMIT 1", (doc_id,)
+        ).fetchone()
+
+    def _removal(self, doc_id, profile_url):
+        # A publication shared by several authors stays while any
+        # profile still lists it, as the next profile's copy if
+        # profile_url's was the indexed one
+        owner = self._owner(doc_id)
+        if owner is None:
+            return [(doc_id, "removed", None)]
+        if owner[0] > profile_url:
+            return [(doc_id, "updated", json.loads(owner[1]))]
+        return []
+
+    def pending_changes(self):
+        """
+        Net change per doc_id across all unfinished runs, in the order
+        they were recorded: (doc_id, change, publication or None)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.doc_id, c.change, c.data FROM changes c "
+                "JOIN runs r ON r.run_id = c.run_id "
+                "WHERE r.finished_at IS NULL ORDER BY c.seq"
+            ).fetchall()
+
+        latest = {}
+        for doc_id, change, data in rows:
+            latest.pop(doc_id, None)
+            latest[doc_id] = (change, json.loads(data) if data else None)
+
+        return [(doc_id, change, pub) for doc_id, (change, pub) in latest.items()]
+
+    def publications(self):
+        """
+        Every stored publication, one per doc_id
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, data FROM publications ORDER BY profile_url, doc_id"
+            ).fetchall()
+
+        seen = {}
+        for doc_id, data in rows:
+            seen.setdefault(doc_id, json.loads(data))
+        return list(seen.values())
+
+
+class _ValidatorView:
+    """
+    Read-only view of page validators for HttpFetcher (created with
+    save_validators=False; they are stored with the page's
+    publications). Page bodies are not persisted, so a 304 comes back
+    with html=None.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, url):
+        with self._store._lock:
+            row = self._store._conn.execute(
+                "SELECT etag, last_modified FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or not any(row):
+            return None
+        return (row[0], row[1], None)
@@ -0,0 +1,181 @@
+import threading
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# html is the page body; not_modified is True when a conditional GET
+# returned 304 and html is the previously fetched body. etag and
+# last_modified are the response's validators, if any.
+# Every fetcher's fetch(url, required=None, conditional=True) returns a
+# Page; required is a completeness predicate only FallbackFetcher acts on,
+# conditional=False asks HttpFetcher for the full body regardless of
+# stored validators.
+Page = namedtuple(
+    "Page", ["url", "html", "status", "not_modified", "etag", "last_modified"],
+    defaults=(None, None),
+)
+
+USER_AGENT = "CoventrySearchEngineBot/1.0 (+research crawler)"
+
+
+class FetchError(Exception):
+    pass
+
+
+class HttpFetcher:
+    """
+    Plain HTTP fetcher for server-rendered pages.
+
+    Uses one pooled keep-alive session and remembers ETag/Last-Modified
+    validators per URL, so refetching an unchanged page is a 304 with no
+    body transferred.
+    """
+
+    def __init__(self, rate_limiter=None, pool_size=10, timeout=30, retries=2,
+                 validators=None, save_validators=True):
+        """
+        :param validators: dict-like url -> (etag, last_modified, html)
+            store, e.g. CrawlStateStore.validators; html may be None, in
+            which case a 304 is returned without a body
+        :param save_validators: store each response's validators in
+            validators. False leaves that to the caller, which gets them
+            on the Page (CrawlStateStore saves them with the page's
+            publications, so a crash in between cannot skip the page
+            on the next run).
+        """
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.save_validators = save_validators
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=0.5,
+                              status_forcelist=(429, 502, 503, 504)),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # url -> (etag, last_modified, html)
+        self.validators = {} if validators is None else validators
+        self._lock = threading.Lock()
+
+    def fetch(self, url, required=None, conditional=True):
+        with self._lock:
+            cached = self.validators.get(url) if conditional else None
+
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire(url)
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as exc:
+            raise FetchError(f"{url}: {exc}") from exc
+
+        if response.status_code == 304 and cached:
+            return Page(url, cached[2], 304, True, cached[0], cached[1])
+
+        if response.status_code != 200:
+            raise FetchError(f"{url}: HTTP {response.status_code}")
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if self.save_validators and (etag or last_modified):
+            with self._lock:
+                self.validators[url] = (etag, last_modified, response.text)
+
+        return Page(url, response.text, 200, False, etag, last_modified)
+
+    def close(self):
+        self.session.close()
+
+
+class SeleniumFetcher:
+    """
+    Headless browser fetcher for pages that need JavaScript.
+
+    Each calling thread gets its own driver from driver_factory, created
+    on first use, so a pool of crawl workers is a pool of browsers.
+    """
+
+    def __init__(self, driver_factory, rate_limiter=None):
+        self.driver_factory = driver_factory
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    def _driver(self):
+        driver = getattr(self._local, "driver", None)
+        if driver is None:
+            driver = self._local.driver = self.driver_factory()
+            with self._lock:
+                self._drivers.append(driver)
+        return driver
+
+    def fetch(self, url, required=None, conditional=True):
+        driver = self._driver()
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire(url)
+
+        try:
+            driver.get(url)
+        except Exception as exc:
+            raise FetchError(f"{url}: {exc}") from exc
+
+        return Page(url, driver.page_source, 200, False)
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            driver.quit()
+        self._local = threading.local()
+
+
+class FallbackFetcher:
+    """
+    Try the cheap fetcher first and use the fallback only when the page
+    fails to load or lacks the content the caller requires.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def fetch(self, url, required=None, conditional=True):
+        """
+        :param required: predicate on the html; False means the primary
+            response is incomplete (e.g. rendered client-side)
+        """
+        page = None
+        try:
+            page = self.primary.fetch(url, conditional=conditional)
+            if page.not_modified or required is None or required(page.html):
+                return page
+        except FetchError:
+            pass
+
+        rendered = self.fallback.fetch(url)
+        if page is not None:
+            # The validators still describe the primary's response
+            rendered = rendered._replace(etag=page.etag, last_modified=page.last_modified)
+        return rendered
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
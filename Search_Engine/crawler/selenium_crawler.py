@@ -1,106 +1,21 @@
-import time
+import queue
 import re
+import threading
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
 from datetime import datetime
 
+from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 
+from crawler.fetchers import FallbackFetcher, HttpFetcher, SeleniumFetcher
+from crawler.rate_limiter import HostRateLimiter
 
-class ImprovedSeleniumCrawler:
-    """
-    Selenium-based crawler for Coventry PurePortal
-    """
-
-    def __init__(self, crawl_delay=2):
-        """
-        :param crawl_delay: seconds to wait between requests (polite crawling)
-        """
-        self.driver = None
-        self.crawl_delay = crawl_delay
-        self.seen_titles = set()
-
-    def init_driver(self):
-        options = Options()
-        options.add_argument("--headless=new")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--no-sandbox")
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=options)
-
-    def crawl_department(self, base_url, max_authors=20):
-        self.init_driver()
-        publications = []
-
-        # ---------- Load department page ----------
-        self.driver.get(base_url)
-        time.sleep(self.crawl_delay)
-
-        soup = BeautifulSoup(self.driver.page_source, "html.parser")
-
-        # ---------- Extract author profile links ----------
-        author_links = list({
-            urljoin(base_url, a["href"])
-            for a in soup.find_all("a", href=True)
-            if "/en/persons/" in a["href"]
-        })[:max_authors]
-
-        # ---------- Crawl each author ----------
-        for profile_url in author_links:
-            self.driver.get(profile_url)
-            time.sleep(self.crawl_delay)
-
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
-
-            name_tag = soup.find("h1")
-            author_name = name_tag.get_text(strip=True) if name_tag else "Unknown Author"
-
-            # ---------- Extract publications ----------
-            for pub in soup.find_all("a", href=re.compile("/en/publications/")):
-                title = pub.get_text(strip=True)
 
-                # Deduplication
-                if title.lower() in self.seen_titles:
-                    continue
-                self.seen_titles.add(title.lower())
-
-                container_text = pub.parent.get_text(" ")
-
-                # Year extraction
-                year_match = re.search(r"(19|20)\d{2}", container_text)
-                year = int(year_match.group()) if year_match else None
-
-                # Co-authors
-                co_authors = [
-                    a.get_text(strip=True)
-                    for a in pub.parent.find_all("a", href=re.compile("/en/persons/"))
-                ]
-
-                if author_name not in co_authors:
-                    co_authors.insert(0, author_name)
-
-                publications.append({
-                    "title": title,
-                    "authors": list(set(co_authors)),
-                    "year": year,
-                    "publication_link": urljoin(profile_url, pub["href"]),
-                    "profile_link": profile_url,
-                    "crawled_at": datetime.now().isoformat()
-                })
-import time
-import re
-from urllib.parse import urljoin
-from datetime import datetime
-
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+# Sentinel a worker puts on the result queue when it runs out of work
+_WORKER_DONE = object()
 
 
 class ImprovedSeleniumCrawler:
@@ -109,96 +24,243 @@ class ImprovedSeleniumCrawler:
     with robust year extraction and polite crawling
     """
 
-    def __init__(self, crawl_delay=2):
-        self.driver = None
+    def __init__(self, crawl_delay=2, workers=1, fetcher=None, state=None):
+        """
+        :param crawl_delay: minimum seconds between requests to the same
+            host, shared by all workers (polite crawling)
+        :param workers: number of pages fetched in parallel
+        :param fetcher: page fetcher; defaults to plain HTTP with a
+            headless Chrome fallback for pages missing required content
+        :param state: optional CrawlStateStore; unchanged profiles are
+            then skipped and only changed profiles are parsed and yielded
+        """
+        self.state = state
         self.crawl_delay = crawl_delay
-        self.seen_titles = set()
-
-    def init_driver(self):
+        self.workers = max(1, workers)
+        self.rate_limiter = HostRateLimiter(1 / crawl_delay if crawl_delay else None)
+        self.seen_publications = set()
+        self._seen_lock = threading.Lock()
+        self._driver_path = None
+        self._driver_lock = threading.Lock()
+
+        self.fetcher = fetcher or FallbackFetcher(
+            HttpFetcher(
+                rate_limiter=self.rate_limiter,
+                pool_size=self.workers,
+                validators=state.validators if state else None,
+                save_validators=state is None,
+            ),
+            SeleniumFetcher(self._new_driver, rate_limiter=self.rate_limiter),
+        )
+
+    def _new_driver(self):
         options = Options()
         options.add_argument("--headless=new")
         options.add_argument("--disable-gpu")
         options.add_argument("--no-sandbox")
 
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=options)
+        with self._driver_lock:
+            if self._driver_path is None:
+                self._driver_path = ChromeDriverManager().install()
 
-    def crawl_department(self, base_url, max_authors=20):
-        self.init_driver()
-        publications = []
+        service = Service(self._driver_path)
+        return webdriver.Chrome(service=service, options=options)
+
+    def close(self):
+        self.fetcher.close()
 
-        # ---------- Load department page ----------
-        self.driver.get(base_url)
-        time.sleep(self.crawl_delay)
+    def crawl_department(self, base_url, max_authors=20):
+        """
+        Every publication as one list; iter_department streams them
+        """
+        return list(self.iter_department(base_url, max_authors))
 
-        soup = BeautifulSoup(self.driver.page_source, "html.parser")
+    def iter_department(self, base_url, max_authors=20):
+        """
+        Yield publications as soon as each author page is parsed.
+
+        Author profiles go into a frontier queue drained by self.workers
+        threads; the per-host rate limiter keeps the combined request
+        rate within one request per crawl_delay seconds. Profiles are
+        yielded in URL order whichever worker finishes first, so a
+        publication listed on several profiles is always kept from the
+        lowest profile URL.
+
+        With a state store, profiles already done in the current run or
+        unchanged since the last one are skipped, and the publication
+        changes of each profile are recorded in the store.
+        """
+        run_id = self.state.begin_run() if self.state else None
+        threads = []
+        stop = threading.Event()
+
+        try:
+            # ---------- Load department page ----------
+            page = self.fetcher.fetch(
+                base_url, required=_has_profile_links, conditional=False
+            )
+            soup = BeautifulSoup(page.html, "lxml")
+
+            # ---------- Extract author profile links ----------
+            author_links = sorted({
+                urljoin(base_url, a["href"])
+                for a in soup.find_all("a", href=True)
+                if "/en/persons/" in a["href"]
+            })[:max_authors]
+
+            queued = [
+                profile_url for profile_url in author_links
+                if run_id is None or not self.state.is_done(run_id, profile_url)
+            ]
+            frontier = queue.Queue()
+            for profile_url in queued:
+                frontier.put(profile_url)
+
+            # ---------- Crawl authors in parallel ----------
+            results = queue.Queue()
+            for _ in range(min(self.workers, frontier.qsize())):
+                thread = threading.Thread(
+                    target=self._crawl_worker,
+                    args=(frontier, results, stop, run_id),
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+            # Workers report (profile_url, publications) per profile,
+            # which are held until the profiles before them are in
+            parsed = {}
+            position = 0
+            running = len(threads)
+            while running:
+                item = results.get()
+                if item is _WORKER_DONE:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    parsed[item[0]] = item[1]
+                    while position < len(queued) and queued[position] in parsed:
+                        for publication in parsed.pop(queued[position]):
+                            # The store tracks publications per profile,
+                            # so shared ones are kept on every profile
+                            if run_id is not None or self._first_sighting(publication):
+                                yield publication
+                        position += 1
+
+            if run_id is not None:
+                self.state.prune_profiles(run_id, author_links)
+
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.close()
+
+    def _crawl_worker(self, frontier, results, stop, run_id=None):
+        try:
+            while not stop.is_set():
+                try:
+                    profile_url = frontier.get_nowait()
+                except queue.Empty:
+                    break
+
+                page = self.fetcher.fetch(profile_url, required=_has_publications)
+
+                if run_id is None:
+                    results.put((profile_url, list(
+                        self.parse_author_page(page.html, profile_url, dedupe=False)
+                    )))
+                    continue
 
-        # ---------- Extract author profile links ----------
-        author_links = list({
-            urljoin(base_url, a["href"])
-            for a in soup.find_all("a", href=True)
-            if "/en/persons/" in a["href"]
-        })[:max_authors]
+                # ---------- Incremental: skip unchanged profiles ----------
+                if page.not_modified or not self.state.page_changed(profile_url, page.html):
+                    self.state.mark_done(run_id, profile_url, page)
+                    results.put((profile_url, []))
+                    continue
 
-        # ---------- Crawl each author ----------
-        for profile_url in author_links:
-            self.driver.get(profile_url)
-            time.sleep(self.crawl_delay)
+                publications = list(
+                    self.parse_author_page(page.html, profile_url, dedupe=False)
+                )
+                self.state.record_profile(run_id, profile_url, publications, page)
+                results.put((profile_url, publications))
+
+        except Exception as exc:
+            results.put(exc)
+
+        finally:
+            results.put(_WORKER_DONE)
+
+    def parse_author_page(self, html, profile_url, dedupe=True):
+        soup = BeautifulSoup(html, "lxml")
+
+        name_tag = soup.find("h1")
+        author_name = name_tag.get_text(strip=True) if name_tag else "Unknown Author"
+
+        # ---------- Extract publications ----------
+        for pub_link in soup.find_all("a", href=re.compile("/en/publications/")):
+            title = pub_link.get_text(strip=True)
+
+            if not title:
+                continue
+
+            # ---------- ROBUST YEAR EXTRACTION ----------
+            year = None
+
+            # 1️⃣ Try closest logical container
+            container = pub_link.find_parent(["li", "article", "div"])
+            if container:
+                text = container.get_text(" ")
+                match = re.search(r"(19|20)\d{2}", text)
+                if match:
+                    year = int(match.group())
+
+            # 2️⃣ Fallback: parent text
+            if year is None:
+                text = pub_link.parent.get_text(" ")
+                match = re.search(r"(19|20)\d{2}", text)
+                if match:
+                    year = int(match.group())
+
+            # ---------- Co-authors ----------
+            co_authors = [
+                a.get_text(strip=True)
+                for a in container.find_all("a", href=re.compile("/en/persons/"))
+            ] if container else []
+
+            if author_name not in co_authors:
+                co_authors.insert(0, author_name)
+
+            publication = {
+                "title": title,
+                # Sorted: set order changes from process to process
+                "authors": sorted(set(co_authors)),
+                "year": year,
+                "publication_link": urljoin(profile_url, pub_link["href"]),
+                "profile_link": profile_url,
+                "crawled_at": datetime.now().isoformat()
+            }
+
+            # ---- Deduplication (shared across calls) ----
+            if not dedupe or self._first_sighting(publication):
+                yield publication
+
+    def _first_sighting(self, publication):
+        """
+        Record publication as seen; False if it already was. Keyed on
+        the publication link, which co-authors' profiles share.
+        """
+        key = publication["publication_link"]
+        with self._seen_lock:
+            if key in self.seen_publications:
+                return False
+            self.seen_publications.add(key)
+            return True
 
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
 
-            name_tag = soup.find("h1")
-            author_name = name_tag.get_text(strip=True) if name_tag else "Unknown Author"
+def _has_profile_links(html):
+    return "/en/persons/" in html
 
-            # ---------- Extract publications ----------
-            for pub_link in soup.find_all("a", href=re.compile("/en/publications/")):
-                title = pub_link.get_text(strip=True)
 
-                # ---- Deduplication ----
-                if not title or title.lower() in self.seen_titles:
-                    continue
-                self.seen_titles.add(title.lower())
-
-                # ---------- ROBUST YEAR EXTRACTION ----------
-                year = None
-
-                # 1️⃣ Try closest logical container
-                container = pub_link.find_parent(["li", "article", "div"])
-                if container:
-                    text = container.get_text(" ")
-                    match = re.search(r"(19|20)\d{2}", text)
-                    if match:
-                        year = int(match.group())
-
-                # 2️⃣ Fallback: parent text
-                if year is None:
-                    text = pub_link.parent.get_text(" ")
-                    match = re.search(r"(19|20)\d{2}", text)
-                    if match:
-                        year = int(match.group())
-
-                # ---------- Co-authors ----------
-                co_authors = [
-                    a.get_text(strip=True)
-                    for a in pub_link.find_parent(["li", "article", "div"])
-                    .find_all("a", href=re.compile("/en/persons/"))
-                ] if pub_link.find_parent(["li", "article", "div"]) else []
-
-                if author_name not in co_authors:
-                    co_authors.insert(0, author_name)
-
-                publications.append({
-                    "title": title,
-                    "authors": list(set(co_authors)),
-                    "year": year,
-                    "publication_link": urljoin(profile_url, pub_link["href"]),
-                    "profile_link": profile_url,
-                    "crawled_at": datetime.now().isoformat()
-                })
-
-        self.driver.quit()
-        return publications
-
-
-        self.driver.quit()
-        return publications
+def _has_publications(html):
+    return "/en/publications/" in html
@@ -0,0 +1,238 @@
+"""
+Batch retrieval evaluation: MAP, nDCG@k, MRR, P@k and R-precision over
+any number of queries at once.
+
+    python -m evaluation.engine --index data/search_index.pkl \
+        --topics topics.tsv --qrels qrels.txt --cutoffs 5 10 20
+
+Judged documents are looked up for every ranked document in one sorted
+search, and each metric is a few NumPy operations over a (queries x
+rank) gain matrix rather than a Python loop per query. Queries run
+through AdvancedInvertedIndex.search_many, across worker processes
+with --processes.
+
+Conventions follow trec_eval: a document is relevant with a grade of
+RELEVANCE_LEVEL or more, nDCG uses the grade as gain with a log2(rank
++ 1) discount, and scores are averaged over every judged query with a
+relevant document; a query missing from the run scores 0.
+"""
+
+import argparse
+import json
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from evaluation.trec import read_qrels, read_run, read_topics, write_run
+
+
+AVAILABLE = np is not None
+
+RELEVANCE_LEVEL = 1
+
+DEFAULT_CUTOFFS = (5, 10, 20)
+
+# Results retrieved per query when building a run
+DEFAULT_DEPTH = 1000
+
+
+class Evaluation:
+    """
+    Per-query metric arrays (metrics[name][i] belongs to queries[i])
+    """
+
+    def __init__(self, queries, metrics):
+        self.queries = queries
+        self.metrics = metrics
+
+    def mean(self):
+        return {
+            name: float(values.mean()) if len(values) else 0.0
+            for name, values in self.metrics.items()
+        }
+
+    def per_query(self):
+        """
+        {query_id: {metric: value}}
+        """
+        return {
+            query_id: {name: float(values[i]) for name, values in self.metrics.items()}
+            for i, query_id in enumerate(self.queries)
+        }
+
+
+def _gain_matrix(queries, qrels, run, width):
+    """
+    Grades of the ranked documents, queries x width and 0 when
+    unjudged, and the judged grades with their query rows
+    """
+    doc_nums = {}
+    judged_keys = []
+    judged_grades = []
+    judged_queries = []
+    for qi, query_id in enumerate(queries):
+        for doc_id, grade in qrels[query_id].items():
+            doc_num = doc_nums.setdefault(doc_id, len(doc_nums))
+            judged_queries.append(qi)
+            judged_keys.append(doc_num)
+            judged_grades.append(grade)
+
+    num_docs = max(len(doc_nums), 1)
+    keys = np.array(judged_queries, dtype=np.int64) * num_docs \
+        + np.array(judged_keys, dtype=np.int64)
+    grades = np.array(judged_grades, dtype=np.float64)
+    order = np.argsort(keys, kind="stable")
+    keys, grades = keys[order], grades[order]
+
+    rows, ranks, docs = [], [], []
+    for qi, query_id in enumerate(queries):
+        ranked = run.get(query_id, ())[:width]
+        rows.extend([qi] * len(ranked))
+        ranks.extend(range(len(ranked)))
+        docs.extend(doc_nums.get(doc_id, -1) for doc_id, _ in ranked)
+
+    rows = np.array(rows, dtype=np.int64)
+    ranks = np.array(ranks, dtype=np.int64)
+    docs = np.array(docs, dtype=np.int64)
+
+    gains = np.zeros((len(queries), width))
+    known = docs >= 0
+    lookup = rows[known] * num_docs + docs[known]
+    at = np.minimum(np.searchsorted(keys, lookup), max(len(keys) - 1, 0))
+    found = keys[at] == lookup
+    gains[rows[known][found], ranks[known][found]] = grades[at[found]]
+
+    judged = (np.array(judged_queries, dtype=np.int64), np.array(judged_grades, dtype=np.float64))
+    return gains, judged
+
+
+def _ideal_gains(judged, num_queries, width):
+    """
+    Each query's judged grades, best first, queries x width
+    """
+    query_rows, grades = judged
+    order = np.lexsort((-grades, query_rows))
+    query_rows, grades = query_rows[order], grades[order]
+
+    starts = np.searchsorted(query_rows, np.arange(num_queries))
+    positions = np.arange(len(query_rows)) - starts[query_rows]
+    keep = positions < width
+
+    ideal = np.zeros((num_queries, width))
+    ideal[query_rows[keep], positions[keep]] = np.maximum(grades[keep], 0)
+    return ideal
+
+
+def evaluate(qrels, run, cutoffs=DEFAULT_CUTOFFS, relevance_level=RELEVANCE_LEVEL):
+    """
+    qrels: {query_id: {doc_id: grade}}
+    run: {query_id: [(doc_id, score)] best first}
+
+    Returns an Evaluation with "map", "mrr", "r_precision" and "p@k",
+    "ndcg@k" for each cutoff k.
+    """
+    if not AVAILABLE:
+        raise ImportError("the evaluation engine requires numpy")
+
+    queries = [
+        query_id for query_id, judgements in qrels.items()
+        if any(grade >= relevance_level for grade in judgements.values())
+    ]
+    num_relevant = np.array([
+        sum(grade >= relevance_level for grade in qrels[q].values()) for q in queries
+    ], dtype=np.float64)
+
+    depth = max((len(run.get(q, ())) for q in queries), default=0)
+    width = max([depth, *cutoffs, int(num_relevant.max()) if len(queries) else 0, 1])
+
+    gains, judged = _gain_matrix(queries, qrels, run, width)
+    relevant = gains >= relevance_level
+    ranks = np.arange(1, width + 1)
+
+    hits = np.cumsum(relevant, axis=1)
+    metrics = {
+        "map": (relevant * hits / ranks).sum(axis=1) / num_relevant,
+        "mrr": np.where(
+            relevant.any(axis=1), 1.0 / (relevant.argmax(axis=1) + 1), 0.0
+        ),
+        "r_precision": (
+            relevant & (ranks[None, :] <= num_relevant[:, None])
+        ).sum(axis=1) / num_relevant,
+    }
+
+    discounts = 1.0 / np.log2(ranks + 1)
+    gains = np.maximum(gains, 0)
+    ideal = _ideal_gains(judged, len(queries), width)
+    for k in cutoffs:
+        metrics[f"p@{k}"] = hits[:, k - 1] / k
+        dcg = gains[:, :k] @ discounts[:k]
+        idcg = ideal[:, :k] @ discounts[:k]
+        metrics[f"ndcg@{k}"] = np.divide(
+            dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0
+        )
+
+    return Evaluation(queries, metrics)
+
+
+def run_queries(index, topics, depth=DEFAULT_DEPTH, processes=None, bm25f=None):
+    """
+    Search every topic ({query_id: query text}) as one batch; returns a
+    run {query_id: [(doc_id, score)]}. With processes > 1 the batch is
+    split across worker processes (see search_many).
+    """
+    query_ids = list(topics)
+    results = index.search_many(
+        [topics[q] for q in query_ids], k=depth, processes=processes, bm25f=bm25f
+    )
+    return {
+        query_id: [(str(hit.doc_id), hit.score) for hit in hits]
+        for query_id, hits in zip(query_ids, results)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--qrels", required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--run", help="evaluate an existing TREC run file")
+    source.add_argument("--topics", help="query_id<TAB>query file to search")
+    parser.add_argument("--index", default="data/search_index.pkl")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--bm25f", action="store_true", help="rank with BM25F")
+    parser.add_argument("--save-run", help="write the run made from --topics here")
+    parser.add_argument("--cutoffs", type=int, nargs="+", default=list(DEFAULT_CUTOFFS))
+    parser.add_argument("--per-query", action="store_true")
+    args = parser.parse_args(argv)
+
+    qrels = read_qrels(args.qrels)
+
+    if args.run:
+        run = read_run(args.run)
+    else:
+        from indexing.bm25f import BM25F
+        from indexing.inverted_index import AdvancedInvertedIndex
+
+        index = AdvancedInvertedIndex()
+        if not index.load(args.index):
+            parser.error(f"cannot load index {args.index}")
+        run = run_queries(
+            index, read_topics(args.topics), args.depth, args.processes,
+            BM25F() if args.bm25f else None,
+        )
+        if args.save_run:
+            write_run(args.save_run, run, "bm25f" if args.bm25f else "tfidf")
+
+    evaluation = evaluate(qrels, run, args.cutoffs)
+    report = {"queries": len(evaluation.queries), "mean": evaluation.mean()}
+    if args.per_query:
+        report["per_query"] = evaluation.per_query()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+TREC-format relevance judgements, runs and topics.
+
+    qrels   query_id  iteration  doc_id  grade            (whitespace separated)
+    run     query_id  Q0  doc_id  rank  score  tag
+    topics  query_id <TAB> query text
+
+Doc and query ids are kept as strings.
+"""
+
+from collections import defaultdict
+
+
+def read_qrels(filepath):
+    """
+    {query_id: {doc_id: grade}}; a repeated judgement keeps the last grade
+    """
+    qrels = defaultdict(dict)
+    with open(filepath, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 4:
+                raise ValueError(f"{filepath}:{line_no}: expected 4 columns in qrels")
+            query_id, _, doc_id, grade = parts
+            qrels[query_id][doc_id] = int(grade)
+    return dict(qrels)
+
+
+def read_run(filepath):
+    """
+    {query_id: [(doc_id, score)]} ranked as trec_eval does: by score,
+    descending, ties by doc id, descending; the rank column is ignored.
+    Repeated doc ids keep their first entry.
+    """
+    entries = defaultdict(dict)
+    with open(filepath, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 6:
+                raise ValueError(f"{filepath}:{line_no}: expected 6 columns in run")
+            query_id, _, doc_id, _, score, _ = parts
+            entries[query_id].setdefault(doc_id, float(score))
+
+    return {
+        query_id: sorted(docs.items(), key=lambda x: (x[1], x[0]), reverse=True)
+        for query_id, docs in entries.items()
+    }
+
+
+def write_run(filepath, run, tag="run"):
+    """
+    run: {query_id: [(doc_id, score)] best first}
+    """
+    with open(filepath, "w", encoding="utf-8") as f:
+        for query_id, ranked in run.items():
+            for rank, (doc_id, score) in enumerate(ranked, 1):
+                f.write(f"{query_id} Q0 {doc_id} {rank} {score:.8g} {tag}\n")
+
+
+def read_topics(filepath):
+    """
+    {query_id: query text}, in file order
+    """
+    topics = {}
+    with open(filepath, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            query_id, sep, text = line.partition("\t")
+            if not sep:
+                raise ValueError(f"{filepath}:{line_no}: expected query_id<TAB>query")
+            topics[query_id.strip()] = text.strip()
+    return topics
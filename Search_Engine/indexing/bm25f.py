@@ -0,0 +1,78 @@
+import math
+
+from indexing.fields import FIELDS, FIELD_WEIGHTS
+
+
+class BM25F:
+    """
+    Query-time BM25F parameters.
+
+    Each field's term frequency is length-normalized against the field's
+    average length, boosted by its weight and summed before the k1
+    saturation, so retuning weights, k1 or b needs no reindexing.
+    """
+
+    def __init__(self, field_weights=None, k1=1.2, b=0.75):
+        weights = dict(FIELD_WEIGHTS)
+        weights.update(field_weights or {})
+
+        unknown = set(weights) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+
+        self.field_weights = tuple(float(weights[f]) for f in FIELDS)
+        self.k1 = float(k1)
+        self.b = float(b)
+
+    def _key(self):
+        return (self.field_weights, self.k1, self.b)
+
+    def __eq__(self, other):
+        return isinstance(other, BM25F) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        weights = dict(zip(FIELDS, self.field_weights))
+        return f"BM25F(field_weights={weights}, k1={self.k1}, b={self.b})"
+
+    @staticmethod
+    def idf(num_docs, df):
+        return math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+    def accumulate(self, scores, postings, weight, field_lengths, avg_lengths,
+                   deleted=()):
+        """
+        Add weight * BM25F(term, doc) to scores[doc] for every posting.
+
+        field_lengths is the flat per-document token count array
+        (len(FIELDS) per doc number); avg_lengths the live averages.
+        """
+        num_fields = len(FIELDS)
+        k1 = self.k1
+
+        # weight_f / (1 - b + b * len / avg) == weight_f / (base + scale * len)
+        fields = [
+            (f, w, 1.0 - self.b, self.b / avg if avg else 0.0)
+            for f, (w, avg) in enumerate(zip(self.field_weights, avg_lengths))
+            if w
+        ]
+
+        field_tfs = postings.field_tfs
+        for i, doc_num in enumerate(postings.doc_ids):
+            if doc_num in deleted:
+                continue
+
+            row = i * num_fields
+            lengths = doc_num * num_fields
+            tf = 0.0
+            for f, w, base, scale in fields:
+                raw = field_tfs[row + f]
+                if raw:
+                    tf += w * raw / (base + scale * field_lengths[lengths + f])
+
+            if tf:
+                scores[doc_num] = (
+                    scores.get(doc_num, 0.0) + weight * tf * (k1 + 1) / (k1 + tf)
+                )
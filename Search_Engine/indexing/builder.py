@@ -0,0 +1,371 @@
+"""
+Bulk index construction across worker processes (SPIMI).
+
+    builder = IndexBuilder(processes=4, memory_budget=512 * 2 ** 20)
+    index = builder.build(keyed_publications(iter_jsonl(path)), "index.seg")
+
+The document stream is cut into blocks that worker processes invert in
+parallel. A worker collects its block's postings in a term dictionary
+and writes them to disk as a run sorted by term whenever their estimated
+size reaches its share of the memory budget, and at the end of the
+block. Runs are merged k ways, MERGE_FAN_IN at a time.
+
+Given a filepath, the stored documents are spilled to disk as they
+arrive and the segment is written from the merged runs in two passes,
+one for idf and norms and one for the postings, so the budget bounds
+the whole build: the parent keeps only per-document ids, field lengths,
+norms and facets. The index returned maps the written segment. Without
+a filepath the runs are merged into an in-memory term dictionary and
+finalize() computes idf, norms and top-k bounds.
+
+Documents are numbered in stream order, so the result is the index that
+add_document() for each document followed by finalize() would build.
+"""
+
+import heapq
+import math
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from array import array
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+from operator import itemgetter
+
+from indexing.fields import FIELDS, FIELD_WEIGHTS, analyze_fields, weighted_tf
+from indexing.inverted_index import DEFAULT_BACKEND, AdvancedInvertedIndex
+from indexing.positions import encode_positions
+from indexing.postings import PostingList, compute_idf
+from indexing.segment import write_segment
+from utils.instrumentation import stage, timed
+
+
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+
+# Documents sent to a worker at a time
+BLOCK_SIZE = 2000
+
+# Runs merged at once; more runs are first merged in groups of this many
+MERGE_FAN_IN = 32
+
+# Rough in-memory cost in bytes of one pending posting (plus its encoded
+# positions) and of one term in a worker's dictionary
+POSTING_BYTES = 200
+TERM_BYTES = 150
+
+
+class IndexBuilder:
+    def __init__(self, processes=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 block_size=BLOCK_SIZE, stem=False, positions=False,
+                 backend=DEFAULT_BACKEND, temp_dir=None):
+        """
+        :param processes: worker processes; defaults to the CPU count.
+            With 1 the blocks are inverted in this process.
+        :param memory_budget: bytes of postings held by all workers
+            together before they spill runs to disk
+        :param stem, positions, backend: options of the index built
+        :param temp_dir: where runs are written; the system default if None
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+        self.block_size = block_size
+        self.stem = stem
+        self.positions = positions
+        self.backend = backend
+        self.temp_dir = temp_dir
+
+    @timed("build")
+    def build(self, documents, filepath=None):
+        """
+        Index a stream of (doc_id, doc_data) pairs; a repeated doc_id
+        replaces the earlier document. Returns the finalized
+        AdvancedInvertedIndex: the segment written to filepath, loaded,
+        or an in-memory index without one.
+        """
+        index = AdvancedInvertedIndex(
+            stem=self.stem, positions=self.positions, backend=self.backend
+        )
+        directory = tempfile.mkdtemp(prefix="index-build-", dir=self.temp_dir)
+        spill = None
+        pool = None
+        try:
+            if self.processes > 1:
+                # Spawned, not forked: the stream may be fed by threads
+                # (the crawler's workers), which a fork would copy mid-call
+                pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            if filepath:
+                spill = open(os.path.join(directory, "documents.pkl"), "w+b")
+
+            with stage("invert"):
+                blocks = self._invert(pool, index, documents, directory, spill)
+            with stage("merge_runs"):
+                runs = self._reduce_runs(
+                    pool, [run for _, _, runs in blocks for run in runs], directory
+                )
+                if spill is None:
+                    self._install(index, blocks, _merge_runs(runs))
+
+            if spill is not None:
+                with stage("write_segment"):
+                    self._write(index, blocks, runs, spill, filepath, directory)
+        finally:
+            if spill is not None:
+                spill.close()
+            if pool is not None:
+                pool.shutdown()
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if filepath:
+            index.load(filepath)
+        else:
+            index.finalize()
+        return index
+
+    def _blocks(self, index, documents, spill=None):
+        """
+        Number and store documents in index as they arrive, or append
+        them to the spill file; yield (first doc number, [doc_data])
+        blocks
+        """
+        block = []
+        for doc_id, doc_data in documents:
+            doc_num = len(index.doc_keys)
+            replaced = index._doc_nums.get(doc_id)
+            if replaced is not None:
+                index.doc_keys[replaced] = None
+                index.facets.delete(replaced)
+
+            index._doc_nums[doc_id] = doc_num
+            index.doc_keys.append(doc_id)
+            if spill is None:
+                index.documents[doc_id] = doc_data
+            else:
+                pickle.dump(doc_data, spill, pickle.HIGHEST_PROTOCOL)
+            index.facets.add(doc_num, doc_data)
+
+            block.append(doc_data)
+            if len(block) == self.block_size:
+                yield doc_num + 1 - len(block), block
+                block = []
+        if block:
+            yield len(index.doc_keys) - len(block), block
+
+    def _invert(self, pool, index, documents, directory, spill=None):
+        """
+        [(first doc number, field lengths, run paths)] per block, in doc
+        number order
+        """
+        options = (
+            self.stem, self.positions,
+            max(1, self.memory_budget // self.processes), directory,
+        )
+        blocks = []
+        if pool is None:
+            for start, block in self._blocks(index, documents, spill):
+                blocks.append(_invert_block(start, block, *options))
+            return blocks
+
+        # At most two blocks per worker are in flight, so a long stream
+        # is never read ahead of the workers
+        running = set()
+        for start, block in self._blocks(index, documents, spill):
+            if len(running) >= 2 * self.processes:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                blocks.extend(future.result() for future in done)
+            running.add(pool.submit(_invert_block, start, block, *options))
+        blocks.extend(future.result() for future in wait(running).done)
+        return sorted(blocks, key=itemgetter(0))
+
+    def _reduce_runs(self, pool, runs, directory):
+        """
+        Merge groups of MERGE_FAN_IN consecutive runs until at most
+        MERGE_FAN_IN remain
+        """
+        level = 0
+        while len(runs) > MERGE_FAN_IN:
+            groups = [runs[i:i + MERGE_FAN_IN] for i in range(0, len(runs), MERGE_FAN_IN)]
+            paths = [
+                os.path.join(directory, f"merged-{level}-{n:06d}.run")
+                for n in range(len(groups))
+            ]
+            mapper = pool.map if pool is not None else map
+            runs = list(mapper(_combine_runs, groups, paths))
+            level += 1
+        return runs
+
+    def _install(self, index, blocks, postings):
+        """
+        Fill index with the merged postings and the blocks' field lengths
+        """
+        replaced = {n for n, doc_id in enumerate(index.doc_keys) if doc_id is None}
+
+        for term, entries in postings:
+            if replaced:
+                entries = [e for e in entries if e[0] not in replaced]
+            if entries:
+                index.index[term] = PostingList.from_entries(entries)
+
+        num_fields = len(FIELDS)
+        for _, lengths, _ in blocks:
+            index.field_lengths.extend(lengths)
+        for doc_num in range(len(index.doc_keys)):
+            if doc_num in replaced:
+                continue
+            start = doc_num * num_fields
+            for f, length in enumerate(index.field_lengths[start:start + num_fields]):
+                index._field_length_totals[f] += length
+
+        # Placeholders until finalize() computes the norms
+        index.doc_norms = array("d", bytes(8 * len(index.doc_keys)))
+        index.generation += 1
+
+    def _write(self, index, blocks, runs, spill, filepath, directory):
+        """
+        Write to filepath the segment that finalize() and save() would
+        write, reading the merged runs twice and the spilled documents
+        once
+        """
+        live = [n for n, doc_id in enumerate(index.doc_keys) if doc_id is not None]
+        remap = array("i", [-1]) * len(index.doc_keys)
+        for new_num, old_num in enumerate(live):
+            remap[old_num] = new_num
+
+        num_fields = len(FIELDS)
+        lengths = array("I")
+        for _, block_lengths, _ in blocks:
+            lengths.extend(block_lengths)
+        field_lengths = array("I")
+        for n in live:
+            field_lengths.extend(lengths[n * num_fields:(n + 1) * num_fields])
+
+        if len(runs) > 1:
+            runs = [_combine_runs(runs, os.path.join(directory, "final.run"))]
+
+        def postings():
+            # Renumbered densely, replaced documents left out, idf set
+            for run in runs:
+                for term, _, entries in _read_run(run, 0):
+                    entries = [
+                        (remap[e[0]],) + tuple(e[1:]) for e in entries if remap[e[0]] >= 0
+                    ]
+                    if entries:
+                        term_postings = PostingList.from_entries(entries)
+                        yield term, term_postings.with_idf(
+                            compute_idf(len(live), term_postings.df)
+                        )
+
+        # Summed in term order, as finalize() does
+        norms_sq = [0.0] * len(live)
+        for _, term_postings in postings():
+            idf = term_postings.idf
+            for doc_num, tf in term_postings:
+                weight = tf * idf
+                norms_sq[doc_num] += weight * weight
+        doc_norms = array("d", (math.sqrt(s) for s in norms_sq))
+
+        def documents():
+            spill.seek(0)
+            for doc_id in index.doc_keys:
+                doc_data = pickle.load(spill)
+                if doc_id is not None:
+                    yield doc_data
+
+        write_segment(
+            filepath,
+            (
+                (term, term_postings.with_max_score(doc_norms))
+                for term, term_postings in postings()
+            ),
+            [index.doc_keys[n] for n in live],
+            documents(),
+            doc_norms,
+            FIELDS,
+            field_lengths,
+            analyzer={"stem": self.stem},
+            facets=index.facets.compact(live),
+            field_weights=[FIELD_WEIGHTS[f] for f in FIELDS],
+        )
+
+
+# -------------------------------------------------
+# RUNS (TERM-SORTED PARTIAL INDEXES ON DISK)
+# -------------------------------------------------
+# A run is a pickle stream of (term, [(doc_num, weighted_tf, field_tfs,
+# encoded positions or None)]) in term order, covering a contiguous range
+# of doc numbers; the entries are the delta postings of add_document()
+def _invert_block(start, documents, stem, positions, budget, directory):
+    """
+    Invert documents numbered from start; returns (start, field lengths,
+    run paths)
+    """
+    postings = defaultdict(list)
+    size = 0
+    runs = []
+    lengths = array("I")
+
+    for doc_num, doc_data in enumerate(documents, start):
+        field_tfs, doc_lengths, term_positions = analyze_fields(doc_data, stem, positions)
+        for token, tfs in field_tfs.items():
+            encoded = encode_positions(term_positions[token]) if term_positions else None
+            entries = postings[token]
+            if not entries:
+                size += TERM_BYTES
+            entries.append((doc_num, weighted_tf(tfs), tfs, encoded))
+            size += POSTING_BYTES + (len(encoded) if encoded else 0)
+        lengths.extend(doc_lengths)
+
+        if size >= budget:
+            runs.append(_write_run(postings, directory, start, len(runs)))
+            postings = defaultdict(list)
+            size = 0
+
+    if postings:
+        runs.append(_write_run(postings, directory, start, len(runs)))
+    return start, lengths, runs
+
+
+def _write_run(postings, directory, start, part):
+    path = os.path.join(directory, f"block-{start:012d}-{part:04d}.run")
+    with open(path, "wb") as f:
+        for term in sorted(postings):
+            pickle.dump((term, postings[term]), f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(path, run_num):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                term, entries = pickle.load(f)
+            except EOFError:
+                return
+            yield term, run_num, entries
+
+
+def _merge_runs(paths):
+    """
+    (term, entries) in term order over runs given in doc number order.
+    Runs cover disjoint doc number ranges, so a term's entries are
+    concatenated run by run.
+    """
+    merged = heapq.merge(*(_read_run(path, n) for n, path in enumerate(paths)))
+    for term, group in groupby(merged, key=itemgetter(0)):
+        entries = []
+        for _, _, part in group:
+            entries.extend(part)
+        yield term, entries
+
+
+def _combine_runs(paths, path):
+    with open(path, "wb") as f:
+        for item in _merge_runs(paths):
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    for run in paths:
+        os.remove(run)
+    return path
@@ -0,0 +1,307 @@
+"""
+Block-compressed postings for on-disk segments.
+
+A term's postings are cut into blocks of BLOCK_SIZE. The term's data
+starts with a skip table, one (last doc number, block offset) uint32
+pair per block, followed by the blocks:
+
+    header   uint16 posting count | uint8 gap width | uint8 flags
+    gaps     doc number gaps, 1, 2 or 4 bytes each (the smallest width
+             that fits the block); the first gap is from the previous
+             block's last doc number
+    tfs      per-field term frequencies, one column per field, 1 or 2
+             bytes each (flags & TF_WIDTH_MASK)
+    weights  float32, only if flags & EXPLICIT_WEIGHTS
+
+Weights are normally not stored: they are the field-boosted term
+frequencies, recomputed from the tf columns with the field weights the
+segment was written with. A block whose weights do not come out exactly
+the same keeps them explicitly.
+
+Fixed-width blocks decode with array.frombytes and itertools.accumulate
+rather than a per-byte Python loop, and the skip table lets a filtered
+search decode only the blocks that can hold its candidates.
+"""
+
+import struct
+from array import array
+from itertools import accumulate, chain, repeat
+from operator import add, mul
+
+from indexing.postings import PostingList, gallop
+
+
+BLOCK_SIZE = 128
+
+BLOCK_HEADER = struct.Struct("<HBB")
+SKIP_ENTRY_SIZE = 8
+
+TF_WIDTH_MASK = 0x0F
+EXPLICIT_WEIGHTS = 0x80
+
+# byte width -> array typecode
+WIDTH_TYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+def _width(max_value):
+    if max_value < 0x100:
+        return 1
+    if max_value < 0x10000:
+        return 2
+    return 4
+
+
+def _column(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def _weights(columns, field_weights):
+    """
+    Field-boosted term frequencies from tf columns, summed in field
+    order exactly as fields.weighted_tf does
+    """
+    weights = None
+    for weight, column in zip(field_weights, columns):
+        # Most terms never occur in some fields; all-zero columns add
+        # nothing to the sum
+        if not weight or not any(column):
+            continue
+        boosted = map(mul, column, repeat(weight))
+        weights = list(boosted) if weights is None else list(map(add, weights, boosted))
+    if weights is None:
+        weights = [0.0] * (len(columns[0]) if columns else 0)
+    return array("f", weights)
+
+
+# -------------------------------------------------
+# ENCODE
+# -------------------------------------------------
+def encode_postings(postings, num_fields, field_weights):
+    """
+    PostingList -> bytes (skip table and blocks), padded to 4 bytes
+    """
+    doc_ids = postings.doc_ids
+    weights = postings.weights
+    field_tfs = postings.field_tfs
+
+    skips = array("I")
+    blocks = bytearray()
+    previous = 0
+
+    for start in range(0, postings.df, BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, postings.df)
+        n = end - start
+
+        block_ids = doc_ids[start:end]
+        gaps = [block_ids[0] - previous]
+        gaps.extend(b - a for a, b in zip(block_ids, block_ids[1:]))
+        previous = block_ids[-1]
+        gap_width = _width(max(gaps))
+
+        rows = field_tfs[start * num_fields:end * num_fields]
+        columns = [rows[f::num_fields] for f in range(num_fields)]
+        tf_width = _width(max(rows, default=0))
+
+        flags = tf_width
+        block_weights = array("f", weights[start:end])
+        if _weights(columns, field_weights) != block_weights:
+            flags |= EXPLICIT_WEIGHTS
+
+        skips.append(previous)
+        skips.append(len(blocks))
+
+        blocks += BLOCK_HEADER.pack(n, gap_width, flags)
+        blocks += array(WIDTH_TYPECODES[gap_width], gaps).tobytes()
+        for column in columns:
+            blocks += array(WIDTH_TYPECODES[tf_width], column).tobytes()
+        if flags & EXPLICIT_WEIGHTS:
+            blocks += block_weights.tobytes()
+
+    blocks += b"\0" * (-len(blocks) % 4)
+    return skips.tobytes() + bytes(blocks)
+
+
+def encoded_size(df):
+    """
+    Size of the skip table for df postings
+    """
+    return -(-df // BLOCK_SIZE) * SKIP_ENTRY_SIZE
+
+
+# -------------------------------------------------
+# DECODE
+# -------------------------------------------------
+class BlockPostingList:
+    """
+    PostingList interface over encode_postings() bytes (e.g. a segment
+    memoryview). doc_ids, weights and field_tfs are decoded on first
+    access and kept; select() decodes only the blocks it needs.
+    Modifying operations return a plain PostingList.
+    """
+
+    __slots__ = (
+        "df", "idf", "max_score", "positions",
+        "_view", "_skips", "_num_fields", "_field_weights",
+        "_doc_ids", "_weights", "_columns", "_field_tfs",
+    )
+
+    def __init__(self, view, df, idf, max_score, num_fields, field_weights,
+                 positions=None):
+        self.df = df
+        self.idf = idf
+        self.max_score = max_score
+        self.positions = positions
+
+        skip_size = encoded_size(df)
+        self._skips = _column("I", view[:skip_size])
+        self._view = view[skip_size:]
+        self._num_fields = num_fields
+        self._field_weights = field_weights
+
+        self._doc_ids = None
+        self._weights = None
+        self._columns = None
+        self._field_tfs = None
+
+    # -------- BLOCKS --------
+    @property
+    def num_blocks(self):
+        return len(self._skips) // 2
+
+    def _block_ids(self, b):
+        offset = self._skips[2 * b + 1]
+        n, gap_width, _ = BLOCK_HEADER.unpack_from(self._view, offset)
+        start = offset + BLOCK_HEADER.size
+        gaps = _column(WIDTH_TYPECODES[gap_width], self._view[start:start + n * gap_width])
+
+        base = self._skips[2 * b - 2] if b else 0
+        return array("i", accumulate(gaps, initial=base))[1:]
+
+    def _block(self, b):
+        """
+        (doc_ids, weights, tf columns) of block b
+        """
+        offset = self._skips[2 * b + 1]
+        n, gap_width, flags = BLOCK_HEADER.unpack_from(self._view, offset)
+        doc_ids = self._block_ids(b)
+
+        pos = offset + BLOCK_HEADER.size + n * gap_width
+        tf_width = flags & TF_WIDTH_MASK
+        typecode = WIDTH_TYPECODES[tf_width]
+        columns = []
+        for _ in range(self._num_fields):
+            columns.append(_column(typecode, self._view[pos:pos + n * tf_width]))
+            pos += n * tf_width
+
+        if flags & EXPLICIT_WEIGHTS:
+            weights = _column("f", self._view[pos:pos + 4 * n])
+        else:
+            weights = _weights(columns, self._field_weights)
+
+        return doc_ids, weights, columns
+
+    def _decode(self):
+        if self._weights is None:
+            doc_ids = array("i")
+            weights = array("f")
+            columns = []
+            for b in range(self.num_blocks):
+                block_ids, block_weights, block_columns = self._block(b)
+                doc_ids += block_ids
+                weights += block_weights
+                columns.append(block_columns)
+            self._doc_ids = doc_ids
+            self._weights = weights
+            self._columns = columns
+
+    # -------- POSTINGLIST INTERFACE --------
+    @property
+    def doc_ids(self):
+        # Doc numbers alone skip decoding the tf columns and weights
+        if self._doc_ids is None:
+            doc_ids = array("i")
+            for b in range(self.num_blocks):
+                doc_ids += self._block_ids(b)
+            self._doc_ids = doc_ids
+        return self._doc_ids
+
+    @property
+    def weights(self):
+        self._decode()
+        return self._weights
+
+    @property
+    def field_tfs(self):
+        # Interleaved per posting only when asked for; scoring by weight
+        # (and the sparse backend) never needs it
+        if self._field_tfs is None:
+            self._decode()
+            field_tfs = array("H")
+            for columns in self._columns:
+                field_tfs.extend(chain.from_iterable(zip(*columns)))
+            self._field_tfs = field_tfs
+        return self._field_tfs
+
+    def __len__(self):
+        return self.df
+
+    def __iter__(self):
+        return zip(self.doc_ids, self.weights)
+
+    def to_posting_list(self):
+        return PostingList(
+            self.doc_ids, self.weights, self.idf, self.max_score,
+            self.field_tfs, self.positions,
+        )
+
+    def entries(self):
+        return self.to_posting_list().entries()
+
+    def replace(self, **changes):
+        return self.to_posting_list().replace(**changes)
+
+    def with_idf(self, idf):
+        return self.replace(idf=idf)
+
+    def with_max_score(self, doc_norms):
+        return self.to_posting_list().with_max_score(doc_norms)
+
+    def select(self, doc_nums):
+        """
+        Postings of the documents in doc_nums (ascending), decoding only
+        the blocks whose doc number range holds a candidate
+        """
+        # When most blocks would be decoded anyway, decode (and keep)
+        # the whole list
+        if self._weights is not None or len(doc_nums) >= self.df:
+            return self.to_posting_list().select(doc_nums)
+
+        doc_ids = array("i")
+        weights = array("f")
+        field_tfs = array("H")
+
+        j = 0
+        previous = -1
+        for b in range(self.num_blocks):
+            last = self._skips[2 * b]
+            j = gallop(doc_nums, previous + 1, j)
+            if j == len(doc_nums):
+                break
+            previous = last
+            if doc_nums[j] > last:
+                continue
+
+            block_ids, block_weights, columns = self._block(b)
+            k = j
+            for i, doc_num in enumerate(block_ids):
+                k = gallop(doc_nums, doc_num, k)
+                if k == len(doc_nums):
+                    break
+                if doc_nums[k] == doc_num:
+                    doc_ids.append(doc_num)
+                    weights.append(block_weights[i])
+                    field_tfs.extend(column[i] for column in columns)
+
+        return PostingList(doc_ids, weights, self.idf, self.max_score, field_tfs)
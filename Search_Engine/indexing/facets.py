@@ -0,0 +1,265 @@
+"""
+Columnar year and author facets.
+
+Each document number has a year (uint16, 0 when unknown) and a list of
+author ids (CSR: uint32 offsets into a uint32 id column, ids indexing
+author_names). Per-value doc bitmaps, Python ints with bit n set for doc
+number n, are built from the columns on first use, so counts over a
+result set and filters are AND + popcount per value rather than a walk
+over the stored documents.
+"""
+
+from array import array
+
+from indexing.postings import intersect_sorted
+
+
+FACET_FIELDS = ("year", "authors")
+
+# Year column value for documents without a numeric year
+UNKNOWN_YEAR = 0
+
+# Result sets smaller than this are counted from the columns directly;
+# larger ones with bitmaps
+COLUMN_SCAN_LIMIT = 256
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(bitmap):
+        return bin(bitmap).count("1")
+
+# byte -> positions of its set bits
+_BYTE_BITS = [tuple(b for b in range(8) if byte >> b & 1) for byte in range(256)]
+
+
+def to_bitmap(doc_nums):
+    """
+    Ascending doc numbers -> bitmap
+    """
+    if not len(doc_nums):
+        return 0
+    data = bytearray(doc_nums[-1] // 8 + 1)
+    for doc_num in doc_nums:
+        data[doc_num >> 3] |= 1 << (doc_num & 7)
+    return int.from_bytes(data, "little")
+
+
+def bitmap_docs(bitmap):
+    """
+    Bitmap -> ascending doc numbers
+    """
+    docs = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for i, byte in enumerate(data):
+        if byte:
+            base = i * 8
+            docs.extend(base + b for b in _BYTE_BITS[byte])
+    return docs
+
+
+def parse_year(value):
+    year = str(value).strip() if value is not None else ""
+    if year.isdigit() and 0 < int(year) <= 0xFFFF:
+        return int(year)
+    return UNKNOWN_YEAR
+
+
+def normalize_filters(filters):
+    """
+    {field: values} (or normalized filters) -> hashable ((field,
+    (values...)), ...), or None when no values are selected. Values
+    within a field are alternatives; fields must all match.
+    """
+    if not filters:
+        return None
+
+    items = filters.items() if hasattr(filters, "items") else filters
+    normalized = []
+    for field, values in sorted(items):
+        if field not in FACET_FIELDS:
+            raise ValueError(f"unknown facet {field!r}")
+        if isinstance(values, (str, int)):
+            values = [values]
+        values = tuple(sorted(set(values), key=str))
+        if values:
+            normalized.append((field, values))
+    return tuple(normalized) or None
+
+
+class FacetIndex:
+    """
+    Year and author columns over doc numbers, parallel to the inverted
+    index; columns may be arrays or memoryviews over a mapped segment.
+    """
+
+    def __init__(self, years=None, author_offsets=None, author_ids=None,
+                 author_names=()):
+        self.years = years if years is not None else array("H")
+        self.author_offsets = (
+            author_offsets if author_offsets is not None else array("I", [0])
+        )
+        self.author_ids = author_ids if author_ids is not None else array("I")
+        self.author_names = list(author_names)
+        self._name_ids = {name: i for i, name in enumerate(self.author_names)}
+
+        # Doc numbers deleted since the last compaction
+        self._deleted = set()
+
+        # field -> {value: bitmap} and the live documents bitmap, built
+        # lazily and dropped on every change
+        self._bitmaps = None
+        self._live = 0
+
+    @classmethod
+    def from_documents(cls, documents):
+        facets = cls()
+        for doc_num, doc_data in enumerate(documents):
+            facets.add(doc_num, doc_data)
+        return facets
+
+    def __len__(self):
+        return len(self.years)
+
+    # -------- MAINTENANCE --------
+    def add(self, doc_num, doc_data):
+        """
+        Append the facets of doc_num, the next document number
+        """
+        self.years.append(parse_year(doc_data.get("year")))
+
+        for name in dict.fromkeys(doc_data.get("authors", [])):
+            author_id = self._name_ids.get(name)
+            if author_id is None:
+                author_id = self._name_ids[name] = len(self.author_names)
+                self.author_names.append(name)
+            self.author_ids.append(author_id)
+        self.author_offsets.append(len(self.author_ids))
+
+        self._bitmaps = None
+
+    def delete(self, doc_num):
+        self._deleted.add(doc_num)
+        self._bitmaps = None
+
+    def compact(self, live):
+        """
+        FacetIndex renumbered to live (old doc numbers, ascending)
+        """
+        facets = FacetIndex(author_names=self.author_names)
+        for n in live:
+            facets.years.append(self.years[n])
+            facets.author_ids.extend(self._authors_of(n))
+            facets.author_offsets.append(len(facets.author_ids))
+        return facets
+
+    def copy(self):
+        """
+        In-memory copy of columns that may be mapped from a segment
+        """
+        facets = FacetIndex(
+            array("H", self.years), array("I", self.author_offsets),
+            array("I", self.author_ids), self.author_names,
+        )
+        facets._deleted = set(self._deleted)
+        return facets
+
+    def _authors_of(self, doc_num):
+        return self.author_ids[self.author_offsets[doc_num]:self.author_offsets[doc_num + 1]]
+
+    # -------- BITMAPS --------
+    def _ensure_bitmaps(self):
+        if self._bitmaps is not None:
+            return
+
+        year_docs = {}
+        author_docs = {}
+        live = []
+        for doc_num, year in enumerate(self.years):
+            if doc_num in self._deleted:
+                continue
+            live.append(doc_num)
+            year_docs.setdefault(year, []).append(doc_num)
+            for author_id in self._authors_of(doc_num):
+                author_docs.setdefault(author_id, []).append(doc_num)
+
+        self._live = to_bitmap(live)
+        self._bitmaps = {
+            "year": {year: to_bitmap(d) for year, d in year_docs.items()},
+            "authors": {
+                self.author_names[a]: to_bitmap(d) for a, d in author_docs.items()
+            },
+        }
+
+    def value_bitmap(self, field, values):
+        """
+        Bitmap of live documents having any of values in field
+        """
+        self._ensure_bitmaps()
+        bitmaps = self._bitmaps[field]
+        if field == "year":
+            values = [parse_year(v) for v in values]
+
+        bitmap = 0
+        for value in values:
+            bitmap |= bitmaps.get(value, 0)
+        return bitmap
+
+    def filter_docs(self, filters, docs=None):
+        """
+        Ascending live doc numbers matching normalized filters, within
+        docs (ascending doc numbers) if given
+        """
+        self._ensure_bitmaps()
+        bitmap = self._live
+        for field, values in filters:
+            bitmap &= self.value_bitmap(field, values)
+        matched = bitmap_docs(bitmap)
+        return matched if docs is None else intersect_sorted([docs, matched])
+
+    # -------- COUNTS --------
+    def counts(self, field, docs=None):
+        """
+        {value: document count} for field over live documents, or over
+        docs (ascending live doc numbers). Unknown years count under
+        UNKNOWN_YEAR.
+        """
+        if docs is not None and len(docs) < COLUMN_SCAN_LIMIT:
+            return self._scan_counts(field, docs)
+
+        self._ensure_bitmaps()
+        scope = self._live if docs is None else to_bitmap(docs)
+
+        counts = {}
+        for value, bitmap in self._bitmaps[field].items():
+            count = _popcount(bitmap & scope)
+            if count:
+                counts[value] = count
+        return counts
+
+    def _scan_counts(self, field, docs):
+        counts = {}
+        for doc_num in docs:
+            if field == "year":
+                values = (self.years[doc_num],)
+            else:
+                values = (self.author_names[a] for a in self._authors_of(doc_num))
+            for value in values:
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def statistics(self):
+        """
+        Corpus-wide figures for the sidebar: live document count, distinct
+        authors and publications per year (newest first, unknown last)
+        """
+        self._ensure_bitmaps()
+        years = self.counts("year")
+        return {
+            "total_docs": _popcount(self._live),
+            "total_authors": len(self.counts("authors")),
+            "years": dict(sorted(
+                years.items(),
+                key=lambda x: (x[0] == UNKNOWN_YEAR, -x[0]),
+            )),
+        }
@@ -0,0 +1,75 @@
+"""
+Searchable document fields, shared by both index implementations.
+"""
+
+from collections import Counter
+
+from indexing.positions import FIELD_GAP
+from indexing.text_preprocessor import TextPreprocessor
+
+
+FIELDS = ("title", "authors", "year", "abstract", "keywords")
+
+# Boosts folded into the TF-IDF weights at index time; also the default
+# BM25F field weights
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "authors": 2.5,
+    "year": 1.5,
+    "keywords": 2.0,
+    "abstract": 1.0,
+}
+
+# Per-field term frequencies are stored as uint16
+MAX_FIELD_TF = 0xFFFF
+
+
+def field_texts(doc_data):
+    return {
+        "title": doc_data.get("title", ""),
+        "authors": " ".join(doc_data.get("authors", [])),
+        "year": str(doc_data.get("year", "")),
+        "abstract": doc_data.get("abstract", ""),
+        "keywords": " ".join(doc_data.get("keywords", [])),
+    }
+
+
+def analyze_fields(doc_data, stem=False, positions=False):
+    """
+    Returns ({term: [tf per field]}, [token count per field], term
+    positions), fields in FIELDS order. With positions set the last item
+    is {term: [positions]}, each field starting FIELD_GAP after the
+    previous one ends; otherwise it is None.
+    """
+    field_tfs = {}
+    lengths = []
+    term_positions = {} if positions else None
+    base = 0
+
+    for i, text in enumerate(field_texts(doc_data).values()):
+        tokens = TextPreprocessor.analyze(text, stem)
+        lengths.append(len(tokens))
+
+        for token, tf in Counter(tokens).items():
+            tfs = field_tfs.get(token)
+            if tfs is None:
+                tfs = field_tfs[token] = [0] * len(FIELDS)
+            tfs[i] = min(tf, MAX_FIELD_TF)
+
+        if positions:
+            for offset, token in enumerate(tokens, base):
+                term_positions.setdefault(token, []).append(offset)
+            base += len(tokens) + FIELD_GAP
+
+    return field_tfs, lengths, term_positions
+
+
+def weighted_tf(tfs):
+    """
+    Field-boosted term frequency used by the TF-IDF scorers
+    """
+    weight = 0.0
+    for field, tf in zip(FIELDS, tfs):
+        if tf:
+            weight += tf * FIELD_WEIGHTS[field]
+    return weight
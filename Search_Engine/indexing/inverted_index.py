@@ -1,164 +1,1186 @@
+import heapq
 import math
 import pickle
 import os
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 
-from indexing.text_preprocessor import TextPreprocessor
+from indexing.bm25f import BM25F
+from indexing.facets import FACET_FIELDS, FacetIndex, normalize_filters
+from indexing.fields import FIELDS, FIELD_WEIGHTS, analyze_fields, weighted_tf
+from indexing.positions import (
+    FIELD_GAP, Positions, TermPositions, encode_positions, min_distance,
+    phrase_starts, within,
+)
+from indexing.postings import (
+    PostingList, compute_idf, count_union_sorted, difference_sorted,
+    intersect_sorted, union_sorted,
+)
+from indexing.query_cache import QueryCache
+from indexing.query_parser import (
+    Near, Not, Optional, Or, Phrase, Term, YearRange, parse_query,
+)
+from indexing.search_results import Hit, SearchResults
+from indexing import sparse_backend
+from indexing.segment import Segment, SegmentError, is_segment, write_segment
+from indexing.topk import maxscore_top_k
+from utils.helpers import publication_content
+from utils.instrumentation import count, stage, timed, trace
+
+
+# Pending postings folded into the frozen term dictionary automatically
+DEFAULT_MERGE_THRESHOLD = 50000
+
+# "sparse" scores with NumPy/SciPy, "python" with the pure-Python loops;
+# both return identical rankings. sparse is opt-in: its first query
+# decodes every posting list into a private CSR matrix, in every process,
+# where "python" decodes only the blocks a query touches from the
+# mapped segment, whose pages all processes share.
+DEFAULT_BACKEND = "python"
+
+# Search results kept per index; 0 disables the cache
+DEFAULT_CACHE_SIZE = 256
+
+# On a positional index the best PROXIMITY_WINDOW results of a multi-term
+# query are rescored by score * (1 + PROXIMITY_WEIGHT / d), d being the
+# smallest distance between two different query terms in the document
+PROXIMITY_WINDOW = 100
+PROXIMITY_WEIGHT = 0.5
 
 
 class AdvancedInvertedIndex:
-    def __init__(self):
-        # term -> list of (doc_id, weighted_tf)
-        self.index = defaultdict(list)
+    def __init__(self, merge_threshold=DEFAULT_MERGE_THRESHOLD, stem=False,
+                 backend=DEFAULT_BACKEND, cache_size=DEFAULT_CACHE_SIZE,
+                 positions=False):
+        """
+        :param stem: index and query stemmed tokens ("modelling" matches
+            "model"); saved with the index and restored by load()
+        :param positions: record token positions, enabling "quoted
+            phrases", NEAR/k and the proximity boost; saved with the
+            index. Loading an index without positions rebuilds it.
+        :param backend: "python" or "sparse" (requires numpy and scipy;
+            faster on an index built in memory, see DEFAULT_BACKEND)
+        :param cache_size: number of search results kept in an LRU cache
+            keyed by the analyzed query; 0 disables it
+        """
+        if backend not in ("python", "sparse"):
+            raise ValueError(f"unknown backend {backend!r}")
+        if backend == "sparse" and not sparse_backend.AVAILABLE:
+            raise ImportError("the sparse backend requires numpy and scipy")
+
+        self.merge_threshold = merge_threshold
+        self.stem = stem
+        self.positions = positions
+        self.backend = backend
+        self.cache = QueryCache(cache_size) if cache_size else None
 
-        # doc_id -> document metadata
+        # Bumped by every change that can alter search results; cached
+        # results from an older generation are never returned
+        self.generation = 0
+
+        # CorpusStats (indexing.sharding) of the whole corpus when this
+        # index is one shard of it: idf, norms and BM25F statistics then
+        # follow the corpus rather than this index's own documents
+        self.corpus_stats = None
+        self._reset()
+
+    def _reset(self):
+        # term -> PostingList (finalized, array-backed)
+        self.index = {}
+
+        # Delta segment: term -> list of (doc_num, weighted_tf, field_tfs,
+        # encoded positions or None) added since the last merge,
+        # searchable before it is merged
+        self._pending = defaultdict(list)
+        self._pending_count = 0
+
+        # Tombstoned doc_nums and their postings per term, until merged
+        self._deleted = set()
+        self._deleted_df = Counter()
+
+        # doc_id -> document metadata (live documents only)
         self.documents = {}
 
-        # doc_id -> document vector norm
-        self.doc_norms = {}
+        # doc_num -> doc_id (None once deleted), and live doc_id -> doc_num
+        self.doc_keys = []
+        self._doc_nums = {}
+
+        # doc_num -> document vector norm
+        self.doc_norms = array("d")
+
+        # Token count of each field, len(FIELDS) entries per doc_num, and
+        # the totals over live documents (BM25F length normalization)
+        self.field_lengths = array("I")
+        self._field_length_totals = [0] * len(FIELDS)
+
+        # doc_num -> norm for documents in the delta, computed lazily
+        self._delta_norms = None
+
+        # document count the stored idf values were computed for
+        self._idf_num_docs = 0
+
+        # memory-mapped segment backing the structures above after load()
+        self._segment = None
+
+        # SparseIndex over the frozen postings, built on first use
+        self._sparse = None
+
+        # Year and author columns and bitmaps over doc_nums
+        self.facets = FacetIndex()
 
     # -------------------------------------------------
     # ADD DOCUMENT TO INDEX
     # -------------------------------------------------
     def add_document(self, doc_id, doc_data):
+        """
+        Index doc_data under doc_id. Re-adding an existing doc_id
+        replaces the previous version of the document.
+        """
+        self._ensure_writable()
+
+        if doc_id in self._doc_nums:
+            self.delete_document(doc_id)
+
+        doc_num = len(self.doc_keys)
+        self._doc_nums[doc_id] = doc_num
+        self.doc_keys.append(doc_id)
         self.documents[doc_id] = doc_data
+        self.facets.add(doc_num, doc_data)
 
-        searchable_fields = {
-            "title": doc_data.get("title", ""),
-            "authors": " ".join(doc_data.get("authors", [])),
-            "year": str(doc_data.get("year", "")),
-            "abstract": doc_data.get("abstract", ""),
-            "keywords": " ".join(doc_data.get("keywords", [])),
-        }
+        field_tfs, lengths, positions = analyze_fields(
+            doc_data, self.stem, self.positions
+        )
+        for token, tfs in field_tfs.items():
+            encoded = encode_positions(positions[token]) if positions else None
+            self._pending[token].append((doc_num, weighted_tf(tfs), tfs, encoded))
 
-        field_weights = {
-            "title": 3.0,
-            "authors": 2.5,
-            "year": 1.5,
-            "keywords": 2.0,
-            "abstract": 1.0,
-        }
+        self.field_lengths.extend(lengths)
+        for f, length in enumerate(lengths):
+            self._field_length_totals[f] += length
+
+        self._pending_count += len(field_tfs)
+        self._delta_norms = None
+        self.generation += 1
+
+        if self._pending_count >= self.merge_threshold:
+            self.merge()
 
-        for field, text in searchable_fields.items():
-            processed = TextPreprocessor.preprocess(text)
-            tokens = TextPreprocessor.tokenize(processed)
-            tokens = TextPreprocessor.remove_stopwords(tokens)
+    @timed("index")
+    def add_documents(self, documents):
+        """
+        Index a stream of (doc_id, doc_data) pairs as they arrive, e.g.
+        keyed_publications(iter_jsonl(path)); returns the count. Only
+        the index itself grows, whatever the length of the stream.
+        """
+        added = 0
+        for doc_id, doc_data in documents:
+            self.add_document(doc_id, doc_data)
+            added += 1
+        return added
 
-            for token in tokens:
-                tf = tokens.count(token)
-                weighted_tf = tf * field_weights[field]
-                self.index[token].append((doc_id, weighted_tf))
+    def update_document(self, doc_id, doc_data):
+        self.add_document(doc_id, doc_data)
+
+    def delete_document(self, doc_id):
+        """
+        Tombstone doc_id; its postings are dropped at the next merge.
+        Returns False if the document is not in the index.
+        """
+        self._ensure_writable()
+
+        doc_num = self._doc_nums.pop(doc_id, None)
+        if doc_num is None:
+            return False
+
+        doc_data = self.documents.pop(doc_id)
+        self.doc_keys[doc_num] = None
+        self._deleted.add(doc_num)
+        self.facets.delete(doc_num)
+        self._deleted_df.update(analyze_fields(doc_data, self.stem)[0].keys())
+
+        start = doc_num * len(FIELDS)
+        for f, length in enumerate(self.field_lengths[start:start + len(FIELDS)]):
+            self._field_length_totals[f] -= length
+        self._delta_norms = None
+        self.generation += 1
+        return True
+
+    @timed("index")
+    def sync_documents(self, documents):
+        """
+        Bring the index in line with documents (doc_id -> doc_data, or
+        a stream of (doc_id, doc_data) pairs indexed as they arrive):
+        new and changed documents are indexed, missing ones deleted once
+        the stream is exhausted. Returns (added, updated, deleted) counts.
+
+        Call finalize() before saving the result: merge() leaves the
+        norms of untouched documents at their old idf.
+        """
+        self._ensure_writable()
+        added = updated = deleted = 0
+        seen = set()
+
+        items = documents.items() if hasattr(documents, "items") else documents
+        for doc_id, doc_data in items:
+            seen.add(doc_id)
+            current = self.documents.get(doc_id)
+            if current is None:
+                added += 1
+            elif publication_content(current) != publication_content(doc_data):
+                updated += 1
+            else:
+                continue
+            self.add_document(doc_id, doc_data)
+
+        for doc_id in [d for d in self.documents if d not in seen]:
+            self.delete_document(doc_id)
+            deleted += 1
+
+        return added, updated, deleted
 
     # -------------------------------------------------
-    # FINALIZE INDEX (COMPUTE DOCUMENT NORMS)
+    # MERGE DELTA (INCREMENTAL)
     # -------------------------------------------------
+    @timed("merge")
+    def merge(self):
+        """
+        Fold the delta segment and tombstones into the frozen term
+        dictionary. Only terms touched since the last merge are rebuilt
+        and only new documents get norms, so the cost follows the size
+        of the change. Norms of untouched documents keep the idf they
+        were computed with until the next finalize().
+        """
+        self._ensure_writable()
+        self.generation += 1
+
+        if self._pending or self._deleted:
+            norms = self._live_norms()
+            deleted = self._deleted
+
+            for doc_num in deleted:
+                if doc_num < len(self.doc_norms):
+                    self.doc_norms[doc_num] = 0.0
+            self.doc_norms.extend(
+                norms[n] for n in range(len(self.doc_norms), len(self.doc_keys))
+            )
+
+            for term in set(self._pending) | set(self._deleted_df):
+                entries = []
+                postings = self.index.get(term)
+                if postings is not None:
+                    entries = [e for e in postings.entries() if e[0] not in deleted]
+                entries += [
+                    e for e in self._pending.get(term, ()) if e[0] not in deleted
+                ]
+
+                if entries:
+                    self.index[term] = PostingList.from_entries(entries) \
+                        .with_max_score(self.doc_norms)
+                else:
+                    self.index.pop(term, None)
+
+            self._pending = defaultdict(list)
+            self._pending_count = 0
+            self._deleted = set()
+            self._deleted_df = Counter()
+            self._delta_norms = None
+            self._sparse = None
+
+        # idf is cheap to refresh per term, postings are not touched
+        for term, postings in self.index.items():
+            idf = self._idf(term, postings.df)
+            if idf != postings.idf:
+                self.index[term] = postings.with_idf(idf)
+        self._idf_num_docs = len(self.documents)
+
+    def _compact(self):
+        """
+        Renumber live documents densely, dropping deleted doc_nums
+        """
+        if len(self.doc_keys) == len(self.documents):
+            return
+
+        live = [n for n, doc_id in enumerate(self.doc_keys) if doc_id is not None]
+        remap = array("i", [-1]) * len(self.doc_keys)
+        for new_num, old_num in enumerate(live):
+            remap[old_num] = new_num
+
+        for term, postings in self.index.items():
+            self.index[term] = postings.replace(
+                doc_ids=array("i", (remap[d] for d in postings.doc_ids))
+            )
+
+        num_fields = len(FIELDS)
+        field_lengths = array("I")
+        for n in live:
+            field_lengths.extend(
+                self.field_lengths[n * num_fields:(n + 1) * num_fields]
+            )
+
+        self.doc_keys = [self.doc_keys[n] for n in live]
+        self.doc_norms = array("d", (self.doc_norms[n] for n in live))
+        self.field_lengths = field_lengths
+        self.facets = self.facets.compact(live)
+        self._doc_nums = {doc_id: n for n, doc_id in enumerate(self.doc_keys)}
+        self._sparse = None
+
+    # -------------------------------------------------
+    # FINALIZE INDEX (FREEZE POSTINGS, IDF, NORMS)
+    # -------------------------------------------------
+    @timed("finalize")
     def finalize(self):
         """
-        Precompute full document vector norms for cosine similarity
+        Merge and compact the index, then recompute idf per term,
+        full document vector norms for cosine similarity and per-term
+        top-k score bounds from scratch
         """
-        doc_vectors = defaultdict(lambda: defaultdict(float))
+        self.merge()
+        self._compact()
+        self.generation += 1
+
+        # Norms are summed in term order; sorting the terms makes them
+        # the same however the index was built (in one piece or sharded)
+        self.index = dict(sorted(self.index.items()))
+
+        if self.backend == "sparse":
+            self._finalize_sparse()
+            return
+
+        norms_sq = [0.0] * len(self.doc_keys)
+
+        for term, postings in self.index.items():
+            idf = self._idf(term, postings.df)
+            self.index[term] = postings.with_idf(idf)
+
+            for doc_num, tf in postings:
+                weight = tf * idf
+                norms_sq[doc_num] += weight * weight
+
+        self.doc_norms = array("d", (math.sqrt(s) for s in norms_sq))
 
         for term, postings in self.index.items():
-            df = len(set(doc_id for doc_id, _ in postings))
-            idf = math.log((len(self.documents) + 1) / (df + 1)) + 1
+            self.index[term] = postings.with_max_score(self.doc_norms)
+
+    def _finalize_sparse(self):
+        matrix = self._sparse_index()
 
-            for doc_id, tf in postings:
-                doc_vectors[doc_id][term] += tf * idf
+        idf = [self._idf(term, p.df) for term, p in self.index.items()]
+        norms = matrix.norms(idf)
+        max_scores = matrix.max_scores(norms)
 
-        self.doc_norms = {}
-        for doc_id, vector in doc_vectors.items():
-            self.doc_norms[doc_id] = math.sqrt(
-                sum(weight ** 2 for weight in vector.values())
+        self.doc_norms = array("d")
+        self.doc_norms.frombytes(norms.tobytes())
+
+        for row, (term, postings) in enumerate(list(self.index.items())):
+            self.index[term] = postings.replace(
+                idf=idf[row], max_score=float(max_scores[row])
             )
 
+    def _sparse_index(self):
+        if self._sparse is None:
+            self._sparse = sparse_backend.SparseIndex(self.index, len(self.doc_keys))
+        return self._sparse
+
+    # -------------------------------------------------
+    # LIVE VIEW (FROZEN TERMS + DELTA - TOMBSTONES)
+    # -------------------------------------------------
+    def _term_postings(self, term, candidates=None):
+        """
+        Postings for term as a list of PostingLists: the frozen list
+        and, if the term is in the delta, a small list built from it.
+        With candidates (ascending doc numbers) each list is cut down to
+        those documents.
+        """
+        sources = []
+
+        postings = self.index.get(term)
+        if postings is not None:
+            sources.append(postings)
+
+        pending = self._pending.get(term)
+        if pending:
+            sources.append(
+                PostingList.from_entries(pending)
+                .with_max_score(self._live_norms())
+            )
+
+        if candidates is not None:
+            sources = [postings.select(candidates) for postings in sources]
+        return sources
+
+    def _live_df(self, term):
+        postings = self.index.get(term)
+        df = postings.df if postings is not None else 0
+        return df + len(self._pending.get(term, ())) - self._deleted_df.get(term, 0)
+
+    def _idf(self, term, df):
+        """
+        idf of term found in df of this index's documents, or in as many
+        as the corpus statistics record
+        """
+        stats = self.corpus_stats
+        if stats is None:
+            return compute_idf(len(self.documents), df)
+        return compute_idf(stats.num_docs, stats.df.get(term, df))
+
+    def _live_idf(self, term):
+        if self.corpus_stats is not None:
+            return self._idf(term, self._live_df(term))
+
+        postings = self.index.get(term)
+        num_docs = len(self.documents)
+
+        if (
+            postings is not None
+            and term not in self._pending
+            and term not in self._deleted_df
+            and num_docs == self._idf_num_docs
+        ):
+            return postings.idf
+
+        return compute_idf(num_docs, self._live_df(term))
+
+    def _live_norms(self):
+        if not self._pending and not self._deleted:
+            return self.doc_norms
+
+        if self._delta_norms is None:
+            norms_sq = defaultdict(float)
+            for term, pairs in self._pending.items():
+                idf = self._live_idf(term)
+                for doc_num, tf, _, _ in pairs:
+                    weight = tf * idf
+                    norms_sq[doc_num] += weight * weight
+            self._delta_norms = {d: math.sqrt(s) for d, s in norms_sq.items()}
+
+        return _LiveNorms(self.doc_norms, self._delta_norms, self._deleted)
+
     # -------------------------------------------------
-    # SEARCH (TF-IDF + TRUE COSINE SIMILARITY)
+    # SEARCH (TF-IDF + TRUE COSINE SIMILARITY, OR BM25F)
     # -------------------------------------------------
-    def search(self, query):
-        processed = TextPreprocessor.preprocess(query)
-        tokens = TextPreprocessor.tokenize(processed)
-        tokens = TextPreprocessor.remove_stopwords(tokens)
+    def search(self, query, k=None, bm25f=None, filters=None):
+        """
+        Rank documents for query, best first.
+
+        With k set only the top k documents are scored to completion
+        (MaxScore); total_hits on the result still counts every match.
+        Pass a BM25F instance to rank with BM25F over the per-field
+        statistics instead of TF-IDF cosine similarity.
+
+        The query language (see indexing.query_parser) supports AND, OR,
+        NOT, parentheses, field prefixes such as author: and year ranges.
+        Such queries are first evaluated over the sorted postings, then
+        only the matching documents are scored; total_hits is the number
+        of matches. Plain terms are ranked as a bag of words as before.
+
+        "Quoted phrases" and a NEAR/k b are checked against positions on
+        a positional index, where documents with the query terms close
+        together are also boosted. Without positions they only require
+        all of their terms.
+
+        filters restricts results by facet, e.g. {"year": [2022, 2023],
+        "authors": ["Jane Smith"]}: any listed value of a field, every
+        field. Unlike author: in the query, author names match exactly.
+        """
+        with trace("search", query=query, k=k):
+            with stage("analysis"):
+                parsed = parse_query(query, self.stem)
+                filters = normalize_filters(filters)
+            return self._cached_search(parsed, k, {}, bm25f, filters)
+
+    def search_many(self, queries, k=None, processes=None, bm25f=None,
+                    filters=None):
+        """
+        Run a batch of queries; returns one SearchResults per query, in
+        order. Queries are analyzed up front and each distinct term's
+        postings and idf are looked up once for the whole batch.
+
+        With processes > 1 the batch is split across worker processes
+        that each map the saved segment read-only. This needs an index
+        opened with load() and unchanged since; otherwise, or when the
+        file has been replaced on disk, the batch runs in this process.
+        """
+        queries = list(queries)
+        filters = normalize_filters(filters)
+
+        with trace("search_many", queries=len(queries), k=k, processes=processes):
+            if (
+                processes and processes > 1 and len(queries) > 1
+                and self._segment is not None and self._segment.is_current()
+            ):
+                return self._search_pool(queries, k, processes, bm25f, filters)
+
+            with stage("analysis"):
+                parsed = [parse_query(q, self.stem) for q in queries]
+            term_cache = {}
+            return [
+                self._cached_search(query, k, term_cache, bm25f, filters)
+                for query in parsed
+            ]
+
+    def _search_pool(self, queries, k, processes, bm25f=None, filters=None):
+        # Several chunks per worker so a slow chunk does not idle the rest
+        size = math.ceil(len(queries) / (processes * 4))
+        chunks = [queries[i:i + size] for i in range(0, len(queries), size)]
+
+        results = []
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_search_worker,
+            initargs=(self._segment.path, self.backend),
+        ) as pool:
+            for chunk_results in pool.map(
+                _search_chunk, chunks, repeat(k), repeat(bm25f), repeat(filters)
+            ):
+                results.extend(
+                    SearchResults(r, r.total_hits, self.get_document)
+                    for r in chunk_results
+                )
+        return results
+
+    def _cached_search(self, query, k, term_cache, bm25f=None, filters=None):
+        """
+        Scoring behind the result cache; "Modelling!" and "modelling"
+        parse to the same query and share an entry
+        """
+        if self.cache is None:
+            return self._score_query(query, k, term_cache, bm25f, filters)
+
+        key = (query, k, bm25f, filters)
+        generation = self.generation
+        results = self.cache.get(key, generation)
+        if results is None:
+            count("cache_misses")
+            results = self._score_query(query, k, term_cache, bm25f, filters)
+            self.cache.put(key, generation, results)
+        else:
+            count("cache_hits")
+
+        # Callers get their own list; the cached one stays unchanged
+        return SearchResults(results, results.total_hits, results.fetch)
+
+    def _score_query(self, query, k, term_cache, bm25f, filters=None):
+        boost = self._boosted(query)
+        ranked, total_hits = self._rank(
+            query, k, term_cache, bm25f, filters, boost
+        )
+        with stage("ranking"):
+            if boost:
+                ranked = self._proximity_boost(ranked, query.tokens)
+            return self._results(ranked[:k], total_hits)
+
+    def _boosted(self, query):
+        return self.positions and len(set(query.tokens)) > 1
+
+    def _rank(self, query, k, term_cache, bm25f, filters=None, boost=False):
+        """
+        ([(doc_num, score)] best first, total hits) before the proximity
+        boost. With boost set at least PROXIMITY_WINDOW results are kept,
+        for the boost to reorder.
+        """
+        tokens = query.tokens
+        if query.match is None and filters is None and not boost:
+            return self._score_tokens(tokens, k, term_cache, bm25f)
 
+        candidates = None
+        if query.match is not None or filters is not None:
+            # Only postings of matching documents are scored, so a
+            # selective filter stays cheap however common its terms are
+            candidates = self._matching_docs(query, filters)
+            if not candidates:
+                return [], 0
+
+        window = k
+        if boost and k is not None:
+            window = max(k, PROXIMITY_WINDOW)
+
+        ranked, total_hits = self._score_tokens(
+            tokens, window, term_cache, bm25f, candidates
+        )
+
+        if candidates is not None:
+            total_hits = len(candidates)
+            if window is None or len(ranked) < window:
+                # Documents matched only through filters have no score
+                scored = {doc_num for doc_num, _ in ranked}
+                unscored = ((d, 0.0) for d in candidates if d not in scored)
+                limit = None if window is None else window - len(ranked)
+                ranked = ranked + list(islice(unscored, limit))
+
+        return ranked, total_hits
+
+    def _score_tokens(self, tokens, k, term_cache, bm25f, candidates=None):
+        """
+        Returns ([(doc_num, score)] best first, total hits). candidates,
+        if given, restricts scoring to those ascending doc numbers.
+        """
+        if bm25f is not None:
+            return self._search_bm25f(tokens, k, bm25f, candidates)
+        return self._search_tokens(tokens, k, term_cache, candidates)
+
+    def _search_bm25f(self, tokens, k, bm25f, candidates=None):
+        """
+        BM25F over per-field term frequencies and field lengths. Its
+        weights depend on query-time parameters, so every posting of the
+        query terms is scored; top-k is a heap selection.
+        """
+        stats = self.corpus_stats
+        if stats is None:
+            num_docs = len(self.documents)
+            totals = self._field_length_totals
+        else:
+            num_docs = stats.num_docs
+            totals = stats.field_length_totals
+        if not tokens or not num_docs:
+            return [], 0
+
+        avg_lengths = [total / num_docs for total in totals]
+
+        with stage("postings"):
+            term_sources = []
+            for term, tf in Counter(tokens).items():
+                sources = self._term_postings(term, candidates)
+                if sources:
+                    term_sources.append((term, tf, sources))
+                    count("postings_scanned", sum(p.df for p in sources))
+
+        scores = {}
+        with stage("scoring"):
+            for term, tf, sources in term_sources:
+                df = self._live_df(term)
+                if stats is not None:
+                    df = stats.df.get(term, df)
+                idf = BM25F.idf(num_docs, df)
+                for postings in sources:
+                    bm25f.accumulate(
+                        scores, postings, tf * idf,
+                        self.field_lengths, avg_lengths, self._deleted
+                    )
+
+        key = lambda x: (-x[1], x[0])
+        with stage("ranking"):
+            if k is None:
+                ranked = sorted(scores.items(), key=key)
+            else:
+                ranked = heapq.nsmallest(k, scores.items(), key=key)
+
+        return ranked, len(scores)
+
+    def _search_tokens(self, tokens, k, term_cache, candidates=None):
+        """
+        term_cache: term -> (sources, idf), shared by the queries of a batch
+        """
         if not tokens or not self.documents:
-            return []
+            return [], 0
+
+        if candidates is not None:
+            # Restricted postings are specific to this query
+            term_cache = {}
 
         # -------- QUERY VECTOR --------
         query_tf = defaultdict(int)
         for t in tokens:
             query_tf[t] += 1
 
+        # A shard weighs every term of the corpus, including terms it has
+        # no postings for, so the query norm is that of a single index
+        stats = self.corpus_stats
         query_vector = {}
-        for term, tf in query_tf.items():
-            if term in self.index:
-                df = len(set(doc_id for doc_id, _ in self.index[term]))
-                idf = math.log((len(self.documents) + 1) / (df + 1)) + 1
-                query_vector[term] = tf * idf
+        term_sources = {}
+        with stage("postings"):
+            for term, tf in query_tf.items():
+                entry = term_cache.get(term)
+                if entry is None:
+                    sources = self._term_postings(term, candidates)
+                    in_corpus = sources or (stats is not None and stats.df.get(term, 0))
+                    idf = self._live_idf(term) if in_corpus else 0.0
+                    entry = term_cache[term] = (sources, idf)
 
-        if not query_vector:
-            return []
+                sources, idf = entry
+                if idf:
+                    query_vector[term] = tf * idf
+                if sources:
+                    term_sources[term] = (sources, idf)
+                    count("postings_scanned", sum(p.df for p in sources))
+
+        if not term_sources:
+            return [], 0
 
         query_norm = math.sqrt(sum(w ** 2 for w in query_vector.values()))
         if query_norm == 0:
-            return []
+            return [], 0
+
+        doc_norms = self._live_norms()
+
+        if (
+            self.backend == "sparse" and candidates is None
+            and not self._pending and not self._deleted
+        ):
+            # Scoring and top-k selection are one matrix operation
+            with stage("scoring"):
+                return self._sparse_index().search(
+                    {t: query_vector[t] * idf for t, (_, idf) in term_sources.items()},
+                    query_norm, doc_norms, k
+                )
+
+        if k is not None:
+            with stage("scoring"):
+                return self._search_top_k(
+                    query_vector, query_norm, term_sources, doc_norms, k
+                )
 
         # -------- DOT PRODUCT --------
         scores = defaultdict(float)
 
-        for term, q_weight in query_vector.items():
-            df = len(set(doc_id for doc_id, _ in self.index[term]))
-            idf = math.log((len(self.documents) + 1) / (df + 1)) + 1
+        with stage("scoring"):
+            for term, (sources, idf) in term_sources.items():
+                term_weight = query_vector[term] * idf
 
-            for doc_id, tf in self.index.get(term, []):
-                scores[doc_id] += q_weight * (tf * idf)
+                for postings in sources:
+                    for doc_num, tf in postings:
+                        scores[doc_num] += term_weight * tf
 
         # -------- COSINE SIMILARITY --------
-        results = []
-        for doc_id, dot_product in scores.items():
-            doc_norm = self.doc_norms.get(doc_id)
+        with stage("ranking"):
+            ranked = []
+            for doc_num, dot_product in scores.items():
+                doc_norm = doc_norms[doc_num]
 
-            if not doc_norm or doc_norm == 0:
-                continue
+                if not doc_norm:
+                    continue
 
-            cosine_score = dot_product / (query_norm * doc_norm)
-            results.append((doc_id, self.documents[doc_id], cosine_score))
+                ranked.append((doc_num, dot_product / (query_norm * doc_norm)))
 
-        results.sort(key=lambda x: x[2], reverse=True)
-        return results
+            ranked.sort(key=lambda x: (-x[1], x[0]))
+        return ranked, len(ranked)
+
+    def _search_top_k(self, query_vector, query_norm, term_sources, doc_norms, k):
+        terms = []
+        for term, (sources, idf) in term_sources.items():
+            factor = query_vector[term] * idf / query_norm
+            for postings in sources:
+                terms.append((
+                    postings.doc_ids,
+                    postings.weights,
+                    factor,
+                    factor * postings.max_score,
+                ))
+
+        total_hits = count_union_sorted([t[0] for t in terms], self._deleted)
+
+        ranked = maxscore_top_k(terms, k, doc_norms)
+
+        # MaxScore sums factor * weight / norm; the selected documents are
+        # rescored the way the exhaustive and sparse scorers sum, so every
+        # path returns bit-identical scores
+        with stage("ranking"):
+            scores = dict.fromkeys((doc_num for doc_num, _ in ranked), 0.0)
+            for term, (sources, idf) in term_sources.items():
+                term_weight = query_vector[term] * idf
+                for postings in sources:
+                    doc_ids = postings.doc_ids
+                    for doc_num in scores:
+                        i = bisect_left(doc_ids, doc_num)
+                        if i < len(doc_ids) and doc_ids[i] == doc_num:
+                            scores[doc_num] += term_weight * postings.weights[i]
+
+            ranked = [
+                (doc_num, dot_product / (query_norm * doc_norms[doc_num]))
+                for doc_num, dot_product in scores.items()
+            ]
+            ranked.sort(key=lambda x: (-x[1], x[0]))
+        return ranked, total_hits
 
     # -------------------------------------------------
-    # SAVE INDEX
+    # BOOLEAN, FIELDED AND POSITIONAL MATCHING
     # -------------------------------------------------
-    def save(self, filepath):
-        with open(filepath, "wb") as f:
-            pickle.dump(
-                (dict(self.index), self.documents, self.doc_norms),
-                f
+    @timed("postings")
+    def _matching_docs(self, query, filters=None):
+        """
+        Ascending live doc numbers matching a parsed query (its tree, or
+        any of its terms) and the normalized facet filters
+        """
+        if query.match is not None:
+            docs = self._evaluate(query.match)
+        else:
+            docs = union_sorted([self._term_docs(t) for t in set(query.tokens)])
+            if self._deleted:
+                docs = [d for d in docs if d not in self._deleted]
+
+        if filters is not None and len(docs):
+            docs = self.facets.filter_docs(filters, docs)
+        return docs
+
+    def facet_counts(self, query=None, filters=None, limit=None):
+        """
+        {facet: [(value, count)] most frequent first} over the documents
+        matching query and filters, or over the whole index without a
+        query. Years are ints, UNKNOWN_YEAR (0) for documents without one.
+        """
+        filters = normalize_filters(filters)
+
+        docs = None
+        if query is not None:
+            docs = self._matching_docs(parse_query(query, self.stem), filters)
+        elif filters is not None:
+            docs = self.facets.filter_docs(filters)
+
+        counts = {}
+        for field in FACET_FIELDS:
+            values = sorted(
+                self.facets.counts(field, docs).items(),
+                key=lambda x: (-x[1], str(x[0]))
             )
+            counts[field] = values[:limit]
+        return counts
+
+    def _evaluate(self, node):
+        """
+        Live doc numbers matching a query tree, ascending. Conjunctions
+        intersect sorted postings rarest first with galloping search.
+        """
+        docs = self._match(node)
+        if self._deleted:
+            docs = [d for d in docs if d not in self._deleted]
+        return docs
+
+    def _match(self, node):
+        # May include tombstoned doc numbers; _evaluate drops them
+        kind = type(node)
+
+        if kind is Term:
+            return self._term_docs(node.token, node.field)
+
+        if kind is Phrase or kind is Near:
+            if kind is Phrase:
+                tokens, field = node.tokens, node.field
+            else:
+                tokens, field = node.left + node.right, None
+
+            docs = intersect_sorted([self._term_docs(t, field) for t in set(tokens)])
+            if not self.positions:
+                # Without positions a phrase or NEAR needs all its terms
+                return docs
+            return self._positional_filter(node, docs)
+
+        if kind is YearRange:
+            return union_sorted([
+                self._term_docs(str(year), "year")
+                for year in range(node.start, node.end + 1)
+            ])
+
+        if kind is Or:
+            return union_sorted([self._match(child) for child in node.children])
+
+        if kind is Not:
+            return difference_sorted(self._all_docs(), self._match(node.child))
+
+        # And: intersect the required children, then drop the negated
+        # ones; Optional children only contribute to scoring
+        positive = [
+            self._match(child) for child in node.children
+            if type(child) not in (Not, Optional)
+        ]
+        docs = intersect_sorted(positive) if positive else self._all_docs()
+        for child in node.children:
+            if type(child) is Not and len(docs):
+                docs = difference_sorted(docs, self._match(child.child))
+        return docs
+
+    def _term_docs(self, term, field=None):
+        """
+        Ascending doc numbers containing term, in field if given. The
+        frozen doc ids are returned as they are when no field is given.
+        """
+        f = FIELDS.index(field) if field is not None else None
+        num_fields = len(FIELDS)
+        parts = []
+
+        postings = self.index.get(term)
+        if postings is not None:
+            if f is None:
+                parts.append(postings.doc_ids)
+            else:
+                tfs = postings.field_tfs
+                parts.append([
+                    d for i, d in enumerate(postings.doc_ids)
+                    if tfs[i * num_fields + f]
+                ])
+
+        # Delta doc numbers are ascending and above every frozen one
+        pending = self._pending.get(term)
+        if pending:
+            parts.append([e[0] for e in pending if f is None or e[2][f]])
+
+        if len(parts) == 1:
+            return parts[0]
+        return [d for part in parts for d in part]
+
+    def _all_docs(self):
+        if len(self.doc_keys) == len(self.documents):
+            return range(len(self.doc_keys))
+        return [n for n, doc_id in enumerate(self.doc_keys) if doc_id is not None]
+
+    def _positional_filter(self, node, docs):
+        """
+        docs (each containing every term of a Phrase or Near node) where
+        the phrase occurs, inside its field if it has one, or the NEAR
+        operands are at most k positions apart
+        """
+        tokens = node.tokens if type(node) is Phrase else node.left + node.right
+        term_lists = {t: TermPositions(self._term_postings(t)) for t in set(tokens)}
+
+        matches = []
+        for doc_num in docs:
+            positions = {
+                t: term_list.positions(term_list.find(doc_num))
+                for t, term_list in term_lists.items()
+            }
+
+            def starts(operand):
+                if len(operand) == 1:
+                    return positions[operand[0]]
+                return phrase_starts([positions[t] for t in operand])
+
+            if type(node) is Phrase:
+                found = starts(node.tokens)
+                if found and node.field is not None:
+                    start, end = self._field_span(doc_num, node.field)
+                    found = [p for p in found if start <= p < end]
+            else:
+                found = within(
+                    starts(node.left), len(node.left),
+                    starts(node.right), len(node.right), node.k
+                )
+
+            if found:
+                matches.append(doc_num)
+
+        return matches
+
+    def _field_span(self, doc_num, field):
+        """
+        Range of positions occupied by field in doc_num, as laid out by
+        analyze_fields
+        """
+        num_fields = len(FIELDS)
+        f = FIELDS.index(field)
+        lengths = self.field_lengths[doc_num * num_fields:(doc_num + 1) * num_fields]
+        start = sum(lengths[:f]) + f * FIELD_GAP
+        return start, start + lengths[f]
+
+    def _proximity_boost(self, ranked, tokens):
+        """
+        Rescore the top PROXIMITY_WINDOW results by how close together
+        the query terms occur; terms in different fields never count
+        """
+        window = ranked[:PROXIMITY_WINDOW]
+        if not window:
+            return ranked
+
+        term_lists = [TermPositions(self._term_postings(t)) for t in set(tokens)]
+
+        boosted = []
+        for doc_num, score in window:
+            position_lists = []
+            for term_list in term_lists:
+                i = term_list.find(doc_num)
+                if i is not None:
+                    position_lists.append(term_list.positions(i))
+
+            distance = min_distance(position_lists)
+            if distance is not None and distance < FIELD_GAP:
+                score *= 1 + PROXIMITY_WEIGHT / distance
+            boosted.append((doc_num, score))
+
+        # Scores only grow, so the window stays ahead of the rest
+        boosted.sort(key=lambda x: (-x[1], x[0]))
+        return boosted + ranked[PROXIMITY_WINDOW:]
+
+    def _results(self, ranked, total_hits=None):
+        """
+        Hits for (doc_num, score) pairs; documents are fetched on demand
+        """
+        return SearchResults(
+            [Hit(self.doc_keys[doc_num], score) for doc_num, score in ranked],
+            total_hits,
+            self.get_document,
+        )
+
+    def get_document(self, doc_id):
+        """
+        Stored document for doc_id, or None. A loaded index reads it from
+        the segment's stored-fields section without decoding any other.
+        """
+        try:
+            return self.documents[doc_id]
+        except KeyError:
+            return None
+
+    def _document_at(self, doc_num):
+        if self._segment is not None:
+            return self._segment.document(doc_num)
+        return self.documents[self.doc_keys[doc_num]]
+
+    # -------------------------------------------------
+    # SAVE INDEX (MEMORY-MAPPABLE SEGMENT)
+    # -------------------------------------------------
+    @timed("save")
+    def save(self, filepath):
+        self.merge()
+        self._compact()
+
+        write_segment(
+            filepath,
+            self.index,
+            self.doc_keys,
+            (self._document_at(n) for n in range(len(self.doc_keys))),
+            self.doc_norms,
+            FIELDS,
+            self.field_lengths,
+            analyzer={"stem": self.stem},
+            facets=self.facets,
+            field_weights=[FIELD_WEIGHTS[f] for f in FIELDS],
+        )
 
     # -------------------------------------------------
-    # LOAD INDEX (SAFE + AUTO-FINALIZE)
+    # LOAD INDEX (MMAP SEGMENT OR LEGACY PICKLE)
     # -------------------------------------------------
+    @timed("load")
     def load(self, filepath):
+        """
+        Open a saved index. Segments are memory-mapped and decoded
+        lazily; legacy pickles, segments without field statistics and,
+        when this index records positions, segments without them are
+        rebuilt in memory from their stored documents.
+        """
         if not os.path.exists(filepath):
             return False
 
+        self.close()
+        self._reset()
+        self.generation += 1
+
         try:
-            with open(filepath, "rb") as f:
-                index_data, documents, doc_norms = pickle.load(f)
+            if is_segment(filepath):
+                segment = Segment(filepath)
+                self.stem = segment.meta.get("analyzer", {}).get("stem", False)
 
-            self.index = defaultdict(list, index_data)
-            self.documents = documents
+                if segment.fields != list(FIELDS) or (
+                    self.positions and not segment.positions
+                ):
+                    documents = dict(segment.documents.items())
+                    segment.close()
+                    self._rebuild(documents)
+                    return True
 
-            # If norms missing or empty → recompute
-            if not doc_norms:
-                self.finalize()
-            else:
-                self.doc_norms = doc_norms
+                self._segment = segment
+                self.positions = segment.positions
+                self.index = segment.terms
+                self.documents = segment.documents
+                self.doc_keys = segment.doc_keys
+                self.doc_norms = segment.doc_norms
+                self.field_lengths = segment.field_lengths
+                self.facets = segment.facets or FacetIndex.from_documents(
+                    segment.documents.values()
+                )
+                self._field_length_totals = list(segment.field_length_totals)
+                self._idf_num_docs = segment.num_docs
+                return True
+
+            with open(filepath, "rb") as f:
+                index_data, documents, doc_norms = pickle.load(f)
 
+            self.stem = False
+            self._rebuild(documents)
             return True
 
-        except (EOFError, pickle.UnpicklingError):
-            self.index = defaultdict(list)
-            self.documents = {}
-            self.doc_norms = {}
+        except (EOFError, pickle.UnpicklingError, SegmentError, ValueError):
+            self.close()
+            self._reset()
             return False
+
+    def _rebuild(self, documents):
+        # Older formats lack per-field statistics; reindexing the stored
+        # documents recovers them and the same TF-IDF weights
+        for doc_id, doc_data in documents.items():
+            self.add_document(doc_id, doc_data)
+        self.finalize()
+
+    def _ensure_writable(self):
+        """
+        Copy a memory-mapped index into plain in-memory structures
+        before it is modified
+        """
+        segment = self._segment
+        if segment is None:
+            return
+
+        self.index = {
+            term: PostingList(
+                array("i", p.doc_ids), array("f", p.weights),
+                p.idf, p.max_score, array("H", p.field_tfs),
+                None if p.positions is None else Positions(
+                    array("I", p.positions.offsets), bytes(p.positions.data)
+                ),
+            )
+            for term, p in segment.terms.items()
+        }
+        self.doc_keys = list(segment.doc_keys)
+        self._doc_nums = {doc_id: n for n, doc_id in enumerate(self.doc_keys)}
+        self.documents = dict(zip(self.doc_keys, segment.documents.values()))
+        self.doc_norms = array("d", segment.doc_norms)
+        self.field_lengths = array("I", segment.field_lengths)
+        self.facets = self.facets.copy()
+
+        self._segment = None
+        segment.close()
+
+    def close(self):
+        """
+        Release the memory-mapped segment, if any
+        """
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+# -------------------------------------------------
+# SEARCH_MANY WORKER PROCESSES
+# -------------------------------------------------
+# Index opened by each pool worker; the segment is mapped read-only, so
+# workers share the page cache instead of holding private copies
+_worker_index = None
+
+
+def _init_search_worker(filepath, backend):
+    global _worker_index
+    _worker_index = AdvancedInvertedIndex(backend=backend)
+    _worker_index.load(filepath)
+
+
+def _search_chunk(queries, k, bm25f=None, filters=None):
+    return _worker_index.search_many(queries, k, bm25f=bm25f, filters=filters)
+
+
+class _LiveNorms:
+    """
+    Norm lookup over frozen norms, delta norms and tombstones
+    """
+
+    __slots__ = ("_frozen", "_delta", "_deleted")
+
+    def __init__(self, frozen, delta, deleted):
+        self._frozen = frozen
+        self._delta = delta
+        self._deleted = deleted
+
+    def __getitem__(self, doc_num):
+        if doc_num in self._deleted:
+            return 0.0
+        if doc_num < len(self._frozen):
+            return self._frozen[doc_num]
+        return self._delta.get(doc_num, 0.0)
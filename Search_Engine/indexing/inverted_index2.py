@@ -1,8 +1,11 @@
+import heapq
 import math
 import pickle
 import os
 from collections import defaultdict
 
+from indexing.fields import analyze_fields, weighted_tf
+from indexing.search_results import Hit, SearchResults
 from indexing.text_preprocessor import TextPreprocessor
 
 
@@ -25,40 +28,21 @@ class AdvancedInvertedIndex:
 
         self.documents[doc_id] = doc_data
 
-        searchable_fields = {
-            "title": doc_data.get("title", ""),
-            "authors": " ".join(doc_data.get("authors", [])),
-            "year": str(doc_data.get("year", "")),
-            "abstract": doc_data.get("abstract", ""),
-            "keywords": " ".join(doc_data.get("keywords", [])),
-        }
-
-        # Field importance (boosting)
-        field_weights = {
-            "title": 3.0,
-            "authors": 2.5,
-            "year": 1.5,
-            "keywords": 2.0,
-            "abstract": 1.0,
-        }
-
-        for field, text in searchable_fields.items():
-            processed = TextPreprocessor.preprocess(text)
-            tokens = TextPreprocessor.tokenize(processed)
-            tokens = TextPreprocessor.remove_stopwords(tokens)
-
-            for token in set(tokens):
-                tf = tokens.count(token)
-                weighted_tf = tf * field_weights[field]
-                self.index[token].append((doc_id, weighted_tf))
+        # One posting per (term, doc): field-boosted tfs are summed
+        field_tfs, _, _ = analyze_fields(doc_data)
+
+        for token, tfs in field_tfs.items():
+            self.index[token].append((doc_id, weighted_tf(tfs)))
 
     # -------------------------------------------------
     # SEARCH (TF-IDF RANKING)
     # -------------------------------------------------
-    def search(self, query):
-        processed = TextPreprocessor.preprocess(query)
-        tokens = TextPreprocessor.tokenize(processed)
-        tokens = TextPreprocessor.remove_stopwords(tokens)
+    def search(self, query, k=None):
+        """
+        With k set, only the k best documents are selected (bounded heap)
+        instead of sorting every match; total_hits counts all matches.
+        """
+        tokens = TextPreprocessor.analyze_query(query)
 
         scores = defaultdict(float)
 
@@ -70,16 +54,25 @@ class AdvancedInvertedIndex:
                 for doc_id, tf in self.index[token]:
                     scores[doc_id] += tf * idf
 
-        ranked_results = sorted(
-            scores.items(), key=lambda x: x[1], reverse=True
+        if k is None:
+            ranked_results = sorted(
+                scores.items(), key=lambda x: x[1], reverse=True
+            )
+        else:
+            ranked_results = heapq.nlargest(
+                k, scores.items(), key=lambda x: x[1]
+            )
+
+        return SearchResults(
+            [
+                Hit(doc_id, score)
+                for doc_id, score in ranked_results
+                if doc_id in self.documents
+            ],
+            total_hits=len(scores),
+            fetch=self.documents.get
         )
 
-        return [
-            (doc_id, self.documents[doc_id], score)
-            for doc_id, score in ranked_results
-            if doc_id in self.documents
-        ]
-
     # -------------------------------------------------
     # SAVE INDEX (PICKLE)
     # -------------------------------------------------
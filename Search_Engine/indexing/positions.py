@@ -0,0 +1,168 @@
+"""
+Compressed token positions for the positional index.
+
+Each posting's positions are stored as varint-encoded gaps; a term's
+lists are concatenated with a uint32 offset table, so one posting's
+positions decode without touching the others.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+# Added between fields so phrases and NEAR never span two fields
+FIELD_GAP = 100
+
+
+def encode_positions(positions):
+    """
+    Ascending positions -> varint gap bytes
+    """
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        gap = position - previous
+        previous = position
+        while gap >= 0x80:
+            out.append((gap & 0x7F) | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return bytes(out)
+
+
+def decode_positions(data):
+    positions = []
+    position = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += value
+            positions.append(position)
+            value = shift = 0
+    return positions
+
+
+class Positions:
+    """
+    Position lists of one term, parallel to its postings.
+
+    offsets has df + 1 entries into data; both may be arrays or
+    memoryviews over a mapped segment.
+    """
+
+    __slots__ = ("offsets", "data")
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_encoded(cls, chunks):
+        offsets = array("I", [0])
+        data = bytearray()
+        for chunk in chunks:
+            data += chunk
+            offsets.append(len(data))
+        return cls(offsets, bytes(data))
+
+    def encoded(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i):
+        return decode_positions(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def tobytes(self):
+        """
+        Serialized form: uint32 offsets followed by the encoded data
+        """
+        return array("I", self.offsets).tobytes() + bytes(self.data)
+
+    @classmethod
+    def frombuffer(cls, view, df):
+        """
+        Positions over a tobytes() buffer (e.g. a segment memoryview)
+        """
+        size = 4 * (df + 1)
+        offsets = view[:size].cast("I")
+        return cls(offsets, view[size:size + offsets[df]])
+
+
+# -------------------------------------------------
+# POSITIONAL MATCHING
+# -------------------------------------------------
+class TermPositions:
+    """
+    Doc numbers of one term, ascending, with their positions, over the
+    term's PostingLists (frozen list first, then the delta, whose doc
+    numbers are all larger)
+    """
+
+    def __init__(self, postings_lists):
+        self._parts = [p for p in postings_lists if p.df and p.positions is not None]
+        self._starts = []
+
+        if len(self._parts) == 1:
+            self.doc_ids = self._parts[0].doc_ids
+            self._starts.append(0)
+        else:
+            self.doc_ids = array("i")
+            for postings in self._parts:
+                self._starts.append(len(self.doc_ids))
+                self.doc_ids.extend(postings.doc_ids)
+
+    def positions(self, i):
+        part = bisect_right(self._starts, i) - 1
+        return self._parts[part].positions[i - self._starts[part]]
+
+    def find(self, doc_num):
+        i = bisect_left(self.doc_ids, doc_num)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_num:
+            return i
+        return None
+
+
+def phrase_starts(position_lists):
+    """
+    Positions where the lists' terms occur consecutively
+    """
+    following = [set(p) for p in position_lists[1:]]
+    return [
+        start for start in position_lists[0]
+        if all(start + i in positions for i, positions in enumerate(following, 1))
+    ]
+
+
+def within(a_starts, a_len, b_starts, b_len, k):
+    """
+    True if an occurrence of a and one of b are at most k positions apart
+    (1 = adjacent), in either order and without overlapping
+    """
+    for a in a_starts:
+        lo = bisect_left(b_starts, a - k - b_len + 1)
+        hi = bisect_right(b_starts, a + a_len - 1 + k)
+        for b in b_starts[lo:hi]:
+            gap = b - (a + a_len - 1) if b >= a else a - (b + b_len - 1)
+            if 1 <= gap <= k:
+                return True
+    return False
+
+
+def min_distance(position_lists):
+    """
+    Smallest distance between occurrences of two different terms, or
+    None when fewer than two of the terms occur
+    """
+    merged = sorted(
+        (p, term) for term, positions in enumerate(position_lists)
+        for p in positions
+    )
+    best = None
+    for (p1, t1), (p2, t2) in zip(merged, merged[1:]):
+        if t1 != t2 and (best is None or p2 - p1 < best):
+            best = p2 - p1
+    return best
@@ -0,0 +1,275 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+
+from indexing.positions import Positions
+
+
+def compute_idf(num_docs, df):
+    """
+    Smoothed inverse document frequency used by every scorer
+    """
+    return math.log((num_docs + 1) / (df + 1)) + 1
+
+
+# -------------------------------------------------
+# SORTED DOC NUMBER LISTS
+# -------------------------------------------------
+def gallop(values, target, lo=0):
+    """
+    Index of the first value >= target at or after lo. Probes lo+1,
+    lo+2, lo+4, ... before a binary search, so skipping ahead costs the
+    log of the distance skipped, not of the list length.
+    """
+    n = len(values)
+    hi = lo
+    step = 1
+    while hi < n and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(values, target, lo, min(hi, n))
+
+
+def intersect_sorted(lists):
+    """
+    Values present in every ascending list. The shortest list drives and
+    the others are galloped through, so the cost follows the rarest list
+    rather than the longest.
+    """
+    if not lists:
+        return []
+
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        matched = []
+        i = 0
+        n = len(other)
+        for value in result:
+            i = gallop(other, value, i)
+            if i == n:
+                break
+            if other[i] == value:
+                matched.append(value)
+        result = matched
+        if not result:
+            break
+    return result
+
+
+def union_sorted(lists):
+    lists = [values for values in lists if len(values)]
+    if len(lists) <= 1:
+        return lists[0] if lists else []
+
+    result = []
+    for value in heapq.merge(*lists):
+        if not result or result[-1] != value:
+            result.append(value)
+    return result
+
+
+def count_union_sorted(lists, excluded=()):
+    """
+    Number of distinct values across ascending lists, leaving out those in
+    excluded. The lists are merged as they are read, so nothing the size
+    of the union is built.
+    """
+    lists = [values for values in lists if len(values)]
+    if len(lists) == 1:
+        count = len(lists[0])
+    else:
+        count = 0
+        last = None
+        for value in heapq.merge(*lists):
+            if value != last:
+                count += 1
+                last = value
+
+    for value in excluded:
+        for values in lists:
+            i = bisect_left(values, value)
+            if i < len(values) and values[i] == value:
+                count -= 1
+                break
+    return count
+
+
+def difference_sorted(values, excluded):
+    """
+    Values not in excluded, both ascending
+    """
+    if not len(excluded):
+        return values
+
+    result = []
+    j = 0
+    n = len(excluded)
+    for value in values:
+        j = gallop(excluded, value, j)
+        if j == n or excluded[j] != value:
+            result.append(value)
+    return result
+
+
+class PostingList:
+    """
+    Finalized postings for a single term.
+
+    doc_ids are internal document numbers in ascending order, weights is a
+    parallel float32 array of weighted term frequencies. df and idf are
+    fixed when the list is built, so queries never rescan the postings to
+    recover them. max_score is the largest weight / doc_norm in the list,
+    the per-term upper bound used for top-k early termination.
+
+    field_tfs, when present, is a flat uint16 array of the raw term
+    frequency in each field (num_fields per posting), for field-aware
+    scoring. positions, when present, holds each posting's compressed
+    token positions (see indexing.positions).
+    """
+
+    __slots__ = (
+        "doc_ids", "weights", "df", "idf", "max_score", "field_tfs", "positions",
+    )
+
+    def __init__(self, doc_ids, weights, idf=0.0, max_score=0.0, field_tfs=None,
+                 positions=None):
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.df = len(doc_ids)
+        self.idf = idf
+        self.max_score = max_score
+        self.field_tfs = field_tfs
+        self.positions = positions
+
+    @classmethod
+    def from_pairs(cls, pairs, idf=0.0):
+        """
+        Build from (doc_num, weight) pairs in any order; repeated doc
+        numbers are summed into a single posting.
+        """
+        merged = {}
+        for doc_num, weight in pairs:
+            merged[doc_num] = merged.get(doc_num, 0.0) + weight
+
+        doc_ids = array("i", sorted(merged))
+        weights = array("f", (merged[d] for d in doc_ids))
+        return cls(doc_ids, weights, idf)
+
+    @classmethod
+    def from_entries(cls, entries, idf=0.0):
+        """
+        Build from (doc_num, weight, field_tfs, encoded positions or
+        None) entries in any order. A repeated doc number replaces the
+        earlier entry.
+        """
+        merged = {}
+        for entry in entries:
+            merged[entry[0]] = entry
+
+        doc_ids = array("i", sorted(merged))
+        weights = array("f", (merged[d][1] for d in doc_ids))
+        field_tfs = array("H")
+        for d in doc_ids:
+            field_tfs.extend(merged[d][2])
+
+        positions = None
+        if doc_ids and merged[doc_ids[0]][3] is not None:
+            positions = Positions.from_encoded(merged[d][3] for d in doc_ids)
+
+        return cls(doc_ids, weights, idf, field_tfs=field_tfs, positions=positions)
+
+    def entries(self):
+        """
+        (doc_num, weight, field_tfs, encoded positions or None) per posting
+        """
+        n = len(self.field_tfs) // self.df if self.df else 0
+        tfs = self.field_tfs
+        positions = self.positions
+        for i, (doc_num, weight) in enumerate(self):
+            yield (
+                doc_num, weight, tfs[i * n:(i + 1) * n],
+                positions.encoded(i) if positions is not None else None,
+            )
+
+    def replace(self, **changes):
+        """
+        Copy with some attributes replaced; arrays are shared, not copied
+        """
+        fields = {
+            "doc_ids": self.doc_ids, "weights": self.weights, "idf": self.idf,
+            "max_score": self.max_score, "field_tfs": self.field_tfs,
+            "positions": self.positions,
+        }
+        fields.update(changes)
+        return PostingList(**fields)
+
+    def select(self, doc_nums):
+        """
+        Postings of the documents in doc_nums (ascending), for scoring
+        within a filtered set. idf and max_score are kept; max_score
+        remains an upper bound. Positions are not carried over.
+        """
+        doc_ids = self.doc_ids
+        indices = []
+
+        # Gallop through the longer list, driven by the shorter one
+        if len(doc_nums) < len(doc_ids):
+            i = 0
+            for doc_num in doc_nums:
+                i = gallop(doc_ids, doc_num, i)
+                if i == len(doc_ids):
+                    break
+                if doc_ids[i] == doc_num:
+                    indices.append(i)
+        else:
+            j = 0
+            for i, doc_num in enumerate(doc_ids):
+                j = gallop(doc_nums, doc_num, j)
+                if j == len(doc_nums):
+                    break
+                if doc_nums[j] == doc_num:
+                    indices.append(i)
+
+        field_tfs = None
+        if self.field_tfs is not None:
+            n = len(self.field_tfs) // self.df if self.df else 0
+            field_tfs = array("H")
+            for i in indices:
+                field_tfs.extend(self.field_tfs[i * n:(i + 1) * n])
+
+        return PostingList(
+            array("i", (doc_ids[i] for i in indices)),
+            array("f", (self.weights[i] for i in indices)),
+            self.idf, self.max_score, field_tfs,
+        )
+
+    def with_idf(self, idf):
+        return self.replace(idf=idf)
+
+    def with_max_score(self, doc_norms):
+        max_score = max(
+            (w / doc_norms[d] for d, w in self if doc_norms[d]),
+            default=0.0
+        )
+        return self.replace(max_score=max_score)
+
+    def __len__(self):
+        return self.df
+
+    def __iter__(self):
+        return zip(self.doc_ids, self.weights)
+
+    def __getstate__(self):
+        return (
+            self.doc_ids, self.weights, self.idf, self.max_score,
+            self.field_tfs, self.positions,
+        )
+
+    def __setstate__(self, state):
+        state += (None,) * (6 - len(state))
+        (self.doc_ids, self.weights, self.idf, self.max_score,
+         self.field_tfs, self.positions) = state
+        self.df = len(self.doc_ids)
@@ -0,0 +1,310 @@
+"""
+Query syntax:
+
+    mathematical modelling        terms, ranked as a bag of words
+    "mathematical modelling"      phrase: the terms must be consecutive
+    fluid NEAR/3 dynamics         both within 3 positions, either order
+    fluid AND dynamics            both terms required
+    fluid OR dynamics             either term
+    NOT survey                    excludes matching documents
+    (fluid OR gas) AND flow       parentheses group
+    author:smith title:"neural network"
+                                  term or phrase in one field
+    year:2023  year:2019..2023  year:2020..  year:..2015
+                                  publication year or year range
+
+AND binds tighter than OR. Terms written next to each other without an
+operator keep their bag-of-words meaning: everything except plain terms
+(phrases, NEAR, fielded terms, year ranges and groups) is required,
+and plain terms next to required parts only affect ranking. So
+
+    author:smith year:2023 fluid dynamics
+
+finds papers by smith from 2023, those about fluid dynamics first. NOT
+only excludes: "smith NOT survey" still needs smith.
+
+Operators are upper case; lower case "and", "or", "not" are stopwords.
+Operands go through the same analyzer as documents, so stopwords inside a
+phrase are skipped on both sides. Malformed queries never raise: stray
+operators and unbalanced parentheses are ignored.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from indexing.text_preprocessor import QUERY_CACHE_SIZE, TextPreprocessor
+
+
+# Positions between fields are FIELD_GAP apart; larger NEAR distances
+# are clamped so they never match across fields
+MAX_NEAR = 50
+
+# Bounds for open year ranges such as year:2020..
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+# Field prefixes accepted in queries -> indexed field
+FIELD_PREFIXES = {
+    "title": "title",
+    "author": "authors",
+    "authors": "authors",
+    "year": "year",
+    "abstract": "abstract",
+    "keyword": "keywords",
+    "keywords": "keywords",
+}
+
+LEXER_RE = re.compile(
+    r'(?:(\w+):)?(?:"([^"]*)"?|([^\s()"]+))|([()])'
+)
+NEAR_RE = re.compile(r"NEAR/(\d+)")
+YEAR_RANGE_RE = re.compile(r"(\d{4})?\.\.(\d{4})?")
+
+OPERATORS = ("AND", "OR", "NOT")
+
+# -------- QUERY TREE --------
+# field is None for "any field"
+Term = namedtuple("Term", ["field", "token"])
+Phrase = namedtuple("Phrase", ["field", "tokens"])
+Near = namedtuple("Near", ["left", "right", "k"])
+YearRange = namedtuple("YearRange", ["start", "end"])
+And = namedtuple("And", ["children"])
+Or = namedtuple("Or", ["children"])
+Not = namedtuple("Not", ["child"])
+# Scored but not required; only appears inside And
+Optional = namedtuple("Optional", ["child"])
+
+# tokens: analyzed tokens of the positive operands, for scoring
+# match: query tree the results must satisfy, or None when the query is
+#        a plain bag of words (any matching term is enough)
+ParsedQuery = namedtuple("ParsedQuery", ["tokens", "match"])
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def parse_query(query, stem=False):
+    parser = _Parser(_lex(query), stem)
+    node = parser.sequence()
+
+    if node is None or _is_bag_of_words(node):
+        return ParsedQuery(tuple(_positive_tokens(node)), None)
+    return ParsedQuery(tuple(_positive_tokens(node)), node)
+
+
+def _lex(query):
+    """
+    Query -> list of ("(",) / (")",) / (operator,) / ("NEAR", k) /
+    ("TEXT", field or None, text, quoted)
+    """
+    lexemes = []
+    for match in LEXER_RE.finditer(query):
+        prefix, phrase, word, paren = match.groups()
+        if paren:
+            lexemes.append((paren,))
+            continue
+
+        field = FIELD_PREFIXES.get(prefix.lower()) if prefix else None
+        if prefix and field is None:
+            # Not a field ("ratio:2"): the whole chunk is text
+            field, word, phrase = None, match.group(0), None
+
+        if phrase is not None:
+            lexemes.append(("TEXT", field, phrase, True))
+        elif field is None and word in OPERATORS:
+            lexemes.append((word,))
+        elif field is None and NEAR_RE.fullmatch(word):
+            k = int(NEAR_RE.fullmatch(word).group(1))
+            lexemes.append(("NEAR", min(k, MAX_NEAR)))
+        else:
+            lexemes.append(("TEXT", field, word, False))
+    return lexemes
+
+
+class _Parser:
+    """
+    Recursive descent over the lexemes:
+
+        sequence := or_expr*
+        or_expr  := and_expr ("OR" and_expr)*
+        and_expr := unary ("AND" unary)*
+        unary    := "NOT" unary | primary
+        primary  := "(" sequence ")" | operand ("NEAR/k" operand)*
+    """
+
+    def __init__(self, lexemes, stem):
+        self.lexemes = lexemes
+        self.pos = 0
+        self.stem = stem
+
+    def peek(self):
+        if self.pos < len(self.lexemes):
+            return self.lexemes[self.pos]
+        return None
+
+    def take(self):
+        lexeme = self.peek()
+        self.pos += 1
+        return lexeme
+
+    def sequence(self, nested=False):
+        items = []
+        while True:
+            lexeme = self.peek()
+            if lexeme is None:
+                break
+            if lexeme[0] == ")":
+                if nested:
+                    break
+                self.take()
+                continue
+            if lexeme[0] in ("AND", "OR"):
+                self.take()
+                continue
+
+            node = self.or_expr()
+            if node is not None:
+                items.append(node)
+
+        negations = [n for n in items if isinstance(n, Not)]
+        required = [n for n in items if not _is_plain(n) and not isinstance(n, Not)]
+        optional = [n for n in items if _is_plain(n)]
+        if not required and not negations:
+            return _combine(Or, optional)
+        if optional:
+            # Next to negations alone the plain terms are what must match
+            plain = _combine(Or, optional)
+            required.append(Optional(plain) if required else plain)
+        return _combine(And, required + negations)
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == ("OR",):
+            self.take()
+            children.append(self.and_expr())
+        return _combine(Or, [c for c in children if c is not None])
+
+    def and_expr(self):
+        children = [self.unary()]
+        while self.peek() == ("AND",):
+            self.take()
+            children.append(self.unary())
+        return _combine(And, [c for c in children if c is not None])
+
+    def unary(self):
+        lexeme = self.peek()
+        if lexeme == ("NOT",):
+            self.take()
+            child = self.unary()
+            return Not(child) if child is not None else None
+        return self.primary()
+
+    def primary(self):
+        lexeme = self.take()
+        if lexeme is None:
+            return None
+
+        if lexeme[0] == "(":
+            node = self.sequence(nested=True)
+            if self.peek() == (")",):
+                self.take()
+            return node
+
+        if lexeme[0] != "TEXT":
+            # NEAR without a left operand, or an operator out of place
+            return None
+
+        node = self.operand(lexeme)
+        constraints = []
+        left = lexeme
+        while self.near_follows(left):
+            k = self.take()[1]
+            right = self.take()
+            constraints.append(Near(self.tokens(left), self.tokens(right), k))
+            left = right
+
+        if constraints:
+            return _combine(And, constraints)
+        return node
+
+    def near_follows(self, left):
+        """
+        True if the next lexemes are NEAR/k and a right operand; a NEAR
+        next to a stopword or a fielded operand is left unconsumed and
+        later ignored
+        """
+        if self.pos + 1 >= len(self.lexemes):
+            return False
+        near, right = self.lexemes[self.pos:self.pos + 2]
+        return (
+            near[0] == "NEAR" and right[0] == "TEXT"
+            and left[1] is None and right[1] is None
+            and bool(self.tokens(left)) and bool(self.tokens(right))
+        )
+
+    def tokens(self, lexeme):
+        return tuple(TextPreprocessor.analyze(lexeme[2], self.stem))
+
+    def operand(self, lexeme):
+        _, field, text, quoted = lexeme
+
+        if field == "year" and not quoted:
+            match = YEAR_RANGE_RE.fullmatch(text)
+            if match:
+                start, end = match.groups()
+                return YearRange(
+                    int(start) if start else MIN_YEAR,
+                    int(end) if end else MAX_YEAR,
+                )
+
+        tokens = self.tokens(lexeme)
+        if not tokens:
+            return None
+        if len(tokens) == 1:
+            return Term(field, tokens[0])
+        return Phrase(field, tokens)
+
+
+def _combine(kind, children):
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+
+    # Flatten nested And/And and Or/Or
+    flat = []
+    for child in children:
+        flat.extend(child.children if type(child) is kind else (child,))
+    return kind(tuple(flat))
+
+
+def _is_plain(node):
+    return type(node) is Term and node.field is None
+
+
+def _is_bag_of_words(node):
+    if type(node) is Or:
+        return all(_is_plain(c) for c in node.children)
+    return _is_plain(node)
+
+
+def _positive_tokens(node):
+    kind = type(node)
+    if kind is Term:
+        yield node.token
+    elif kind is Phrase:
+        yield from node.tokens
+    elif kind is Near:
+        yield from node.left
+        yield from node.right
+    elif kind is Optional:
+        yield from _positive_tokens(node.child)
+    elif kind in (And, Or):
+        previous = None
+        for child in node.children:
+            # In a NEAR chain (a NEAR/2 b NEAR/3 c) b is one operand
+            if type(child) is Near and type(previous) is Near \
+                    and child.left == previous.right:
+                yield from child.right
+            else:
+                yield from _positive_tokens(child)
+            previous = child
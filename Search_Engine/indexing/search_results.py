@@ -0,0 +1,35 @@
+from collections import namedtuple
+
+from utils.instrumentation import stage
+
+
+Hit = namedtuple("Hit", ["doc_id", "score"])
+
+
+class SearchResults(list):
+    """
+    Ranked Hits, best first.
+
+    total_hits is the number of documents that matched the query, which is
+    larger than len(self) when the search was limited to the top k.
+
+    Hits carry only the doc id and score; document() loads a stored
+    document on demand, so only the hits actually shown are fetched.
+    """
+
+    def __init__(self, results=(), total_hits=None, fetch=None):
+        super().__init__(results)
+        self.total_hits = len(self) if total_hits is None else total_hits
+        self.fetch = fetch
+
+    def document(self, hit):
+        with stage("documents"):
+            return self.fetch(hit.doc_id)
+
+    def documents(self, hits):
+        with stage("documents"):
+            return [self.fetch(hit.doc_id) for hit in hits]
+
+    def __reduce__(self):
+        # The fetcher is bound to an index and stays in its process
+        return (SearchResults, (list(self), self.total_hits))
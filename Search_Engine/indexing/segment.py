@@ -0,0 +1,503 @@
+"""
+Versioned, memory-mappable on-disk index segment.
+
+Layout (all struct fields little-endian, arrays in the writer's native
+byte order, recorded in META):
+
+    header   MAGIC | version u32 | section count u32
+    table    per section: name 8s | offset u64 | length u64
+    META     JSON: num_docs, num_terms, byteorder, analyzer options,
+             field names, weights and per-field token totals, positions
+             flag, facet author names
+    TERMS    per term (sorted by UTF-8 bytes): see TERM_ENTRY
+    STRINGS  concatenated UTF-8 term strings
+    POSTINGS per term: skip table and compressed blocks of doc number
+             gaps and per-field term frequencies, padded to 4 bytes
+             (see indexing.compression). Version 2 stored int32 doc
+             numbers, float32 weights and uint16 field tfs uncompressed.
+    NORMS    float64 document norms, indexed by doc number
+    FIELDLEN uint32 per-field token counts, one per field per doc number
+    POSOFFS  uint64 offset into POSDATA per term        (positional only)
+    POSDATA  per term: Positions.tobytes(), padded to 4 bytes
+    FYEARS   uint16 publication year per doc number (0 = unknown)
+    FAUTHOFS uint32 offsets into FAUTHIDS, num_docs + 1 entries
+    FAUTHIDS uint32 author ids (indexes into META author_names)
+    KEYOFFS  uint64 offsets into KEYS, num_docs + 1 entries
+    KEYS     JSON-encoded doc ids
+    DOCOFFS  uint64 offsets into DOCS, num_docs + 1 entries
+    DOCS     JSON-encoded stored documents
+
+Opening a segment maps the file read-only; postings, norms and stored
+documents are decoded only when they are asked for, so startup cost does
+not depend on corpus size and processes on one host share page cache.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from contextlib import ExitStack
+from itertools import chain
+
+from indexing.compression import BlockPostingList, encode_postings
+from indexing.facets import FacetIndex
+from indexing.positions import Positions
+from indexing.postings import PostingList
+
+
+MAGIC = b"SEIDX\x00\r\n"
+FORMAT_VERSION = 3
+
+# Version 1 segments have no field statistics and version 2 segments
+# uncompressed postings; both are still readable
+READABLE_VERSIONS = (1, 2, 3)
+
+# Decoded compressed PostingLists kept per segment, most recently used
+DECODED_CACHE_SIZE = 512
+
+HEADER = struct.Struct("<8sII")
+SECTION = struct.Struct("<8sQQ")
+
+# string offset, string length, df, postings offset, idf, max_score
+TERM_ENTRY = struct.Struct("<QIIQdd")
+
+SECTION_NAMES = (
+    b"META", b"TERMS", b"STRINGS", b"POSTINGS", b"NORMS",
+    b"KEYOFFS", b"KEYS", b"DOCOFFS", b"DOCS", b"FIELDLEN",
+)
+
+
+class SegmentError(ValueError):
+    pass
+
+
+def is_segment(filepath):
+    with open(filepath, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _write_with_offsets(values, f):
+    """
+    Write values JSON-encoded to f; returns their offsets
+    """
+    offsets = array("Q", [0])
+    for value in values:
+        chunk = _encode(value)
+        f.write(chunk)
+        offsets.append(offsets[-1] + len(chunk))
+    return offsets.tobytes()
+
+
+# -------------------------------------------------
+# WRITE
+# -------------------------------------------------
+def write_segment(filepath, terms, doc_keys, documents, doc_norms, fields,
+                  field_lengths, analyzer=None, facets=None, field_weights=None):
+    """
+    terms: mapping term -> PostingList with field_tfs, or (term,
+        PostingList) pairs sorted by the terms' UTF-8 bytes
+    doc_keys: doc ids in doc number order
+    documents: stored documents in doc number order
+    doc_norms: norms in doc number order
+    fields: field names, in field_tfs order
+    field_lengths: flat per-field token counts in doc number order
+    analyzer: text analysis options the terms were produced with
+    facets: FacetIndex over the same doc numbers, or None
+    field_weights: per-field boosts the weights were built with, in
+        fields order; weights that cannot be recomputed from them (or
+        all of them, without field_weights) are stored explicitly
+
+    Positions are written when the PostingLists carry them.
+
+    The file is written next to filepath and renamed into place, so
+    readers that still map the previous version are not disturbed. The
+    per-term sections and the stored documents are spilled to temporary
+    files as they are encoded, so one term's postings and one document
+    are held in memory at a time.
+    """
+    if isinstance(terms, Mapping):
+        terms = sorted(terms.items(), key=lambda item: item[0].encode("utf-8"))
+
+    with ExitStack() as stack:
+        def spill():
+            return stack.enter_context(tempfile.TemporaryFile(
+                prefix="segment-", dir=os.path.dirname(filepath) or None
+            ))
+
+        term_table, strings, postings_blob = spill(), spill(), spill()
+        position_offsets, positions_blob = spill(), spill()
+
+        terms = iter(terms)
+        first = next(terms, None)
+        with_positions = first is not None and first[1].positions is not None
+        num_terms = 0
+
+        for term, postings in chain([first] if first else [], terms):
+            encoded = term.encode("utf-8")
+            term_table.write(TERM_ENTRY.pack(
+                strings.tell(), len(encoded), postings.df,
+                postings_blob.tell(), postings.idf, postings.max_score
+            ))
+            strings.write(encoded)
+            postings_blob.write(
+                encode_postings(postings, len(fields), field_weights or ())
+            )
+            num_terms += 1
+
+            if with_positions:
+                position_offsets.write(array("Q", [positions_blob.tell()]).tobytes())
+                data = postings.positions.tobytes()
+                positions_blob.write(data + b"\0" * (-len(data) % 4))
+
+        field_lengths = array("I", field_lengths)
+        totals = [sum(field_lengths[f::len(fields)]) for f in range(len(fields))]
+
+        keys, docs = spill(), spill()
+        key_offsets = _write_with_offsets(doc_keys, keys)
+        doc_offsets = _write_with_offsets(documents, docs)
+
+        meta = {
+            "num_docs": len(doc_norms),
+            "num_terms": num_terms,
+            "byteorder": sys.byteorder,
+            "analyzer": analyzer or {},
+            "fields": list(fields),
+            "field_weights": list(field_weights) if field_weights else None,
+            "field_length_totals": totals,
+            "positions": with_positions,
+            "author_names": facets.author_names if facets is not None else None,
+        }
+
+        sections = dict(zip(SECTION_NAMES, (
+            _encode(meta), term_table, strings,
+            postings_blob, array("d", doc_norms).tobytes(),
+            key_offsets, keys, doc_offsets, docs, field_lengths.tobytes(),
+        )))
+        if with_positions:
+            sections[b"POSOFFS"] = position_offsets
+            sections[b"POSDATA"] = positions_blob
+        if facets is not None:
+            sections[b"FYEARS"] = array("H", facets.years).tobytes()
+            sections[b"FAUTHOFS"] = array("I", facets.author_offsets).tobytes()
+            sections[b"FAUTHIDS"] = array("I", facets.author_ids).tobytes()
+        _write_sections(filepath, sections)
+
+
+def _write_sections(filepath, sections):
+    def size(data):
+        return len(data) if isinstance(data, bytes) else data.tell()
+
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        offset = HEADER.size + SECTION.size * len(sections)
+        table = []
+        for name, data in sections.items():
+            offset += -offset % 8
+            table.append((name, offset, size(data)))
+            offset += size(data)
+
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for entry in table:
+            f.write(SECTION.pack(*entry))
+
+        for (_, section_offset, _), data in zip(table, sections.values()):
+            f.write(b"\0" * (section_offset - f.tell()))
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                data.seek(0)
+                shutil.copyfileobj(data, f)
+
+    os.replace(tmp_path, filepath)
+
+
+# -------------------------------------------------
+# READ
+# -------------------------------------------------
+class Segment:
+    def __init__(self, filepath):
+        self.path = filepath
+
+        with open(filepath, "rb") as f:
+            self._stat = os.fstat(f.fileno())
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SegmentError("empty segment file")
+
+        self._view = memoryview(self._mm)
+
+        magic, version, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise SegmentError("not an index segment")
+        if version not in READABLE_VERSIONS:
+            raise SegmentError(f"unsupported segment version {version}")
+        self.version = version
+
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(
+                self._mm, HEADER.size + i * SECTION.size
+            )
+            self._sections[name.rstrip(b"\0")] = (offset, length)
+
+        self.meta = json.loads(bytes(self._section(b"META")))
+        if self.meta["byteorder"] != sys.byteorder:
+            raise SegmentError("segment was written with a different byte order")
+
+        self.num_docs = self.meta["num_docs"]
+        self.num_terms = self.meta["num_terms"]
+
+        # None for version 1 segments, which carry no field statistics
+        self.fields = self.meta.get("fields")
+        self.field_length_totals = self.meta.get("field_length_totals")
+        self._num_fields = len(self.fields) if self.fields else 0
+        self._field_weights = self.meta.get("field_weights") or ()
+
+        self._decoded = OrderedDict()
+        self._decoded_lock = threading.Lock()
+
+        self._terms = self._section(b"TERMS")
+        self._strings = self._section(b"STRINGS")
+        self._postings = self._section(b"POSTINGS")
+        self._key_offsets = self._section(b"KEYOFFS").cast("Q")
+        self._keys = self._section(b"KEYS")
+        self._doc_offsets = self._section(b"DOCOFFS").cast("Q")
+        self._docs = self._section(b"DOCS")
+
+        self.doc_norms = self._section(b"NORMS").cast("d")
+        self.field_lengths = (
+            self._section(b"FIELDLEN").cast("I") if self.fields else None
+        )
+
+        self.positions = bool(self.meta.get("positions"))
+        self._position_offsets = self._positions = None
+        if self.positions:
+            self._position_offsets = self._section(b"POSOFFS").cast("Q")
+            self._positions = self._section(b"POSDATA")
+
+        # Segments written before facets existed have none; the index
+        # builds them from the stored documents
+        self.facets = None
+        self._facet_views = ()
+        if self.meta.get("author_names") is not None:
+            self._facet_views = (
+                self._section(b"FYEARS").cast("H"),
+                self._section(b"FAUTHOFS").cast("I"),
+                self._section(b"FAUTHIDS").cast("I"),
+            )
+            self.facets = FacetIndex(*self._facet_views, self.meta["author_names"])
+
+        self.terms = SegmentTerms(self)
+        self.doc_keys = SegmentDocKeys(self)
+        self.documents = SegmentDocuments(self)
+
+    def is_current(self):
+        """
+        True while self.path still names the mapped file (it has not
+        been replaced by a newer save)
+        """
+        try:
+            return os.path.samestat(self._stat, os.stat(self.path))
+        except OSError:
+            return False
+
+    def _section(self, name):
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    # -------- TERMS --------
+    def _term_at(self, i):
+        str_off, str_len = TERM_ENTRY.unpack_from(self._terms, i * TERM_ENTRY.size)[:2]
+        return bytes(self._strings[str_off:str_off + str_len])
+
+    def _find_term(self, encoded):
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_at(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_terms and self._term_at(lo) == encoded:
+            return lo
+        return None
+
+    def postings_at(self, i):
+        """
+        PostingList of term i. Compressed lists are kept once decoded,
+        so repeated queries do not decode them again.
+        """
+        if self.version < 3:
+            return self._read_postings(i)
+
+        with self._decoded_lock:
+            postings = self._decoded.get(i)
+            if postings is not None:
+                self._decoded.move_to_end(i)
+                return postings
+
+        postings = self._read_postings(i)
+        with self._decoded_lock:
+            self._decoded[i] = postings
+            while len(self._decoded) > DECODED_CACHE_SIZE:
+                self._decoded.popitem(last=False)
+        return postings
+
+    def _read_postings(self, i):
+        _, _, df, offset, idf, max_score = TERM_ENTRY.unpack_from(
+            self._terms, i * TERM_ENTRY.size
+        )
+
+        positions = None
+        if self.positions:
+            positions = Positions.frombuffer(
+                self._positions[self._position_offsets[i]:], df
+            )
+
+        if self.version >= 3:
+            return BlockPostingList(
+                self._postings[offset:], df, idf, max_score,
+                self._num_fields, self._field_weights, positions,
+            )
+
+        doc_ids = self._postings[offset:offset + 4 * df].cast("i")
+        weights = self._postings[offset + 4 * df:offset + 8 * df].cast("f")
+
+        field_tfs = None
+        if self._num_fields:
+            start = offset + 8 * df
+            field_tfs = self._postings[
+                start:start + 2 * df * self._num_fields
+            ].cast("H")
+
+        return PostingList(doc_ids, weights, idf, max_score, field_tfs, positions)
+
+    def postings(self, term):
+        i = self._find_term(term.encode("utf-8"))
+        return None if i is None else self.postings_at(i)
+
+    # -------- DOCUMENTS --------
+    def doc_key(self, doc_num):
+        start, end = self._key_offsets[doc_num], self._key_offsets[doc_num + 1]
+        return json.loads(bytes(self._keys[start:end]))
+
+    def document(self, doc_num):
+        start, end = self._doc_offsets[doc_num], self._doc_offsets[doc_num + 1]
+        return json.loads(bytes(self._docs[start:end]))
+
+    def close(self):
+        self._decoded.clear()
+        for view in (
+            self._terms, self._strings, self._postings, self._key_offsets,
+            self._keys, self._doc_offsets, self._docs, self.doc_norms,
+            self.field_lengths, self._position_offsets, self._positions,
+            *self._facet_views, self._view,
+        ):
+            if view is not None:
+                view.release()
+
+        try:
+            self._mm.close()
+        except BufferError:
+            # Postings views are still referenced; the mapping is released
+            # once they are garbage collected
+            pass
+
+
+class SegmentTerms(Mapping):
+    """
+    Read-only term dictionary: term -> PostingList decoded on access
+    """
+
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __getitem__(self, term):
+        postings = self._segment.postings(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def __contains__(self, term):
+        return self._segment._find_term(term.encode("utf-8")) is not None
+
+    def __iter__(self):
+        for i in range(self._segment.num_terms):
+            yield self._segment._term_at(i).decode("utf-8")
+
+    def __len__(self):
+        return self._segment.num_terms
+
+    def items(self):
+        # A full scan bypasses the decoded cache instead of flushing it
+        for i in range(self._segment.num_terms):
+            term = self._segment._term_at(i).decode("utf-8")
+            yield term, self._segment._read_postings(i)
+
+
+class SegmentDocKeys(Sequence):
+    """
+    Read-only doc number -> doc id list
+    """
+
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __getitem__(self, doc_num):
+        if isinstance(doc_num, slice):
+            return [self[i] for i in range(*doc_num.indices(len(self)))]
+        if not 0 <= doc_num < len(self):
+            raise IndexError(doc_num)
+        return self._segment.doc_key(doc_num)
+
+    def __len__(self):
+        return self._segment.num_docs
+
+
+class SegmentDocuments(Mapping):
+    """
+    Read-only doc id -> stored document mapping.
+
+    Iteration walks the stored documents in doc number order; lookup by
+    doc id builds the doc id -> doc number table on first use.
+    """
+
+    def __init__(self, segment):
+        self._segment = segment
+        self._doc_nums = None
+
+    def doc_num(self, doc_id):
+        if self._doc_nums is None:
+            self._doc_nums = {
+                key: n for n, key in enumerate(self._segment.doc_keys)
+            }
+        return self._doc_nums[doc_id]
+
+    def __getitem__(self, doc_id):
+        return self._segment.document(self.doc_num(doc_id))
+
+    def __iter__(self):
+        return iter(self._segment.doc_keys)
+
+    def __len__(self):
+        return self._segment.num_docs
+
+    def values(self):
+        for n in range(self._segment.num_docs):
+            yield self._segment.document(n)
+
+    def items(self):
+        for n in range(self._segment.num_docs):
+            yield self._segment.doc_key(n), self._segment.document(n)
@@ -0,0 +1,446 @@
+"""
+Document-partitioned index: N AdvancedInvertedIndex shards searched
+scatter-gather.
+
+Documents are assigned to shards by a stable hash of their doc id. Each
+shard is an ordinary segment file; the directory also holds a manifest
+recording the shard files and, per document in build order, its shard:
+
+    shards.json   {"version", "shards": [file names], "order": [shard]}
+    shard-000.seg ...
+
+Shards score with corpus-wide statistics: the shard builds are finalized
+with the summed document frequencies, so document norms are those of a
+single index, and at query time idf is computed from the df summed over
+all shards. Per-shard top-k lists are merged by score and then by build
+order, the tie-break of a single index, so a ShardedIndex returns the
+ranking the same documents would get from one AdvancedInvertedIndex.
+"""
+
+import heapq
+import json
+import os
+import zlib
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice, repeat
+
+from indexing.facets import FACET_FIELDS, normalize_filters
+from indexing.inverted_index import (
+    DEFAULT_BACKEND, DEFAULT_CACHE_SIZE, PROXIMITY_WINDOW,
+    AdvancedInvertedIndex,
+)
+from indexing.query_cache import QueryCache
+from indexing.query_parser import parse_query
+from indexing.search_results import Hit, SearchResults
+
+
+MANIFEST = "shards.json"
+MANIFEST_VERSION = 1
+
+# Summed document frequencies kept per ShardedIndex, most recently used
+DF_CACHE_SIZE = 4096
+
+# num_docs: live documents in the corpus
+# df: mapping term -> document frequency in the corpus (.get(term, default))
+# field_length_totals: per-field token totals over the corpus
+CorpusStats = namedtuple("CorpusStats", ["num_docs", "df", "field_length_totals"])
+
+
+def shard_of(doc_id, num_shards):
+    """
+    Shard holding doc_id; stable across processes and runs, unlike hash()
+    """
+    return zlib.crc32(str(doc_id).encode("utf-8")) % num_shards
+
+
+def shard_path(directory, shard_num):
+    return os.path.join(directory, f"shard-{shard_num:03d}.seg")
+
+
+class ShardFrequencies:
+    """
+    term -> document frequency summed over the shards, looked up in each
+    shard's term dictionary when first asked for
+    """
+
+    def __init__(self, shards):
+        self._shards = shards
+        self._df = lru_cache(maxsize=DF_CACHE_SIZE)(self._sum)
+
+    def _sum(self, term):
+        return sum(shard._live_df(term) for shard in self._shards)
+
+    def get(self, term, default=None):
+        return self._df(term)
+
+
+def open_shards(paths, backend=DEFAULT_BACKEND):
+    """
+    Load the shard segments and give each the statistics of all of them
+    """
+    shards = []
+    for path in paths:
+        shard = AdvancedInvertedIndex(backend=backend, cache_size=0)
+        if not shard.load(path):
+            for opened in shards:
+                opened.close()
+            return None
+        shards.append(shard)
+
+    stats = CorpusStats(
+        sum(len(shard.documents) for shard in shards),
+        ShardFrequencies(shards),
+        [sum(totals) for totals in zip(*(s._field_length_totals for s in shards))],
+    )
+    for shard in shards:
+        shard.corpus_stats = stats
+    return shards
+
+
+class ShardedIndex:
+    def __init__(self, num_shards=4, stem=False, positions=False,
+                 backend=DEFAULT_BACKEND, processes=None,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param num_shards: number of shards build() partitions into
+        :param stem, positions: analysis options of the shards, as for
+            AdvancedInvertedIndex; load() takes them from the shards
+        :param processes: with processes > 1, shards are built and
+            searched in that many worker processes, which map the shard
+            segments read-only; otherwise everything runs in this process
+        :param cache_size: merged search results kept in an LRU cache;
+            0 disables it
+        """
+        self.num_shards = num_shards
+        self.stem = stem
+        self.positions = positions
+        self.backend = backend
+        self.processes = processes
+        self.cache = QueryCache(cache_size) if cache_size else None
+
+        self.generation = 0
+        self.directory = None
+
+        # Loaded shard indexes and, per shard, doc_num -> build order
+        self.shards = []
+        self._ordinals = []
+
+        # Search workers, started on the first search that needs them
+        self._pool = None
+
+    def __len__(self):
+        return sum(len(shard.documents) for shard in self.shards)
+
+    # -------------------------------------------------
+    # BUILD (SHARDS IN PARALLEL, TWO PASSES)
+    # -------------------------------------------------
+    def build(self, documents, directory):
+        """
+        Index documents (doc_id -> doc_data, or a stream of (doc_id,
+        doc_data) pairs such as keyed_publications(iter_jsonl(path)))
+        into num_shards shards under directory and open them. A repeated
+        doc_id replaces the earlier document.
+
+        The first pass indexes each shard's documents and reports its
+        document frequencies; the second finalizes every shard with the
+        summed statistics, which the norms depend on.
+        """
+        self.close()
+        os.makedirs(directory, exist_ok=True)
+
+        parts = [[] for _ in range(self.num_shards)]
+        order = []
+        ordinals = {}
+        items = documents.items() if hasattr(documents, "items") else documents
+        for doc_id, doc_data in items:
+            # A replaced document moves to the end, as in a single index
+            replaced = ordinals.get(doc_id)
+            if replaced is not None:
+                order[replaced] = None
+            ordinals[doc_id] = len(order)
+
+            shard_num = shard_of(doc_id, self.num_shards)
+            parts[shard_num].append((doc_id, doc_data))
+            order.append(shard_num)
+
+        paths = [shard_path(directory, n) for n in range(self.num_shards)]
+        options = (self.stem, self.positions, self.backend)
+
+        if self.processes and self.processes > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(self.processes, self.num_shards)
+            ) as pool:
+                partials = list(pool.map(
+                    _build_shard, paths, parts, *map(repeat, options)
+                ))
+                stats = _sum_stats(partials)
+                list(pool.map(_finalize_shard, paths, repeat(stats), *map(repeat, options)))
+        else:
+            partials = [_build_shard(p, part, *options) for p, part in zip(paths, parts)]
+            stats = _sum_stats(partials)
+            for path in paths:
+                _finalize_shard(path, stats, *options)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "shards": [os.path.basename(p) for p in paths],
+            "order": [shard_num for shard_num in order if shard_num is not None],
+        }
+        tmp_path = os.path.join(directory, MANIFEST + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+        return self.load(directory)
+
+    # -------------------------------------------------
+    # LOAD
+    # -------------------------------------------------
+    def load(self, directory):
+        """
+        Open the shards saved under directory; False if there are none
+        """
+        manifest_path = os.path.join(directory, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return False
+
+        self.close()
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return False
+
+        paths = [os.path.join(directory, name) for name in manifest["shards"]]
+        shards = open_shards(paths, self.backend)
+        if shards is None:
+            return False
+
+        ordinals = [[] for _ in shards]
+        for ordinal, shard_num in enumerate(manifest["order"]):
+            ordinals[shard_num].append(ordinal)
+
+        self.directory = directory
+        self.shards = shards
+        self._ordinals = ordinals
+        self.num_shards = len(shards)
+        self.stem = shards[0].stem
+        self.positions = shards[0].positions
+        self.generation += 1
+        return True
+
+    # -------------------------------------------------
+    # SEARCH (SCATTER-GATHER)
+    # -------------------------------------------------
+    def search(self, query, k=None, bm25f=None, filters=None):
+        """
+        Rank documents for query over all shards, best first; arguments
+        and results as for AdvancedInvertedIndex.search
+        """
+        return self.search_many([query], k, bm25f, filters)[0]
+
+    def search_many(self, queries, k=None, bm25f=None, filters=None):
+        """
+        Run a batch of queries; each shard ranks the whole batch in one
+        task, so a batch costs one round trip per shard
+        """
+        parsed = [parse_query(q, self.stem) for q in queries]
+        filters = normalize_filters(filters)
+        generation = self.generation
+
+        results = [None] * len(parsed)
+        missing = []
+        for i, query in enumerate(parsed):
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.get((query, k, bm25f, filters), generation)
+            if cached is None:
+                missing.append(i)
+            else:
+                results[i] = SearchResults(cached, cached.total_hits, cached.fetch)
+
+        if missing:
+            batch = [parsed[i] for i in missing]
+            for i, merged in zip(missing, self._scatter(batch, k, bm25f, filters)):
+                if self.cache is not None:
+                    self.cache.put((parsed[i], k, bm25f, filters), generation, merged)
+                results[i] = SearchResults(merged, merged.total_hits, merged.fetch)
+        return results
+
+    def _scatter(self, queries, k, bm25f, filters):
+        if self.processes and self.processes > 1 and len(self.shards) > 1:
+            pool = self._search_pool()
+            futures = [
+                pool.submit(_search_shard, n, queries, k, bm25f, filters)
+                for n in range(len(self.shards))
+            ]
+            per_shard = [f.result() for f in futures]
+        else:
+            per_shard = [
+                _rank_queries(shard, queries, k, bm25f, filters)
+                for shard in self.shards
+            ]
+
+        return [
+            self._gather(query, k, [ranked[i] for ranked in per_shard])
+            for i, query in enumerate(queries)
+        ]
+
+    def _search_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=min(self.processes, len(self.shards)),
+                initializer=_init_shard_worker,
+                initargs=([s._segment.path for s in self.shards], self.backend),
+            )
+        return self._pool
+
+    def _gather(self, query, k, per_shard):
+        """
+        Merge per-shard ([(doc_num, score)], total hits) into one
+        SearchResults
+        """
+        total_hits = sum(total for _, total in per_shard)
+
+        # (-score, build order, shard, doc_num): each shard's list is
+        # already in this order, ties going to the earlier document
+        merged = heapq.merge(*(
+            [(-score, self._ordinals[s][d], s, d) for d, score in ranked]
+            for s, (ranked, _) in enumerate(per_shard)
+        ))
+
+        boost = self.positions and len(set(query.tokens)) > 1
+        window = k
+        if boost and k is not None:
+            window = max(k, PROXIMITY_WINDOW)
+        top = list(islice(merged, window))
+
+        if boost:
+            top = self._proximity_boost(top, query.tokens)
+
+        hits = [
+            Hit(self.shards[s].doc_keys[d], -neg_score)
+            for neg_score, _, s, d in top[:k]
+        ]
+        return SearchResults(hits, total_hits, self.get_document)
+
+    def _proximity_boost(self, top, tokens):
+        """
+        Boost the best PROXIMITY_WINDOW merged results, each by the shard
+        holding its positions, and reorder them
+        """
+        window = top[:PROXIMITY_WINDOW]
+
+        boosted = []
+        for s, shard in enumerate(self.shards):
+            ranked = [(d, -neg_score) for neg_score, _, shard_num, d in window if shard_num == s]
+            if ranked:
+                boosted.extend(
+                    (-score, self._ordinals[s][d], s, d)
+                    for d, score in shard._proximity_boost(ranked, tokens)
+                )
+
+        boosted.sort()
+        return boosted + top[PROXIMITY_WINDOW:]
+
+    # -------------------------------------------------
+    # FACETS AND DOCUMENTS
+    # -------------------------------------------------
+    def facet_counts(self, query=None, filters=None, limit=None):
+        """
+        Facet counts summed over the shards; see
+        AdvancedInvertedIndex.facet_counts
+        """
+        totals = {field: Counter() for field in FACET_FIELDS}
+        for shard in self.shards:
+            for field, values in shard.facet_counts(query, filters).items():
+                totals[field].update(dict(values))
+
+        return {
+            field: sorted(counts.items(), key=lambda x: (-x[1], str(x[0])))[:limit]
+            for field, counts in totals.items()
+        }
+
+    def get_document(self, doc_id):
+        if not self.shards:
+            return None
+        return self.shards[shard_of(doc_id, len(self.shards))].get_document(doc_id)
+
+    def close(self):
+        """
+        Stop the search workers and release the shard segments
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+        self._ordinals = []
+
+
+def _rank_queries(shard, queries, k, bm25f, filters):
+    term_cache = {}
+    return [
+        shard._rank(query, k, term_cache, bm25f, filters, shard._boosted(query))
+        for query in queries
+    ]
+
+
+def _sum_stats(partials):
+    df = Counter()
+    for partial in partials:
+        df.update(partial.df)
+    return CorpusStats(
+        sum(p.num_docs for p in partials),
+        dict(df),
+        [sum(totals) for totals in zip(*(p.field_length_totals for p in partials))],
+    )
+
+
+# -------------------------------------------------
+# BUILD AND SEARCH WORKER PROCESSES
+# -------------------------------------------------
+def _build_shard(path, documents, stem, positions, backend):
+    """
+    Index one shard's documents and save them unfinalized; returns the
+    shard's own CorpusStats
+    """
+    shard = AdvancedInvertedIndex(
+        stem=stem, positions=positions, backend=backend, cache_size=0
+    )
+    for doc_id, doc_data in documents:
+        shard.add_document(doc_id, doc_data)
+    shard.save(path)
+
+    return CorpusStats(
+        len(shard.documents),
+        {term: postings.df for term, postings in shard.index.items()},
+        list(shard._field_length_totals),
+    )
+
+
+def _finalize_shard(path, stats, stem, positions, backend):
+    shard = AdvancedInvertedIndex(
+        stem=stem, positions=positions, backend=backend, cache_size=0
+    )
+    shard.load(path)
+    shard.corpus_stats = stats
+    shard.finalize()
+    shard.save(path)
+    shard.close()
+
+
+# Shards opened by each search worker; every worker maps all of them
+# (sharing the page cache), as idf needs the df of every shard
+_worker_shards = None
+
+
+def _init_shard_worker(paths, backend):
+    global _worker_shards
+    _worker_shards = open_shards(paths, backend)
+
+
+def _search_shard(shard_num, queries, k, bm25f=None, filters=None):
+    return _rank_queries(_worker_shards[shard_num], queries, k, bm25f, filters)
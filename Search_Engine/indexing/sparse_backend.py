@@ -0,0 +1,120 @@
+"""
+Optional NumPy/SciPy scoring backend.
+
+The finalized postings are held as one CSR matrix (a row per term, a
+column per document number) of weighted term frequencies. idf is applied
+on the query side, so a query is a single sparse matrix-vector product
+over the query's rows and document norms are a bincount over the matrix.
+Contributions are summed in the same order as the pure-Python scorer,
+so both backends produce identical scores and rankings.
+"""
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+AVAILABLE = np is not None
+
+
+class SparseIndex:
+    def __init__(self, terms, num_docs):
+        """
+        terms: mapping term -> PostingList, in the order the scorer
+        iterates them
+        """
+        self.num_docs = num_docs
+        self.term_rows = {}
+
+        doc_ids = []
+        weights = []
+        df = []
+        for row, (term, postings) in enumerate(terms.items()):
+            self.term_rows[term] = row
+            doc_ids.append(np.frombuffer(postings.doc_ids, dtype=np.int32))
+            weights.append(np.frombuffer(postings.weights, dtype=np.float32))
+            df.append(postings.df)
+
+        self.df = np.array(df, dtype=np.int64)
+        indptr = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(self.df, out=indptr[1:])
+
+        indices = np.concatenate(doc_ids) if doc_ids else np.zeros(0, np.int32)
+        data = (
+            np.concatenate(weights).astype(np.float64)
+            if weights else np.zeros(0)
+        )
+
+        self.matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(df), num_docs)
+        )
+
+    # -------------------------------------------------
+    # FINALIZE
+    # -------------------------------------------------
+    def norms(self, idf):
+        """
+        Document vector norms for per-term idf values (row order)
+        """
+        m = self.matrix
+        weighted = m.data * np.repeat(np.asarray(idf, dtype=np.float64), self.df)
+        return np.sqrt(np.bincount(
+            m.indices, weights=weighted * weighted, minlength=self.num_docs
+        ))
+
+    def max_scores(self, doc_norms):
+        """
+        Per-term max(weight / doc_norm), the MaxScore upper bounds
+        """
+        m = self.matrix
+        if not m.nnz:
+            return np.zeros(m.shape[0])
+
+        doc_norms = np.asarray(doc_norms, dtype=np.float64)
+        norms = doc_norms[m.indices]
+        ratio = np.divide(
+            m.data, norms, out=np.zeros_like(m.data), where=norms != 0
+        )
+        return np.maximum.reduceat(ratio, m.indptr[:-1])
+
+    # -------------------------------------------------
+    # SEARCH
+    # -------------------------------------------------
+    def search(self, term_weights, query_norm, doc_norms, k=None):
+        """
+        term_weights: term -> query weight * idf, in query order.
+        Returns ([(doc_num, score)] best first, total_hits); ties go to
+        the lower doc number.
+        """
+        rows = [self.term_rows[t] for t in term_weights if t in self.term_rows]
+        if not rows:
+            return [], 0
+
+        q = np.array(
+            [w for t, w in term_weights.items() if t in self.term_rows],
+            dtype=np.float64,
+        )
+        dots = self.matrix[rows].T @ q
+
+        doc_norms = np.asarray(doc_norms, dtype=np.float64)
+        matched = np.flatnonzero(dots)
+        matched = matched[doc_norms[matched] != 0]
+        scores = dots[matched] / (query_norm * doc_norms[matched])
+
+        if k is not None and k < len(matched):
+            if k <= 0:
+                return [], len(matched)
+            # Keep everything tied with the k-th score, then break ties
+            kth = -np.partition(-scores, k - 1)[k - 1]
+            keep = scores >= kth
+            candidates, candidate_scores = matched[keep], scores[keep]
+        else:
+            candidates, candidate_scores = matched, scores
+
+        order = np.lexsort((candidates, -candidate_scores))[:k]
+        ranked = list(zip(
+            candidates[order].tolist(), candidate_scores[order].tolist()
+        ))
+        return ranked, len(matched)
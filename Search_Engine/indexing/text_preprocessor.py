@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 STOP_WORDS = {
     'a','an','and','are','as','at','be','by','for','from','has','he',
@@ -9,11 +10,67 @@ STOP_WORDS = {
     'can','just','should','now'
 }
 
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+CHUNK_RE = re.compile(r'\S+')
+VOWEL_RE = re.compile(r'[aeiouy]')
+
+QUERY_CACHE_SIZE = 1024
+TOKEN_TABLE_SIZE = 200000
+
+# lowercased whitespace chunk -> token ('' when filtered out) and
+# token -> stem, both filled on first use and cleared when they reach
+# TOKEN_TABLE_SIZE entries
+_TOKEN_TABLE = {}
+_STEM_TABLE = {}
+
+
+def _token(chunk):
+    token = _TOKEN_TABLE.get(chunk)
+    if token is None:
+        token = PUNCTUATION_RE.sub('', chunk)
+        if len(token) <= 2 or token in STOP_WORDS:
+            token = ''
+        if len(_TOKEN_TABLE) >= TOKEN_TABLE_SIZE:
+            _TOKEN_TABLE.clear()
+        _TOKEN_TABLE[chunk] = token
+    return token
+
+
+def _strip_suffixes(word):
+    """
+    Light English suffix stripper: plurals, -ing/-ed, a trailing e and
+    doubled final consonants ("modelling", "modelled", "models" -> "model")
+    """
+    if len(word) <= 3:
+        return word
+
+    if word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+
+    for suffix in ("ing", "ed"):
+        stem = word[:-len(suffix)]
+        if word.endswith(suffix) and len(stem) >= 3 and VOWEL_RE.search(stem):
+            word = stem
+            break
+
+    if len(word) >= 4 and word.endswith("e"):
+        word = word[:-1]
+
+    if len(word) >= 4 and word[-1] == word[-2] and word[-1] not in "aeiousy":
+        word = word[:-1]
+
+    return word
+
+
 class TextPreprocessor:
     @staticmethod
     def preprocess(text):
         text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
+        text = PUNCTUATION_RE.sub('', text)
         return text
 
     @staticmethod
@@ -23,3 +80,54 @@ class TextPreprocessor:
     @staticmethod
     def remove_stopwords(tokens):
         return [t for t in tokens if t not in STOP_WORDS and len(t) > 2]
+
+    @staticmethod
+    def stem(token):
+        stemmed = _STEM_TABLE.get(token)
+        if stemmed is None:
+            stemmed = _strip_suffixes(token)
+            if len(_STEM_TABLE) >= TOKEN_TABLE_SIZE:
+                _STEM_TABLE.clear()
+            _STEM_TABLE[token] = stemmed
+        return stemmed
+
+    # -------------------------------------------------
+    # SINGLE-PASS ANALYZER
+    # -------------------------------------------------
+    @staticmethod
+    def analyze(text, stem=False):
+        """
+        preprocess -> tokenize -> remove_stopwords (-> stem) in one pass.
+        Chunks are looked up in a memo table, so the regex only runs on
+        words not seen before.
+        """
+        tokens = []
+        for chunk in text.lower().split():
+            token = _TOKEN_TABLE.get(chunk)
+            if token is None:
+                token = _token(chunk)
+            if token:
+                tokens.append(token)
+
+        if stem:
+            tokens = [TextPreprocessor.stem(t) for t in tokens]
+        return tokens
+
+    @staticmethod
+    def iter_tokens(text, stem=False):
+        """
+        Streaming analyze(): yields tokens without building the cleaned
+        copy of text, for very large inputs
+        """
+        for chunk in CHUNK_RE.finditer(text):
+            token = _token(chunk.group().lower())
+            if token:
+                yield TextPreprocessor.stem(token) if stem else token
+
+    @staticmethod
+    @lru_cache(maxsize=QUERY_CACHE_SIZE)
+    def analyze_query(query, stem=False):
+        """
+        Cached analyze() for query strings; returns a tuple
+        """
+        return tuple(TextPreprocessor.analyze(query, stem))
@@ -0,0 +1,93 @@
+import heapq
+from bisect import bisect_left
+from itertools import accumulate
+
+
+# Upper bounds are inflated slightly so float rounding in the summed
+# contributions can never push a real score above its bound
+BOUND_SLACK = 1 + 1e-9
+
+
+def maxscore_top_k(terms, k, doc_norms):
+    """
+    Document-at-a-time MaxScore over sorted postings.
+
+    terms: iterable of (doc_ids, weights, factor, upper_bound) where a
+    posting contributes factor * weight / doc_norms[doc] to the score and
+    upper_bound is the largest contribution the term can make.
+
+    Returns up to k (doc_num, score) pairs, best first; ties are broken
+    by ascending doc_num, matching an exhaustive sort.
+    """
+    if k <= 0:
+        return []
+
+    terms = sorted(terms, key=lambda t: t[3])
+    n = len(terms)
+    docs = [t[0] for t in terms]
+    weights = [t[1] for t in terms]
+    factors = [t[2] for t in terms]
+    lengths = [len(d) for d in docs]
+    cumulative = list(accumulate(t[3] * BOUND_SLACK for t in terms))
+
+    cursors = [0] * n
+    heap = []
+    threshold = 0.0
+    first_essential = 0
+
+    while first_essential < n:
+        # -------- NEXT CANDIDATE FROM ESSENTIAL TERMS --------
+        doc = None
+        for i in range(first_essential, n):
+            c = cursors[i]
+            if c < lengths[i] and (doc is None or docs[i][c] < doc):
+                doc = docs[i][c]
+
+        if doc is None:
+            break
+
+        norm = doc_norms[doc]
+        inv_norm = 1.0 / norm if norm else 0.0
+
+        score = 0.0
+        for i in range(first_essential, n):
+            c = cursors[i]
+            if c < lengths[i] and docs[i][c] == doc:
+                score += factors[i] * weights[i][c] * inv_norm
+                cursors[i] = c + 1
+
+        if not inv_norm:
+            continue
+
+        # -------- NON-ESSENTIAL TERMS (HIGHEST BOUND FIRST) --------
+        full = len(heap) == k
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if full and score + cumulative[i] <= threshold:
+                pruned = True
+                break
+
+            c = bisect_left(docs[i], doc, cursors[i])
+            if c < lengths[i] and docs[i][c] == doc:
+                score += factors[i] * weights[i][c] * inv_norm
+                c += 1
+            cursors[i] = c
+
+        if pruned:
+            continue
+
+        # -------- HEAP UPDATE --------
+        if not full:
+            heapq.heappush(heap, (score, -doc))
+        elif score > threshold:
+            heapq.heapreplace(heap, (score, -doc))
+        else:
+            continue
+
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < n and cumulative[first_essential] <= threshold:
+                first_essential += 1
+
+    heap.sort(reverse=True)
+    return [(-neg_doc, score) for score, neg_doc in heap]
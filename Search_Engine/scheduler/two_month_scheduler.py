@@ -1,17 +1,69 @@
+from crawler.crawl_state import CrawlStateStore
 from crawler.selenium_crawler import ImprovedSeleniumCrawler
-from indexing.inverted_index2 import AdvancedInvertedIndex
-import json, os
+from indexing.builder import IndexBuilder
+from indexing.inverted_index import AdvancedInvertedIndex
+from utils.helpers import keyed_publications
+from utils.instrumentation import count, instrumentation, stage, trace
+from utils.jsonl import write_jsonl
+import json, os, sys
 
 BASE_URL = "https://pureportal.coventry.ac.uk/en/organisations/ics-research-centre-for-computational-science-and-mathematical-mo"
+INDEX_FILE = "data/index.pkl"
 
-crawler = ImprovedSeleniumCrawler(crawl_delay=3)
-pubs = crawler.crawl_department(BASE_URL, 50)
 
-index = AdvancedInvertedIndex()
-for i, p in enumerate(pubs):
-    index.add_document(i, p)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
 
-index.save("data/index.pkl")
+    # Crawl state survives between runs: unchanged profiles are skipped and
+    # an interrupted run resumes where it stopped
+    state = CrawlStateStore("data/crawl_state.db")
+    run_id = state.begin_run()
 
-with open("data/data.json", "w") as f:
-    json.dump(pubs, f, indent=2)
+    # Phase timings are logged as one JSON line per run when
+    # SEARCH_ENGINE_INSTRUMENTATION=1
+    with trace("scheduled_update", run_id=run_id):
+        crawler = ImprovedSeleniumCrawler(crawl_delay=3, workers=4, state=state)
+        # The state store records each profile's changes as it is parsed,
+        # so the publications need not be kept here
+        with stage("crawl"):
+            for _ in crawler.iter_department(BASE_URL, 50):
+                count("publications_crawled")
+
+        index = AdvancedInvertedIndex(positions=True)
+        changes = state.pending_changes()
+        count("publications_changed", len(changes))
+
+        if "--rebuild" in argv or not index.load(INDEX_FILE):
+            # Full build from every stored publication, across all cores
+            index = IndexBuilder(positions=True).build(
+                keyed_publications(state.publications()), INDEX_FILE
+            )
+            print(f"Index rebuilt: {len(index.documents)} publications")
+        else:
+            # Apply only new, changed and removed publications to the index
+            with stage("index"):
+                for doc_id, change, pub in changes:
+                    if change == "removed":
+                        index.delete_document(doc_id)
+                    else:
+                        index.update_document(doc_id, pub)
+
+            # Recompute idf and every norm, not only those of the
+            # changed documents, so rankings match a full rebuild
+            index.finalize()
+            index.save(INDEX_FILE)
+            print(f"Index sync: {len(changes)} changed publications")
+
+        state.finish_run(run_id)
+
+        with stage("store"):
+            write_jsonl("data/data.jsonl", state.publications())
+
+    if instrumentation.enabled:
+        print(json.dumps(instrumentation.snapshot(), indent=2))
+
+
+# Worker processes of the index builder may import this module; only
+# a direct run crawls
+if __name__ == "__main__":
+    main()
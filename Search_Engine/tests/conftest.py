@@ -0,0 +1,70 @@
+import hashlib
+import os
+import shutil
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Modules import each other as top-level packages (from indexing.x ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves <server.root><path>.html with an ETag of its content; a
+    matching If-None-Match gets a 304. Every (path, status) is appended
+    to server.requests.
+    """
+
+    def do_GET(self):
+        path = os.path.join(self.server.root, *self.path.strip("/").split("/")) + ".html"
+        if not os.path.isfile(path):
+            self._reply(404)
+            return
+
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, etag=etag)
+        else:
+            self._reply(200, body, etag)
+
+    def _reply(self, status, body=b"", etag=None):
+        self.server.requests.append((self.path, status))
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        if status != 304:
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fixture_server(tmp_path):
+    """
+    Local stand-in for PurePortal serving a copy of tests/fixtures, which
+    tests may edit; server.base_url is its http://host:port
+    """
+    root = tmp_path / "site"
+    shutil.copytree(FIXTURES, root)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.root = str(root)
+    server.requests = []
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,54 @@
+import pytest
+
+from benchmarks.corpus import SyntheticCorpus
+from indexing.builder import IndexBuilder
+from indexing.inverted_index import AdvancedInvertedIndex
+
+
+CORPUS = SyntheticCorpus(900, seed=8)
+QUERIES = CORPUS.queries(100) + ["replaced", "replaced model data"]
+
+
+def documents():
+    """
+    The corpus with every 20th document replaced later in the stream
+    """
+    docs = list(CORPUS)
+    return docs + [
+        (doc_id, dict(doc_data, title="replaced " + doc_data["title"]))
+        for doc_id, doc_data in docs[::20]
+    ]
+
+
+@pytest.fixture(scope="module")
+def expected():
+    index = AdvancedInvertedIndex(positions=True, cache_size=0)
+    index.add_documents(iter(documents()))
+    index.finalize()
+    return index
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+@pytest.mark.parametrize("to_file", [False, True])
+def test_built_index_ranks_as_added_documents(expected, tmp_path, processes, to_file):
+    builder = IndexBuilder(
+        processes=processes, memory_budget=200_000, block_size=150,
+        positions=True, temp_dir=str(tmp_path),
+    )
+    path = str(tmp_path / "index.seg") if to_file else None
+    index = builder.build(iter(documents()), path)
+    try:
+        assert list(index.doc_keys) == list(expected.doc_keys)
+        assert list(index.doc_norms) == list(expected.doc_norms)
+        for doc_id in expected.doc_keys[::50]:
+            assert index.documents[doc_id] == expected.documents[doc_id]
+        for query in QUERIES:
+            for k, filters in ((None, None), (10, {"year": [2019, 2020]})):
+                assert list(index.search(query, k=k, filters=filters)) == list(
+                    expected.search(query, k=k, filters=filters)
+                ), query
+        assert list(index.search('"replaced model"', k=5)) == list(
+            expected.search('"replaced model"', k=5)
+        )
+    finally:
+        index.close()
@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import FIXTURES
+from crawler.crawl_state import CrawlStateStore
+from crawler.selenium_crawler import ImprovedSeleniumCrawler
+
+
+DEPARTMENT = "/en/organisations/test-centre"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALICE = os.path.join(FIXTURES, "en", "persons", "alice.html")
+
+
+def crawl(server, state):
+    crawler = ImprovedSeleniumCrawler(crawl_delay=0, workers=1, state=state)
+    return list(crawler.iter_department(server.base_url + DEPARTMENT))
+
+
+def test_profile_fetched_before_a_crash_is_recrawled(fixture_server, tmp_path, monkeypatch):
+    state = CrawlStateStore(str(tmp_path / "state.db"))
+    record_profile = state.record_profile
+
+    def crash_on_bob(run_id, profile_url, publications, page=None):
+        if profile_url.endswith("/bob"):
+            raise RuntimeError("crawler killed")
+        return record_profile(run_id, profile_url, publications, page)
+
+    monkeypatch.setattr(state, "record_profile", crash_on_bob)
+    with pytest.raises(RuntimeError):
+        crawl(fixture_server, state)
+    monkeypatch.undo()
+
+    # The resumed run skips Alice, who was recorded, and fetches Bob's
+    # page in full again
+    fixture_server.requests.clear()
+    crawl(fixture_server, state)
+    assert ("/en/persons/alice", 200) not in fixture_server.requests
+    assert ("/en/persons/bob", 200) in fixture_server.requests
+
+    titles = {pub["title"] for _, change, pub in state.pending_changes()}
+    assert "Graph learning" in titles
+    state.close()
+
+
+def test_unchanged_profiles_are_skipped_on_the_next_run(fixture_server, tmp_path):
+    state = CrawlStateStore(str(tmp_path / "state.db"))
+    run_id = state.begin_run()
+    crawl(fixture_server, state)
+    state.finish_run(run_id)
+
+    fixture_server.requests.clear()
+    run_id = state.begin_run()
+    assert crawl(fixture_server, state) == []
+    assert ("/en/persons/alice", 304) in fixture_server.requests
+    assert ("/en/persons/bob", 304) in fixture_server.requests
+    assert state.pending_changes() == []
+    state.close()
+
+
+
+def test_authors_are_listed_in_a_stable_order():
+    # Set iteration order depends on the hash seed of the process
+    script = (
+        "from crawler.selenium_crawler import ImprovedSeleniumCrawler;"
+        f"html = open({ALICE!r}, encoding='utf-8').read();"
+        "crawler = ImprovedSeleniumCrawler(crawl_delay=0);"
+        "print([p['authors'] for p in crawler.parse_author_page(html, 'http://x/')])"
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True,
+            check=True, cwd=ROOT, env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        ).stdout
+        for seed in range(4)
+    }
+    assert len(outputs) == 1
+
+
+def crawl_with_slow_profile(server, state, slow):
+    """
+    Crawl with two workers, the profile ending in slow fetched last
+    """
+    crawler = ImprovedSeleniumCrawler(crawl_delay=0, workers=2, state=state)
+    fetch = crawler.fetcher.fetch
+
+    def delayed_fetch(url, *args, **kwargs):
+        if url.endswith(slow):
+            time.sleep(0.3)
+        return fetch(url, *args, **kwargs)
+
+    crawler.fetcher.fetch = delayed_fetch
+    return list(crawler.iter_department(server.base_url + DEPARTMENT))
+
+
+@pytest.mark.parametrize("slow", ["/alice", "/bob"])
+def test_shared_publication_is_kept_from_the_lowest_profile(fixture_server, slow):
+    publications = crawl_with_slow_profile(fixture_server, None, slow)
+    shared = [p for p in publications if p["title"] == "Fluid dynamics of thin films"]
+    assert len(shared) == 1
+    assert shared[0]["profile_link"].endswith("/alice")
+    assert [p["profile_link"] for p in publications] == sorted(
+        p["profile_link"] for p in publications
+    )
+
+
+@pytest.mark.parametrize("slow", ["/alice", "/bob"])
+def test_shared_publication_changes_carry_the_lowest_profile(fixture_server, tmp_path, slow):
+    state = CrawlStateStore(str(tmp_path / "state.db"))
+    crawl_with_slow_profile(fixture_server, state, slow)
+    shared = [
+        pub for _, change, pub in state.pending_changes()
+        if pub["title"] == "Fluid dynamics of thin films"
+    ]
+    assert [pub["profile_link"] for pub in shared] == [fixture_server.base_url + "/en/persons/alice"]
+    state.close()
@@ -0,0 +1,110 @@
+import pytest
+
+from crawler.fetchers import FallbackFetcher, FetchError, HttpFetcher, Page
+from crawler.selenium_crawler import _has_publications
+
+
+class RenderingFetcher:
+    """
+    Stand-in for SeleniumFetcher: returns a rendered page and records
+    the URLs it was asked for
+    """
+
+    HTML = '<h1>Carol White</h1><a href="/en/publications/rendered">Rendered</a>'
+
+    def __init__(self):
+        self.urls = []
+
+    def fetch(self, url, required=None, conditional=True):
+        self.urls.append(url)
+        return Page(url, self.HTML, 200, False)
+
+    def close(self):
+        pass
+
+
+def test_fetch_returns_page_with_validators(fixture_server):
+    fetcher = HttpFetcher()
+    url = fixture_server.base_url + "/en/persons/alice"
+    page = fetcher.fetch(url)
+
+    assert page.status == 200 and not page.not_modified
+    assert "Fluid dynamics of thin films" in page.html
+    assert page.etag and fetcher.validators[url][0] == page.etag
+    fetcher.close()
+
+
+def test_unchanged_page_is_a_304_with_the_stored_body(fixture_server):
+    fetcher = HttpFetcher()
+    url = fixture_server.base_url + "/en/persons/alice"
+    first = fetcher.fetch(url)
+    second = fetcher.fetch(url)
+
+    assert second.status == 304 and second.not_modified
+    assert second.html == first.html
+    assert fixture_server.requests == [
+        ("/en/persons/alice", 200), ("/en/persons/alice", 304),
+    ]
+    fetcher.close()
+
+
+def test_changed_page_is_fetched_again(fixture_server):
+    fetcher = HttpFetcher()
+    url = fixture_server.base_url + "/en/persons/bob"
+    fetcher.fetch(url)
+
+    path = f"{fixture_server.root}/en/persons/bob.html"
+    with open(path, encoding="utf-8") as f:
+        html = f.read().replace("Graph learning", "Graph learning at scale")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+    page = fetcher.fetch(url)
+    assert page.status == 200 and "Graph learning at scale" in page.html
+    fetcher.close()
+
+
+def test_unconditional_fetch_ignores_validators(fixture_server):
+    fetcher = HttpFetcher()
+    url = fixture_server.base_url + "/en/persons/alice"
+    fetcher.fetch(url)
+    assert fetcher.fetch(url, conditional=False).status == 200
+    fetcher.close()
+
+
+def test_missing_page_raises(fixture_server):
+    fetcher = HttpFetcher(retries=0)
+    with pytest.raises(FetchError):
+        fetcher.fetch(fixture_server.base_url + "/en/persons/nobody")
+    fetcher.close()
+
+
+def test_fallback_only_for_pages_missing_required_content(fixture_server):
+    fallback = RenderingFetcher()
+    fetcher = FallbackFetcher(HttpFetcher(retries=0), fallback)
+    base = fixture_server.base_url
+
+    page = fetcher.fetch(base + "/en/persons/alice", required=_has_publications)
+    assert page.status == 200 and fallback.urls == []
+
+    # Carol's publications are rendered client-side
+    page = fetcher.fetch(base + "/en/persons/carol", required=_has_publications)
+    assert fallback.urls == [base + "/en/persons/carol"]
+    assert page.html == RenderingFetcher.HTML
+    assert page.etag is not None
+
+    # So is a page the primary cannot fetch
+    fetcher.fetch(base + "/en/persons/nobody", required=_has_publications)
+    assert fallback.urls[-1] == base + "/en/persons/nobody"
+    fetcher.close()
+
+
+def test_not_modified_page_skips_the_fallback(fixture_server):
+    fallback = RenderingFetcher()
+    fetcher = FallbackFetcher(HttpFetcher(), fallback)
+    url = fixture_server.base_url + "/en/persons/carol"
+
+    fetcher.fetch(url, required=_has_publications)
+    page = fetcher.fetch(url, required=_has_publications)
+    assert page.not_modified and len(fallback.urls) == 1
+    fetcher.close()
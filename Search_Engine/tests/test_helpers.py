@@ -0,0 +1,42 @@
+from crawler.crawl_state import CrawlStateStore, content_hash
+from indexing.inverted_index import AdvancedInvertedIndex
+from utils.helpers import make_doc_id, publication_content
+
+
+PUBLICATION = {
+    "title": "Graph learning",
+    "authors": ["Bob Jones", "Alice Smith", "Dan Brown"],
+    "year": 2022,
+    "publication_link": "https://pureportal.example/en/publications/graph-learning",
+    "crawled_at": "2024-01-01T00:00:00",
+}
+
+REORDERED = dict(
+    PUBLICATION,
+    authors=["Dan Brown", "Bob Jones", "Alice Smith"],
+    crawled_at="2024-03-01T00:00:00",
+)
+
+
+def test_author_order_and_crawl_time_are_not_content():
+    assert publication_content(PUBLICATION) == publication_content(REORDERED)
+    assert content_hash(PUBLICATION) == content_hash(REORDERED)
+    assert publication_content(PUBLICATION) != publication_content(
+        dict(PUBLICATION, authors=["Bob Jones"])
+    )
+
+
+def test_sync_documents_ignores_reordered_authors():
+    index = AdvancedInvertedIndex()
+    doc_id = make_doc_id(PUBLICATION)
+    assert index.sync_documents({doc_id: PUBLICATION}) == (1, 0, 0)
+    assert index.sync_documents({doc_id: REORDERED}) == (0, 0, 0)
+
+
+def test_record_profile_ignores_reordered_authors(tmp_path):
+    state = CrawlStateStore(str(tmp_path / "state.db"))
+    run_id = state.begin_run()
+    profile = "https://pureportal.example/en/persons/bob"
+    assert state.record_profile(run_id, profile, [PUBLICATION]) == 1
+    assert state.record_profile(run_id, profile, [REORDERED]) == 0
+    state.close()
@@ -0,0 +1,76 @@
+import pytest
+
+from benchmarks.corpus import SyntheticCorpus
+from indexing import sparse_backend
+from indexing.inverted_index import AdvancedInvertedIndex
+
+
+BACKENDS = ["python"] + (["sparse"] if sparse_backend.AVAILABLE else [])
+
+CORPUS = SyntheticCorpus(1250, seed=21)
+QUERIES = CORPUS.queries(200)
+
+
+def crawls():
+    """
+    The first crawl and a later one with 50 new, 30 changed and 20
+    removed publications
+    """
+    documents = list(CORPUS)
+    first = dict(documents[:1200])
+    second = dict(documents[20:])
+    for doc_id in list(second)[:30]:
+        second[doc_id] = dict(second[doc_id], title="revised " + second[doc_id]["title"])
+    return first, second
+
+
+def rebuilt(index, backend):
+    """
+    Index of the same documents, built from scratch in the same order
+    """
+    fresh = AdvancedInvertedIndex(backend=backend, cache_size=0)
+    for doc_id in index.doc_keys:
+        fresh.add_document(doc_id, index.documents[doc_id])
+    fresh.finalize()
+    return fresh
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_synced_index_ranks_as_a_rebuild(backend, tmp_path):
+    first, second = crawls()
+    path = str(tmp_path / "index.seg")
+
+    index = AdvancedInvertedIndex(backend=backend, cache_size=0)
+    assert index.sync_documents(first) == (1200, 0, 0)
+    index.finalize()
+    index.save(path)
+
+    # As the app and the scheduler update it
+    index = AdvancedInvertedIndex(backend=backend, cache_size=0)
+    assert index.load(path)
+    assert index.sync_documents(second) == (50, 30, 20)
+    index.finalize()
+    index.save(path)
+
+    loaded = AdvancedInvertedIndex(backend=backend, cache_size=0)
+    assert loaded.load(path)
+    expected = rebuilt(loaded, backend)
+    try:
+        assert list(loaded.doc_norms) == list(expected.doc_norms)
+        for query in QUERIES + ["revised"]:
+            assert list(loaded.search(query, k=10)) == list(expected.search(query, k=10)), query
+    finally:
+        loaded.close()
+
+
+def test_top_k_counts_hits_without_pending_deletions():
+    index = AdvancedInvertedIndex(backend="python", cache_size=0)
+    for doc_id, doc_data in CORPUS:
+        index.add_document(doc_id, doc_data)
+    index.finalize()
+    for doc_id in index.doc_keys[::7]:
+        index.delete_document(doc_id)
+
+    # Counted over the posting lists before finalize() drops the deletions
+    for query in QUERIES[:50]:
+        assert index.search(query, k=5).total_hits == index.search(query).total_hits, query
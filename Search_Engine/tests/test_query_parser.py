@@ -0,0 +1,52 @@
+import pytest
+
+from indexing.inverted_index import AdvancedInvertedIndex
+from indexing.query_parser import And, Not, Optional, Or, Term, parse_query
+
+
+DOCUMENTS = {
+    "a": {"title": "Smith survey of fluid dynamics", "authors": ["Ann Smith"], "year": 2020},
+    "b": {"title": "A survey of graph learning", "authors": ["Bo Li"], "year": 2021},
+    "c": {"title": "Smith numerical methods", "authors": ["Cy Smith"], "year": 2022},
+    "d": {"title": "Fluid flow in pipes", "authors": ["Di Wu"], "year": 2023},
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = AdvancedInvertedIndex(positions=True)
+    for doc_id, doc_data in DOCUMENTS.items():
+        index.add_document(doc_id, doc_data)
+    index.finalize()
+    return index
+
+
+def ids(results):
+    return sorted(hit.doc_id for hit in results)
+
+
+def test_plain_terms_next_to_not_stay_required():
+    assert parse_query("smith NOT survey").match == And(
+        (Term(None, "smith"), Not(Term(None, "survey")))
+    )
+    assert parse_query("smith fluid NOT survey").match == And(
+        (Or((Term(None, "smith"), Term(None, "fluid"))), Not(Term(None, "survey")))
+    )
+
+
+def test_plain_terms_next_to_required_parts_only_rank():
+    assert parse_query("author:smith fluid NOT survey").match == And(
+        (Term("authors", "smith"), Optional(Term(None, "fluid")), Not(Term(None, "survey")))
+    )
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("smith NOT survey", ["c"]),
+    ("NOT survey smith", ["c"]),
+    ("smith fluid NOT survey", ["c", "d"]),
+    ("NOT survey", ["c", "d"]),
+    ("author:smith NOT survey", ["c"]),
+    ("fluid NOT (smith OR pipes)", []),
+])
+def test_not_excludes_from_the_other_terms(index, query, expected):
+    assert ids(index.search(query)) == expected
@@ -0,0 +1,91 @@
+import math
+import random
+
+import pytest
+
+from benchmarks.corpus import SyntheticCorpus
+from indexing import sparse_backend
+from indexing.bm25f import BM25F
+from indexing.inverted_index import AdvancedInvertedIndex
+from indexing.sharding import ShardedIndex
+
+
+BACKENDS = ["python"] + (["sparse"] if sparse_backend.AVAILABLE else [])
+
+CORPUS = SyntheticCorpus(1500, seed=3)
+
+
+def multi_term_queries(n=60):
+    """
+    Pairs and triples mixing common and rare words, so that some shards
+    lack some of the query terms
+    """
+    rng = random.Random(5)
+    common = CORPUS.vocabulary[20:200]
+    rare = CORPUS.vocabulary[-2000:]
+    return [
+        " ".join([rng.choice(common)] + rng.sample(rare, rng.choice((1, 2))))
+        for _ in range(n)
+    ] + ["ceviso deor", "podialre canorafi", "inropi dynamics"]
+
+
+def assert_same_ranking(single, sharded):
+    assert sharded.total_hits == single.total_hits
+    assert [h.doc_id for h in sharded] == [h.doc_id for h in single]
+    for a, b in zip(sharded, single):
+        assert math.isclose(a.score, b.score, rel_tol=1e-9)
+
+
+@pytest.fixture(scope="module", params=BACKENDS)
+def indexes(request, tmp_path_factory):
+    single = AdvancedInvertedIndex(backend=request.param)
+    for doc_id, doc_data in CORPUS:
+        single.add_document(doc_id, doc_data)
+    single.finalize()
+
+    sharded = ShardedIndex(num_shards=4, backend=request.param)
+    assert sharded.build(iter(CORPUS), str(tmp_path_factory.mktemp("shards")))
+    yield single, sharded
+    sharded.close()
+
+
+@pytest.mark.parametrize("k", [None, 3, 10])
+@pytest.mark.parametrize("filters", [None, {"year": [2020, 2021, 2022]}])
+def test_multi_term_queries_rank_as_single_index(indexes, k, filters):
+    single, sharded = indexes
+    for query in multi_term_queries():
+        assert_same_ranking(
+            single.search(query, k=k, filters=filters),
+            sharded.search(query, k=k, filters=filters),
+        )
+
+
+def test_bm25f_ranks_as_single_index(indexes):
+    single, sharded = indexes
+    bm25f = BM25F()
+    for query in multi_term_queries(20):
+        assert_same_ranking(
+            single.search(query, k=10, bm25f=bm25f),
+            sharded.search(query, k=10, bm25f=bm25f),
+        )
+
+
+def test_build_from_stream_with_replaced_documents(tmp_path):
+    documents = list(SyntheticCorpus(300, seed=4))
+    documents += [
+        (doc_id, dict(doc_data, title="replaced " + doc_data["title"]))
+        for doc_id, doc_data in documents[::25]
+    ]
+
+    single = AdvancedInvertedIndex()
+    single.add_documents(iter(documents))
+    single.finalize()
+
+    sharded = ShardedIndex(num_shards=3)
+    assert sharded.build(iter(documents), str(tmp_path))
+    try:
+        assert len(sharded) == len(single.documents)
+        for query in ["replaced", "replaced model data"] + multi_term_queries(10):
+            assert_same_ranking(single.search(query), sharded.search(query))
+    finally:
+        sharded.close()
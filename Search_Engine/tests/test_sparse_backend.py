@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+from benchmarks.corpus import SyntheticCorpus
+from indexing.inverted_index import AdvancedInvertedIndex
+
+
+CORPUS = SyntheticCorpus(2000, seed=11)
+
+QUERIES = CORPUS.queries(150) + [
+    "model data analysis", "fluid dynamics", "learning learning network",
+    "the of and", "no-such-term", "no-such-term network",
+]
+
+
+def build(backend):
+    index = AdvancedInvertedIndex(backend=backend, cache_size=0)
+    for doc_id, doc_data in CORPUS:
+        index.add_document(doc_id, doc_data)
+    index.finalize()
+    return index
+
+
+@pytest.fixture(scope="module")
+def indexes():
+    return build("python"), build("sparse")
+
+
+@pytest.mark.parametrize("k", [None, 1, 10, 100])
+def test_sparse_backend_ranks_as_python_backend(indexes, k):
+    python, sparse = indexes
+    for query in QUERIES:
+        expected = python.search(query, k=k)
+        results = sparse.search(query, k=k)
+        assert results.total_hits == expected.total_hits, query
+        assert list(results) == list(expected), query
+
+
+def test_backends_agree_on_norms_and_bounds(indexes):
+    python, sparse = indexes
+    assert list(sparse.doc_norms) == list(python.doc_norms)
+    for term, postings in python.index.items():
+        assert sparse.index[term].idf == postings.idf
+        assert sparse.index[term].max_score == postings.max_score
+
+
+def test_loaded_segment_ranks_as_built_index(indexes, tmp_path):
+    python, _ = indexes
+    path = str(tmp_path / "index.seg")
+    python.save(path)
+    for backend in ("python", "sparse"):
+        loaded = AdvancedInvertedIndex(backend=backend, cache_size=0)
+        assert loaded.load(path)
+        try:
+            for query in QUERIES:
+                for k in (None, 10):
+                    expected = python.search(query, k=k)
+                    results = loaded.search(query, k=k)
+                    assert results.total_hits == expected.total_hits, query
+                    assert list(results) == list(expected), query
+        finally:
+            loaded.close()
@@ -1,4 +1,43 @@
+import hashlib
+
+
+# Fields that change on every crawl without the publication changing
+VOLATILE_FIELDS = ("crawled_at",)
+
+
 def paginate(results, page, size):
     start = (page-1)*size
     end = page*size
     return results[start:end]
+
+
+def make_doc_id(publication):
+    """
+    Stable document id for a crawled publication, derived from its
+    PurePortal link (title as a fallback) so recrawls map onto the
+    same index entry
+    """
+    key = publication.get("publication_link") or publication.get("title", "")
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def keyed_publications(publications):
+    """
+    Yield (doc_id, publication) pairs for a stream of publications
+    """
+    for publication in publications:
+        yield make_doc_id(publication), publication
+
+
+def publication_content(publication):
+    """
+    Publication fields that identify a real change between crawls, with
+    authors sorted: their order carries no meaning and older crawls
+    stored them in set order
+    """
+    content = {
+        k: v for k, v in publication.items() if k not in VOLATILE_FIELDS
+    }
+    if isinstance(content.get("authors"), list):
+        content["authors"] = sorted(content["authors"])
+    return content
@@ -0,0 +1,284 @@
+"""
+Opt-in timings and counters.
+
+    from utils.instrumentation import instrumentation, stage, trace, count
+
+    with trace("search", query=query):     # one record per operation
+        with stage("postings"):            # time spent in a part of it
+            ...
+        count("postings_scanned", n)
+
+Disabled (the default) every call is a flag check. Enabled, stage and
+trace durations are aggregated into log-scale histograms, counters are
+summed, and each finished trace becomes a structured record: kept in a
+ring of recent traces and logged as one JSON line on the
+"search_engine.instrumentation" logger. Set SEARCH_ENGINE_INSTRUMENTATION=1
+or call instrumentation.enable() to turn it on.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+
+ENV_VAR = "SEARCH_ENGINE_INSTRUMENTATION"
+
+# Finished traces kept for inspection
+RECENT_TRACES = 200
+
+# Histogram bucket i counts durations in [2**(i-1), 2**i) microseconds;
+# the last bucket also takes everything longer (~9 minutes and up)
+NUM_BUCKETS = 30
+
+logger = logging.getLogger("search_engine.instrumentation")
+
+_NULL = nullcontext()
+
+
+class Histogram:
+    """
+    Log-scale duration histogram; percentiles are bucket upper bounds
+    """
+
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * NUM_BUCKETS
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[min(bucket, NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((2 ** bucket) / 1e6, self.max)
+        return self.max
+
+    def distribution(self):
+        """
+        [(bucket upper bound in ms, count)] from the first to the last
+        non-empty bucket
+        """
+        used = [b for b, n in enumerate(self.buckets) if n]
+        if not used:
+            return []
+        return [
+            ((2 ** b) / 1000, self.buckets[b])
+            for b in range(used[0], used[-1] + 1)
+        ]
+
+    def summary(self):
+        """
+        Milliseconds: count, total, mean, min, p50, p90, p99, max
+        """
+        ms = lambda s: None if s is None else 1000 * s
+        return {
+            "count": self.count,
+            "total_ms": ms(self.total),
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "min_ms": ms(self.min),
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max),
+        }
+
+
+class _Stage:
+    __slots__ = ("_owner", "_name", "_start")
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._owner._record_stage(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _Trace:
+    __slots__ = ("_owner", "record", "_start")
+
+    def __init__(self, owner, event, fields):
+        self._owner = owner
+        self.record = {"event": event, **fields, "stages": {}, "counters": {}}
+
+    def __enter__(self):
+        self._owner._stack().append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        self._owner._stack().pop()
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        self._owner._finish(self.record, duration)
+        return False
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.log = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def enable(self, log=True):
+        """
+        Start recording. With log set, finished traces are logged at INFO
+        level; a plain handler is added if the logger has none.
+        """
+        self.log = log
+        if log:
+            logger.setLevel(logging.INFO)
+            if not logger.handlers:
+                handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.events = {}
+            self.stages = {}
+            self.counters = {}
+            self.recent = deque(maxlen=RECENT_TRACES)
+
+    # -------- RECORDING --------
+    def stage(self, name):
+        """
+        Context manager timing one stage of the current trace
+        """
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def trace(self, event, **fields):
+        """
+        Context manager recording one operation (a search, a crawl) with
+        its stages and counters; fields are added to its record
+        """
+        if not self.enabled:
+            return _NULL
+        return _Trace(self, event, fields)
+
+    def timed(self, name):
+        """
+        Decorator timing every call of a function as stage name
+        """
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        stack = self._stack()
+        if stack:
+            counters = stack[-1].record["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record_stage(self, name, seconds):
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+            histogram.observe(seconds)
+
+        stack = self._stack()
+        if stack:
+            stages = stack[-1].record["stages"]
+            stages[name] = stages.get(name, 0.0) + 1000 * seconds
+
+    def _finish(self, record, seconds):
+        record["duration_ms"] = 1000 * seconds
+        with self._lock:
+            histogram = self.events.get(record["event"])
+            if histogram is None:
+                histogram = self.events[record["event"]] = Histogram()
+            histogram.observe(seconds)
+            self.recent.append(record)
+
+        if self.log:
+            logger.info(json.dumps(record, default=str))
+
+    # -------- REPORTING --------
+    def snapshot(self):
+        """
+        {"events": {event: histogram summary}, "stages": {stage: summary},
+        "counters": {name: total}}
+        """
+        with self._lock:
+            return {
+                "events": {name: h.summary() for name, h in self.events.items()},
+                "stages": {name: h.summary() for name, h in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def distribution(self, name):
+        """
+        Histogram.distribution() of event or stage name
+        """
+        with self._lock:
+            histogram = self.events.get(name) or self.stages.get(name)
+            return histogram.distribution() if histogram else []
+
+    def slowest(self, event=None, n=10):
+        """
+        The n slowest recent trace records, of event if given
+        """
+        with self._lock:
+            records = [r for r in self.recent if event is None or r["event"] == event]
+        return sorted(records, key=lambda r: -r["duration_ms"])[:n]
+
+
+instrumentation = Instrumentation()
+if os.environ.get(ENV_VAR) == "1":
+    instrumentation.enable()
+
+stage = instrumentation.stage
+trace = instrumentation.trace
+timed = instrumentation.timed
+count = instrumentation.count
@@ -0,0 +1,88 @@
+"""
+JSON Lines files: one JSON object per line.
+
+Records are written as they arrive and flushed line by line, so a crawl
+that dies part way keeps everything written before the crash, and files
+are read back one line at a time in constant memory.
+"""
+
+import json
+import os
+
+
+# Suffix of the file being written; renamed onto the target on success
+PARTIAL_SUFFIX = ".part"
+
+
+class JsonlWriter:
+    """
+    Appends records to path + PARTIAL_SUFFIX, flushing each one, and
+    replaces path with it on close. Leaving the with block through an
+    exception keeps the partial file and leaves path untouched.
+
+        with JsonlWriter("data/publications.jsonl") as writer:
+            for pub in writer.tee(crawler.iter_department(url)):
+                index.add_document(make_doc_id(pub), pub)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.partial_path, "w", encoding="utf-8")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def tee(self, records):
+        """
+        Yield records unchanged, writing each one first
+        """
+        for record in records:
+            self.write(record)
+            yield record
+
+    def close(self, commit=True):
+        if self._file.closed:
+            return
+        self._file.close()
+        if commit:
+            os.replace(self.partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+        return False
+
+
+def write_jsonl(path, records):
+    """
+    Write records to path (see JsonlWriter); returns the record count
+    """
+    with JsonlWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+def iter_jsonl(path):
+    """
+    Yield the records of a JSON Lines file one at a time. A truncated
+    last line, as left by a crash mid-write, is skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise ValueError(f"{path}:{line_no}: invalid JSON line")